@@ -1,45 +1,219 @@
+import time
+_import_start_time = time.perf_counter()
+import concurrent.futures
+import functools
+import itertools
+import json
 import os
+import queue
 import shutil
+import threading
 
-from openai import OpenAI
+# Heavy dependencies (openai, pandas, the google cloud clients, pyaudio, vlc) are imported when the subsystem that
+# needs them is created, so terminal mode never loads the media stack
 from assistant import GPTAssistant
-import pandas as pd
 import utils
+import ratelimit
+import tasks
+import tracing
+from content_catalog import EpisodeCatalog, question_rows
+from history_store import LearningHistoryStore, read_learning_history, export_to_excel
+from cassette import (Cassette, record_session, record_assistant, record_stt, record_tts, ReplayAssistant,
+                      ReplaySTTClient, ReplayTTSClient)
 from tool_functions import (generate_feedback_pretest_function_json, select_question_function_json,
                             generate_feedback_function_json, simplify_question_function_json)
-
-from multimedia.TTS import TTSClient
-from multimedia.STT import STTStreamingClient
-from multimedia.video_player import VideoPlayer
 import yaml
-import time
 import logging
 import argparse
 import glob
+_core_import_duration = time.perf_counter() - _import_start_time
 
 
 class AdaptiveCA:
-    def __init__(self, config_file="configs/sample_config.yaml", text_only=False):
-        with open(config_file) as f:
-            self.config = yaml.safe_load(f)
+    def __init__(self, config_file="configs/sample_config.yaml", text_only=False, pretest_only=False,
+                 profile_startup=False, resume_dir=None, trace=False, record=False, replay=None, replay_speed=1.):
+        self.profiler = utils.StartupProfiler()
+        self.profiler.add("core", "import", _core_import_duration)
+        with self.profiler.measure("config", "init"):
+            with open(config_file) as f:
+                self.config = yaml.safe_load(f)
         # Mainly for testing. I/O will be through console
         self.text_IO = text_only
-        self.learning_history = {}
+        # Pretest doesn't need the episode videos
+        self.pretest_only = pretest_only
+        # Resuming: same log folder, thread, learning history and position in the session as the checkpoint
+        self.checkpoint = self._load_checkpoint(resume_dir) if resume_dir else None
+        self.resumed_program = self.checkpoint["program"] if self.checkpoint else None
+        # Latency budget of the assistant's answers in a turn, past it a local fallback is used
+        turn_settings = self.config.get("turn_settings", {})
+        self.latency_budget = turn_settings.get("latency_budget")
+        self.fallback_accuracy = turn_settings.get("fallback_accuracy", 0.5)
+        self._fallback_feedback = itertools.cycle(turn_settings.get("fallback_feedback",
+                                                                    ["Thank you for your answer!"]))
+        # Assistant calls under a latency budget run here, so the turn can move on while a late one finishes
+        self.assistant_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="assistant")
+        self.grading_executor = None
+        # Feedback tool calls are streamed, the evaluation is spoken as soon as the model has generated it
+        self.stream_feedback = turn_settings.get("stream_feedback", False)
+        # deferred: pretest answers get a local neutral feedback right away and are graded for accuracy in the
+        # background (grading_workers at a time, each on its own assistant thread). immediate: the assistant gives the
+        # feedback and accuracy before the next question
+        self.pretest_grading = turn_settings.get("pretest_grading", "immediate")
+        self.grading_workers = turn_settings.get("grading_workers", 4)
+        self._init_session_state()
 
-        self._init_logging()
-        self._sanity_check()
-        self._retrieve_episode_content()
+        with self.profiler.measure("logging", "init"):
+            self._init_logging()
+        # Span tracing of every turn (assistant HTTP calls, TTS, STT, video switches), saved by save_trace()
+        if trace or self.config["logging"].get("trace", False):
+            tracing.get_tracer().enable()
+        # Background tasks (speech, learning history export) share one bounded pool, failures go to the session log
+        tasks.get_executor().configure(max_workers=self.config.get("background_tasks", {}).get("max_workers"),
+                                       logger=self.logger)
+        # Every OpenAI/TTS/STT request goes through its service's shared rate limiter, background work yields to
+        # the requests the child is waiting for
+        ratelimit.configure(self.config.get("rate_limits"), logger=self.logger)
+        self._init_cassette(record or self.config["logging"].get("record_cassette", False), replay, replay_speed)
+        # Append mode, a resumed session keeps adding to the same store
+        self.history_store = LearningHistoryStore(os.path.join(
+            self.logging_root_dir, self.config["logging"].get("learning_history_store", "learning_history.jsonl")))
+        with self.profiler.measure("sanity_check", "init"):
+            self._sanity_check()
+        with self.profiler.measure("episode_content", "init"):
+            self._retrieve_episode_content()
         self._initialize_assistant()
-        self._init_multimedia_module()
+        # No speakers, microphone or video in terminal mode
+        self.tts_client, self.stt_client, self.video_player, self.barge_in_listener = None, None, None, None
+        if not self.text_IO:
+            self._init_multimedia_module()
+        elif self.cassette and self.cassette.replaying:
+            # Terminal replay: the recorded answers instead of typing them
+            self.stt_client = ReplaySTTClient(self.cassette, logger=self.logger)
+        if self.cassette and not self.cassette.replaying:
+            record_assistant(self.cassette, self.assistant)
+            if self.stt_client:
+                record_stt(self.cassette, self.stt_client, self.barge_in_listener)
+            if self.tts_client:
+                record_tts(self.cassette, self.tts_client)
+        if profile_startup:
+            self.logger.info(self.profiler.report())
+
+    def _init_session_state(self):
+        # Everything that belongs to one child's session (see new_session), the clients and content are shared
+        self.learning_history = self.checkpoint["learning_history"] if self.checkpoint else {}
+        self.position = self.checkpoint["position"] if self.checkpoint else {"section": None}
+        self.program = self.resumed_program
+        self.fallback_counts = self.checkpoint.get("fallback_counts", {}) if self.checkpoint else {}
+        # Seconds from the end of the child's answer to the feedback being sent to TTS, one per turn
+        self.answer_to_feedback = []
+        # Story part being discussed, part of the summary a rolled over assistant thread starts from
+        self.current_story = None
+        self._graders = threading.local()
+        self._pending_grades = {}
+        # By pretest question index, kept next to the pretest records (not in them): the id of the answer's turn in
+        # the history store, and its accuracy (None until graded)
+        self.pretest_record_ids = self.checkpoint.get("pretest_record_ids", []) if self.checkpoint else []
+        self.pretest_accuracy = self.checkpoint.get("pretest_accuracy", []) if self.checkpoint else []
+        # (on_late, json responses, latency) of the assistant's late answers, handled on the main thread
+        self._late_results = queue.SimpleQueue()
+        self._turn_start = time.perf_counter()
+        self._answer_time = time.perf_counter()
+        # Set by new_session, the time to the session's first spoken line is logged
+        self.session_requested_at = None
+
+    def new_session(self, child_id, thread=None):
+        # Start another child's session on the clients that are already initialized (daemon mode, see kiosk.py):
+        # only the log folder (and its cassette when recording), the assistant thread, the learning history and the
+        # position in the session are new.
+        # thread: an assistant thread created ahead of time, otherwise one is created here
+        requested_at = time.perf_counter()
+        self.config["childID"] = child_id
+        self.checkpoint, self.resumed_program = None, None
+        self._init_session_state()
+        self.session_requested_at = requested_at
+        # The previous session's log records are flushed to its own folder
+        utils.stop_queue_logging(self.log_listener)
+        self._init_logging()
+        tasks.get_executor().configure(logger=self.logger)
+        # The rate limiter report logged by finish_session is the session's own
+        ratelimit.reset_stats()
+        tracing.get_tracer().clear()
+        self.history_store = LearningHistoryStore(os.path.join(
+            self.logging_root_dir, self.config["logging"].get("learning_history_store", "learning_history.jsonl")))
+        self.assistant.new_thread(thread)
+        if self.tts_client:
+            tts_log_dir, stt_log_dir = self._media_log_dirs()
+            self.tts_client.output_dir, self.tts_client.file_idx = tts_log_dir, 0
+            self.stt_client.output_dir, self.stt_client.file_idx = stt_log_dir, 0
+        if self.cassette and not self.cassette.replaying:
+            # The clients stay wrapped, their requests now go to the session's own cassette
+            self.cassette.open(os.path.join(self.logging_root_dir,
+                                            self.config["logging"].get("cassette_file", "cassette.jsonl")))
+            record_session(self.cassette, self.assistant)
+        default_episode = os.path.basename(os.path.normpath(self.config["episode_files"]["text"]["base_dir"]))
+        if self.episode != default_episode:
+            self.switch_episode(default_episode)
+        else:
+            self.log_episode_content()
+        self.logger.info(f"New session for child {child_id} in {self.logging_root_dir}")
+
+    def finish_session(self, stop_video=True):
+        # Save everything of the session (learning history export, raw conversation, trace) and flush its logs
+        # The Excel export runs while the raw conversation is fetched
+        export_task = self.save_learning_history(background=True)
+        self.save_raw_conversation()
+        export_task.join()
+        self.save_trace()
+        if self.cassette:
+            self.cassette.close()
+        if self.video_player:
+            if stop_video:
+                self.video_player.stop_video()
+            else:
+                # Waiting for the next session
+                self.video_player.play_video_non_blocking(self.video_path_list["idle"], stop_when_finished=False)
+        self.logger.debug(tasks.get_executor().report())
+        self.logger.debug(ratelimit.report())
+        # Flush the remaining log records
+        utils.stop_queue_logging(self.log_listener)
+
+    def _init_cassette(self, record, replay, replay_speed):
+        # Record: every assistant turn, transcript and synthesized speech goes to cassette.jsonl in the log folder.
+        # Replay: an existing cassette (file or session folder) stands in for OpenAI, STT and TTS
+        self.cassette = None
+        cassette_file_name = self.config["logging"].get("cassette_file", "cassette.jsonl")
+        if replay:
+            cassette_file = os.path.join(replay, cassette_file_name) if os.path.isdir(replay) else replay
+            assert os.path.exists(cassette_file), f"No cassette at {cassette_file}."
+            self.cassette = Cassette(cassette_file, mode="replay", speed=replay_speed, logger=self.logger)
+            self.logger.info(f"Replaying {cassette_file} "
+                             f"({'as fast as possible' if replay_speed <= 0 else f'x{replay_speed}'})")
+        elif record:
+            self.cassette = Cassette(os.path.join(self.logging_root_dir, cassette_file_name), mode="record",
+                                     logger=self.logger)
+
+    def _load_checkpoint(self, resume_dir):
+        checkpoint_file = os.path.join(resume_dir, self.config["logging"].get("checkpoint_file", "checkpoint.json"))
+        assert os.path.exists(checkpoint_file), f"No session checkpoint at {checkpoint_file}."
+        with open(checkpoint_file, encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        checkpoint["log_dir"] = resume_dir
+        return checkpoint
 
     def _init_logging(self):
         # Initialize all kind of logger
-        self.logging_root_dir = os.path.join(self.config["logging"]["logging_dir"],
-                                             f"{self.config['childID']:04}",
-                                             time.strftime(time.strftime("%y%m%d_%H%M%S")))
+        if self.checkpoint:
+            self.logging_root_dir = self.checkpoint["log_dir"]
+        else:
+            self.logging_root_dir = os.path.join(self.config["logging"]["logging_dir"],
+                                                 f"{self.config['childID']:04}",
+                                                 time.strftime(time.strftime("%y%m%d_%H%M%S")))
         os.makedirs(self.logging_root_dir, exist_ok=True)
         self.logger = logging.getLogger("adaptive_CA")
         self.logger.setLevel(logging.DEBUG)
+        # A new session (see new_session) logs to its own folder only
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
 
         # Init debug logger (Everything output from the program)
         debug_formatter = logging.Formatter("%(asctime)s - [%(levelname)s] - %(message)s", "%Y-%m-%d %H:%M:%S")
@@ -47,7 +221,6 @@ class AdaptiveCA:
             os.path.join(self.logging_root_dir, self.config["logging"]["debug_log_file"]))
         debug_handler.setLevel(logging.DEBUG)
         debug_handler.setFormatter(debug_formatter)
-        self.logger.addHandler(debug_handler)
         # Init console logger
         console_formatter = logging.Formatter('%(message)s')
         console_handler = logging.StreamHandler()
@@ -56,15 +229,24 @@ class AdaptiveCA:
         else:
             console_handler.setLevel(logging.INFO)
         console_handler.setFormatter(console_formatter)
-        self.logger.addHandler(console_handler)
         # Init info file logger (Basically all console output + timestamps)
         file_info_formatter = logging.Formatter("%(asctime)s - %(message)s", "%Y-%m-%d %H:%M:%S")
         file_info_handler = logging.FileHandler(
             os.path.join(self.logging_root_dir, self.config["logging"]["assistant_log_file"]))
         file_info_handler.setLevel(logging.INFO)
         file_info_handler.setFormatter(file_info_formatter)
-        self.logger.addHandler(file_info_handler)
+        # Init structured logger (one JSON record per line, with thread and extra fields)
+        structured_handler = logging.FileHandler(os.path.join(
+            self.logging_root_dir, self.config["logging"].get("structured_log_file", "program_events.jsonl")))
+        structured_handler.setLevel(logging.DEBUG)
+        structured_handler.setFormatter(utils.JsonLogFormatter())
+        # The turn path only enqueues records, the file and console I/O happens on a background listener thread
+        self.log_listener = utils.attach_queue_logging(
+            self.logger, [debug_handler, console_handler, file_info_handler, structured_handler])
         self.logger.info(f"Initializing logger...")
+        if self.checkpoint:
+            self.logger.info(f"Resuming {self.checkpoint['program']} session from {self.logging_root_dir} at "
+                             f"{self.position}")
 
     def _sanity_check(self):
         self.logger.info("Checking files...")
@@ -75,11 +257,8 @@ class AdaptiveCA:
             targets.extend([os.path.join(root_dir, category[file]) for file in category if file != "base_dir"])
         # Videos check
         # Keeping video_idx starting at 1. idx have this format: [start, end)
-        self.start_video_idx = self.config["video_settings"]["start_episode"]
-        possible_video_ep = glob.glob(os.path.join(self.config["episode_files"]["episode_videos"]["base_dir"],
-                                                   "*_episode*"))
-        self.end_video_idx = min(self.start_video_idx + self.config["video_settings"]["max_videos"],
-                                 len(possible_video_ep) + 1)    # restrict to number of possible video only
+        self.start_video_idx, self.end_video_idx = self._episode_video_range(
+            self.config["episode_files"]["episode_videos"]["base_dir"])
         if self.start_video_idx >= self.end_video_idx:
             self.logger.error(f"Invalid start_video index: {self.start_video_idx}")
             exit()
@@ -98,11 +277,28 @@ class AdaptiveCA:
             self.logger.info("Missing files detected. Exiting...")
             exit()
 
+    def _episode_video_range(self, video_dir):
+        # [start, end) of the videos played: from start_episode, at most max_videos, restricted to the videos of
+        # the episode's folder
+        start_video_idx = self.config["video_settings"]["start_episode"]
+        possible_video_ep = glob.glob(os.path.join(video_dir, "*_episode*"))
+        return start_video_idx, min(start_video_idx + self.config["video_settings"]["max_videos"],
+                                    len(possible_video_ep) + 1)
+
     def _initialize_assistant(self):
         self.logger.info("Initializing adaptive conversational assistant...")
+        if self.cassette and self.cassette.replaying:
+            self.client = None
+            self.assistant = ReplayAssistant(self.cassette, logger=self.logger)
+            return
+        with self.profiler.measure("assistant", "import"):
+            from openai import OpenAI
+        self.profiler.start("assistant", "init")
         # Initialize client and assistant
         self.client = OpenAI(api_key=utils.get_api_key(api_key_file=self.config["private_key_path"]["OpenAI"]))
-        self.assistant = GPTAssistant(self.client, self.config["OpenAI_assistant"]["id"], logger=self.logger)
+        self.assistant = GPTAssistant(self.client, self.config["OpenAI_assistant"]["id"], logger=self.logger,
+                                      thread_id=self.checkpoint["thread_id"] if self.checkpoint else None,
+                                      **self.assistant_options())
 
         # Update instructions, model, and tools assistants can use
         self.client.beta.assistants.update(assistant_id=self.assistant.id, name="Science Tutor for children")
@@ -115,27 +311,72 @@ class AdaptiveCA:
         available_tools = [{"type": "function", "function": tool} for tool in available_tools]
         self.client.beta.assistants.update(assistant_id=self.assistant.id, tools=available_tools)
         self.logger.debug(self.get_assistant_info())
+        self.profiler.stop("assistant", "init")
+
+    def _media_log_dirs(self):
+        # Session folders of the synthesized speech and of the child's recorded audio
+        tts_log_dir = os.path.join(self.logging_root_dir, self.config["logging"]["tts_log_dir"])
+        stt_log_dir = os.path.join(self.logging_root_dir, self.config["logging"]["stt_log_dir"])
+        os.makedirs(tts_log_dir, exist_ok=True)
+        os.makedirs(stt_log_dir, exist_ok=True)
+        return tts_log_dir, stt_log_dir
 
     def _init_multimedia_module(self, ):
         self.logger.info("Initializing multimedia module...")
         # Text-to-speech, speech-to-text, video players
-        tts_log_dir = os.path.join(self.logging_root_dir, self.config["logging"]["tts_log_dir"])
-        stt_log_dir = os.path.join(self.logging_root_dir, self.config["logging"]["stt_log_dir"])
-        os.makedirs(tts_log_dir)
-        os.makedirs(stt_log_dir)
-        # Init TTS, STT client, and video player to be used later
-        self.tts_client = TTSClient(
-            tts_private_key_path=self.config["private_key_path"]["GCS_TTS"],
-            output_dir=tts_log_dir,
-            logger=self.logger)
-        self.stt_client = STTStreamingClient(
-            gcs_private_key_path=self.config["private_key_path"]["GCS_STT"],
-            gcs_project_id=self.config["gcs_project_id"],
-            max_start_timeout=self.config["stt_settings"]["max_start_timeout"],
-            max_pause_duration=self.config["stt_settings"]["max_pause_duration"],
-            output_dir=stt_log_dir,
-            logger=self.logger)
+        tts_log_dir, stt_log_dir = self._media_log_dirs()
+        with self.profiler.measure("video", "import"):
+            from multimedia.video_player import VideoPlayer
+        if self.cassette and self.cassette.replaying:
+            # Recorded speech and transcripts, no Google clients
+            self.tts_client = ReplayTTSClient(self.cassette, logger=self.logger)
+            self.stt_client = ReplaySTTClient(self.cassette, logger=self.logger)
+        else:
+            with self.profiler.measure("tts", "import"):
+                from multimedia.TTS import TTSClient
+            with self.profiler.measure("stt", "import"):
+                from multimedia.STT import STTStreamingClient
+            # Init TTS, STT client, and video player to be used later
+            self.profiler.start("tts", "init")
+            self.tts_client = TTSClient(
+                tts_private_key_path=self.config["private_key_path"]["GCS_TTS"],
+                output_dir=tts_log_dir,
+                logger=self.logger)
+            if self.checkpoint:
+                # Don't overwrite the audio of the interrupted session
+                self.tts_client.file_idx = self.checkpoint["tts_file_idx"]
+            self.profiler.stop("tts", "init")
+            self.profiler.start("stt", "init")
+            self.stt_client = STTStreamingClient(
+                gcs_private_key_path=self.config["private_key_path"]["GCS_STT"],
+                gcs_project_id=self.config["gcs_project_id"],
+                max_start_timeout=self.config["stt_settings"]["max_start_timeout"],
+                max_pause_duration=self.config["stt_settings"]["max_pause_duration"],
+                output_dir=stt_log_dir,
+                logger=self.logger)
+            if self.checkpoint:
+                self.stt_client.file_idx = self.checkpoint["stt_file_idx"]
+            self.profiler.stop("stt", "init")
+        self.profiler.start("video", "init")
         self.video_player = VideoPlayer(full_screen=self.config["video_settings"]["fullscreen"], logger=self.logger)
+        # Only the first part's video, the next ones are preloaded during the previous part (prepare_part)
+        episode_videos = [] if self.pretest_only else [self.video_path_list["intro"], self.video_path_list["outro"],
+                                                       *self.first_part_videos()]
+        self.video_player.preload(episode_videos,
+                                  loop_paths=[self.video_path_list["idle"], self.video_path_list["lip_flap"]])
+        self.profiler.stop("video", "init")
+        # Barge-in: listen to the child while the assistant is still asking the question
+        barge_in_settings = self.config["stt_settings"].get("barge_in", {})
+        # No microphone in replay
+        if barge_in_settings.get("enabled", False) and not (self.cassette and self.cassette.replaying):
+            from multimedia.barge_in import BargeInListener
+            self.barge_in_listener = BargeInListener(
+                self.stt_client,
+                threshold_db=barge_in_settings.get("vad_threshold_db", -30),
+                min_speech_duration=barge_in_settings.get("min_speech_duration", 0.3),
+                pre_roll=barge_in_settings.get("pre_roll", 0.5),
+                action=barge_in_settings.get("action", "stop"),
+                logger=self.logger)
 
     def _retrieve_episode_content(self):
         self.logger.info("Retrieving episode's content...")
@@ -146,63 +387,144 @@ class AdaptiveCA:
             files[category] = {subcategory: os.path.join(root_dir, sub_files[subcategory])
                                for subcategory in sub_files if subcategory != "base_dir"}
 
-        # Retrieving pretest file
-        df = pd.read_excel(files["text"]["pretest"], usecols=["question", "level", "answer"])
-        self.pretest = df.to_dict(orient="records")
-        self.logger.info(
-            f"Retrieved {len(self.pretest)} pretest questions from {files['text']['pretest']}"
-        )
-
-        # Retrieving warmup questions
-        df = pd.read_excel(files["text"]["warmups"], usecols=["question"])
-        self.warmup_questions = df["question"].tolist()
-        self.logger.info(
-            f"Retrieved {len(self.warmup_questions)} warmup questions from {files['text']['warmups']}"
-        )
-
-        # Retrieving transcript file
-        df = pd.read_excel(files["text"]["transcript"], usecols=["text", "question"])
-        self.dialogues = df.to_dict(orient="records")
-        # For now don't retrieve question without any dialogue (e.g. in town_picnic_base.xlsx)
-        self.dialogues = [dialogue for dialogue in self.dialogues if dialogue["text"].strip()]
-        self.logger.info(
-            f"Retrieved {len(self.dialogues)} parts of episode with base questions from {files['text']['transcript']}"
-        )
-
-        # Retrieving question banks
-        df = pd.read_excel(files["text"]["question_bank"])
-        df = df.sort_values(by=["id_text", "level"], ascending=[True, False])  # Some hacks here: shallow -> int -> deep
-        self.question_banks = []
-        for dict_item in df.groupby("id_text").agg(list).to_dict(orient="records"):
-            current_questions = []
-            for question, level in zip(dict_item["question"], dict_item["level"]):
-                current_questions.append({"question": question, "level": level.upper()})
-            self.question_banks.append(current_questions)
-        self.logger.info(f"Retrieved {len(df)} questions from {files['text']['question_bank']}")
+        self.episode_files = files
+        # Every episode under transcripts/ is indexed once (through the compiled content cache), the configured
+        # episode is the one the session starts with
+        self.catalog = EpisodeCatalog(self.config.get("transcripts_dir", "transcripts/"),
+                                      self.config.get("content_cache_dir", ".content_cache/"), logger=self.logger)
+        episode = os.path.basename(os.path.normpath(self.config["episode_files"]["text"]["base_dir"]))
+        self.catalog.add_episode(episode, files["text"])
+        self.logger.info(f"Episodes available: {', '.join(self.catalog.names)}")
+        if self.checkpoint and self.checkpoint["episode"] in self.catalog.names:
+            episode = self.checkpoint["episode"]
+        self.switch_episode(episode)
+
+    def switch_episode(self, episode):
+        # Swap the session's content to another indexed episode, nothing is re-read from disk. An episode without
+        # question banks (e.g. a base transcript only) or videos can't run a session, the current one is kept
+        content = self.catalog.content(episode)
+        if not content["num_bank_questions"]:
+            raise ValueError(f"Episode {episode} has no question banks")
+        # Episode videos live in <videos root>/<episode>/
+        video_dir = self.config["episode_files"]["episode_videos"]["base_dir"]
+        if os.path.basename(os.path.normpath(video_dir)) != episode:
+            video_dir = os.path.join(os.path.dirname(os.path.normpath(video_dir)), episode)
+        start_video_idx, end_video_idx = self._episode_video_range(video_dir)
+        if start_video_idx >= end_video_idx:
+            raise ValueError(f"Episode {episode} has no video from part {start_video_idx} in {video_dir}")
+        self.start_video_idx, self.end_video_idx = start_video_idx, end_video_idx
+        self.episode = episode
+        self.pretest = content["pretest"]
+        self.warmup_questions = content["warmup_questions"]
+        self.dialogues = content["dialogues"]
+        self.question_banks = content["question_banks"]
+        self.num_bank_questions = content["num_bank_questions"]
 
         # Retrieving videos file
-        episode_path_list = [os.path.join(self.config["episode_files"]["episode_videos"]["base_dir"],
-                                          f"{video_idx:02}_episode.mp4")
+        files = self.episode_files
+        episode_path_list = [os.path.join(video_dir, f"{video_idx:02}_episode.mp4")
                              for video_idx in range(1, self.end_video_idx)]
+        # Intro and outro are the episode's own (same file names in its video folder), the idle and lip flap clips
+        # are the character's, shared by every episode
+        episode_videos = self.config["episode_files"]["episode_videos"]
         self.video_path_list = {
             "episodes": episode_path_list,
             "idle": files["misc_videos"]["idle"],
             "lip_flap": files["misc_videos"]["lip_flap"],
-            "intro": files["episode_videos"]["intro"],
-            "outro": files["episode_videos"]["outro"]
+            "intro": os.path.join(video_dir, episode_videos["intro"]),
+            "outro": os.path.join(video_dir, episode_videos["outro"])
+        }
+        self.log_episode_content()
+        self.logger.info(f"Retrieved {len(self.video_path_list['episodes'])} videos from {video_dir}")
+        if getattr(self, "video_player", None):
+            self.video_player.preload([self.video_path_list["intro"], self.video_path_list["outro"],
+                                       *self.first_part_videos()])
+
+    def log_episode_content(self):
+        # Also logged at the start of every session, its program_info.log tells which episode it used (analytics.py)
+        episode = self.episode
+        self.logger.info(f"Retrieved {len(self.pretest)} pretest questions for {episode}")
+        self.logger.info(f"Retrieved {len(self.warmup_questions)} warmup questions for {episode}")
+        self.logger.info(f"Retrieved {len(self.dialogues)} parts of episode with base questions for {episode}")
+        self.logger.info(f"Retrieved {self.num_bank_questions} bank questions for {episode}")
+
+    def first_part_videos(self):
+        # Video of the part the session starts (or resumes) at
+        first_part_idx = self.position.get("episode_idx", self.start_video_idx - 1)
+        return self.video_path_list["episodes"][first_part_idx:first_part_idx + 1]
+
+    def prepare_part(self, idx, prefetch_media=False):
+        # What part idx of the episode needs before it starts. With prefetch_media (in the background during the
+        # previous part), its video is also opened and parsed and its base question synthesized, so the next part
+        # starts without waiting for either
+        dialogue = self.dialogues[idx]
+        part = {
+            "idx": idx,
+            "story": dialogue["text"],
+            "base_question": dialogue["question"],
+            "segment_id": self.catalog.segment_id(self.episode, idx),
+            "story_message": (f"Here's the current story: {dialogue['text']}. | \n"
+                              f"Through this story, we will assist the child in learning some new science concepts."),
+        }
+        if prefetch_media and not self.text_IO:
+            self.video_player.preload(self.video_path_list["episodes"][idx:idx + 1])
+            with ratelimit.priority("background"):
+                self.tts_client.presynthesize(dialogue["question"])
+        return part
+
+    def assistant_options(self):
+        # Run timeout and context management of the session's assistant (see GPTAssistant)
+        context_settings = self.config.get("assistant_context") or {}
+        return {
+            "run_timeout": self.config.get("turn_settings", {}).get("run_timeout"),
+            "last_messages": context_settings.get("last_messages"),
+            "rollover_tokens": context_settings.get("rollover_tokens"),
+            "context_summary": self.context_summary,
         }
-        self.logger.info(f"Retrieved {len(self.video_path_list['episodes'])} videos from"
-                         f" {self.config['episode_files']['episode_videos']['base_dir']}")
+
+    def context_summary(self):
+        # Seed of a new assistant thread (rollover): what the assistant needs to continue the session, compacted
+        def compact(turns):
+            return [{key: turn.get(key) for key in ("question", "answer", "accuracy")} for turn in turns]
+
+        lines = ["We're continuing the session with the child in a new conversation. As a conversational agent, you "
+                 f"help children from 3 to 6 learn science through the story '{self.episode}'."]
+        for section in ("warmup", "pretest"):
+            if self.learning_history.get(section):
+                lines.append(f"{section.capitalize()} answers: {compact(self.learning_history[section])}")
+        for part_idx, turns in enumerate(self.learning_history.get("episode", [])):
+            lines.append(f"Learning history of story part {part_idx + 1}: {compact(turns)}")
+        if self.current_story:
+            lines.append(f"Here's the current story: {self.current_story}")
+        return "\n".join(lines)
+
+    def log_assistant_usage(self, label, first_run=0):
+        # Input tokens and latency of the assistant's runs since first_run (index in run_stats)
+        run_stats = self.assistant.run_stats[first_run:]
+        if not run_stats:
+            return
+        input_tokens = [stats["input_tokens"] or 0 for stats in run_stats]
+        latencies = [stats["latency"] for stats in run_stats]
+        self.logger.info(f"{label}: {len(run_stats)} assistant runs, input tokens mean "
+                         f"{sum(input_tokens) / len(input_tokens):.0f} (max {max(input_tokens)}), latency mean "
+                         f"{sum(latencies) / len(latencies):.2f}s (max {max(latencies):.2f}s)",
+                         extra={"assistant_usage": label, "runs": len(run_stats), "input_tokens": sum(input_tokens),
+                                "latency": sum(latencies)})
 
     def get_assistant_info(self):
         assistant_data = self.client.beta.assistants.retrieve(self.assistant.id).model_dump()
         object_list = ["id", "name", "description", "instructions", "model", "temperature", "tools"]
         return "\n".join([f"{obj}: {assistant_data[obj]}" for obj in object_list])
 
+    @tracing.traced("speak", "turn")
     def speak(self, *texts):
         # Basically a wrapper for printing out, can choose either doing TTS or not (for debugging)
         texts = " ".join(texts)
         self.logger.info(texts)
+        if self.session_requested_at is not None:
+            self.logger.info(f"Session start to first spoken line took "
+                             f"{time.perf_counter() - self.session_requested_at:.2f}s")
+            self.session_requested_at = None
         if not self.text_IO:
             # Playing lip flap video while TTS
             self.video_player.play_video_non_blocking(self.video_path_list["lip_flap"], stop_when_finished=False)
@@ -210,14 +532,35 @@ class AdaptiveCA:
             # After speaking, we need to buffer between processing time
             self.video_player.play_video_non_blocking(self.video_path_list["idle"], stop_when_finished=False)
 
-    @utils.multithread
+    @tasks.background("speak")
     def speak_non_block(self, *texts):
         self.speak(*texts)
 
+    @tasks.background("speak")
+    def speak_after(self, speech, *texts):
+        # Speak once the previous non blocking speech is done
+        speech.join()
+        self.speak(*texts)
+
+    def report_first_feedback(self):
+        # Called when the turn's first feedback goes to TTS
+        latency = time.perf_counter() - self._answer_time
+        self.answer_to_feedback.append(latency)
+        tracing.get_tracer().instant("first_feedback", "turn", answer_to_feedback=latency)
+        self.logger.debug(f"Answer to first feedback took {latency:.2f}s")
+
+    @tracing.traced("get_response", "turn")
     def get_response(self):
         if self.text_IO:
-            response = input("Response: ")
-            self.logger.info(f"Response: {response}")  # TODO: input and logger slows down?
+            if self.stt_client:  # Replayed answers
+                response = self.stt_client.speech_to_text()
+            else:
+                start_time = time.perf_counter()
+                response = input("Response: ")
+                if self.cassette:
+                    self.cassette.record("stt.speech_to_text", {}, {"transcript": response},
+                                         time.perf_counter() - start_time)
+            self.logger.info(f"Response: {response}")
             return response
 
         # Playing idle video while getting response
@@ -228,22 +571,215 @@ class AdaptiveCA:
         self.logger.info(f"Response: {response}")
         return response
 
+    @tracing.traced("ask_question", "turn")
     def ask_question(self, question):
-        self.speak(question)
-        answer = self.get_response()
+        start_time = time.time()
+        if self.barge_in_listener and not self.text_IO:
+            answer = self.ask_question_barge_in(question)
+        else:
+            self.speak(question)
+            answer = self.get_response()
+        self.logger.debug(f"Question to transcript took {(time.time() - start_time):.2f}s")
+        self._answer_time = time.perf_counter()
         return answer
 
-    def save_learning_history(self):
+    def ask_question_barge_in(self, question):
+        # Same as speak() + get_response(), but the microphone is already listening while the question is spoken
+        self.logger.info(question)
+        self.video_player.play_video_non_blocking(self.video_path_list["lip_flap"], stop_when_finished=False)
+        playback = self.tts_client.text_to_speech_non_blocking(question)
+        if playback is None:
+            return self.get_response()
+        response = self.barge_in_listener.listen(playback)
+        playback.stop()
+        self.video_player.play_video_non_blocking(self.video_path_list["idle"], stop_when_finished=False)
+        if self.barge_in_listener.last_barged_in:
+            self.logger.debug("Child answered before the question finished")
+        self.logger.info(f"Response: {response}")
+        return response
+
+    def converse_within_budget(self, kind, message, tools, fallback, on_late=None, on_field=None):
+        # Assistant tool call bounded by the turn's latency budget. Past the budget (or if the call fails) fallback()
+        # gives local json responses instead; the assistant keeps going in the background and on_late gets its
+        # json responses when they arrive. on_field: see GPTAssistant.converse
+        # The thread runs one call at a time: while a late call is still running, the next calls wait for it (budgeted
+        # ones in the executor's queue, the others, e.g. the story message, on the assistant's lock, at most about
+        # run_timeout)
+        if self.latency_budget is None:
+            return self.assistant.converse(message, tools=tools, on_field=on_field)
+        start_time = time.perf_counter()
+        future = self.assistant_executor.submit(self.assistant.converse, message, tools, on_field)
+        try:
+            return future.result(timeout=self.latency_budget)
+        except concurrent.futures.TimeoutError:
+            if future.cancel():
+                # Never started, queued behind a previous turn's late call: it's dropped instead of running stale
+                self.logger.info(f"No {kind} from the assistant after {self.latency_budget}s (a previous late answer "
+                                 f"is still running), using local fallback")
+            else:
+                self.logger.info(f"No {kind} from the assistant after {self.latency_budget}s, using local fallback")
+                # Bound to this session's queue: a late answer of the previous child (kiosk, see new_session) is
+                # dropped
+                future.add_done_callback(functools.partial(self._on_late_result, kind, start_time, on_late,
+                                                           self._late_results))
+        except Exception as e:
+            self.logger.exception(e)
+            self.logger.info(f"Assistant {kind} failed, using local fallback")
+        self.fallback_counts[kind] = self.fallback_counts.get(kind, 0) + 1
+        return "", fallback()
+
+    def _on_late_result(self, kind, start_time, on_late, late_results, future):
+        # Runs on the assistant executor thread
+        if future.exception() is not None:
+            self.logger.debug(f"Late {kind} failed: {future.exception()}")
+            return
+        self.logger.debug(f"Late {kind} arrived after {(time.perf_counter() - start_time):.2f}s")
+        if on_late:
+            # The learning history and its store are only written by the main thread (apply_late_results)
+            late_results.put((on_late, future.result()[1], time.perf_counter() - start_time))
+
+    def apply_late_results(self):
+        # Main thread only, at the start of a turn and before the learning history is saved
+        while True:
+            try:
+                on_late, json_responses, latency = self._late_results.get_nowait()
+            except queue.Empty:
+                return
+            on_late(json_responses, latency)
+
+    def record_late_feedback(self, section, episode, question, answer, json_responses, latency):
+        # The assistant's feedback that came in past the budget, kept next to the turns in the learning history
+        record = {"section": section, "episode": episode, "question": question, "answer": answer,
+                  "accuracy": json_responses[0].get("accuracy"), "latency": latency}
+        self.learning_history.setdefault("late_results", []).append(record)
+        self.history_store.append("late_results", record)
+
+    def fallback_encouragement(self):
+        return next(self._fallback_feedback)
+
+    def fallback_pretest_feedback(self, question, answer):
+        return [{"question": question, "answer": answer, "accuracy": self.fallback_accuracy,
+                 "feedback": self.fallback_encouragement()}]
+
+    def fallback_feedback(self):
+        return [{"accuracy": self.fallback_accuracy, "evaluation": self.fallback_encouragement(), "explanation": "",
+                 "transition": "Let's try another question."}]
+
+    def fallback_question(self, segment_id, level, question_bank, asked_questions):
+        # Next bank question of the targeted level that hasn't been asked yet
+        candidates = self.catalog.candidates(self.episode, segment_id, level) or question_bank
+        candidate = next((candidate for candidate in candidates if candidate["question"] not in asked_questions),
+                         candidates[0])
+        return [{"question": candidate["question"], "level": candidate["level"],
+                 "rationale": "Local fallback, no valid question from the assistant within the latency budget"}]
+
+    def pretest_feedback_message(self, question, level, sample_answer, answer):
+        return (f"Here's a {level} pretest question: {question}, and a sample answer: {sample_answer}. Here's the "
+                f"child's answer: {answer}. Please give the child a feedback based on their answer.")
+
+    def _grading_assistant(self):
+        # One assistant thread per grading worker, a thread only runs one request at a time. A recorded/replayed
+        # session grades on the session's assistant (one worker) so the cassette keeps a fixed order
+        if self.cassette:
+            return self.assistant
+        grader = getattr(self._graders, "assistant", None)
+        if grader is None:
+            grader = self._graders.assistant = GPTAssistant(
+                self.client, self.config["OpenAI_assistant"]["id"], logger=self.logger,
+                run_timeout=self.config.get("turn_settings", {}).get("run_timeout"))
+        return grader
+
+    def _grade_pretest_answer(self, message):
+        # Nobody waits for the grade, the next question's requests go first
+        with ratelimit.priority("background"):
+            _, json_responses = self._grading_assistant().converse(message,
+                                                                   tools=[generate_feedback_pretest_function_json])
+        return json_responses[0]["accuracy"]
+
+    def submit_pretest_grading(self, q_idx, message):
+        # Graded in the background, the accuracy is set in pretest_accuracy[q_idx] by apply_pretest_grades
+        if self.grading_executor is None:
+            self.grading_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1 if self.cassette else self.grading_workers, thread_name_prefix="grading")
+        self._pending_grades[q_idx] = self.grading_executor.submit(self._grade_pretest_answer, message)
+
+    def apply_pretest_grades(self, wait=False):
+        # Main thread only: the learning history is also written by the checkpoints
+        for q_idx, future in list(self._pending_grades.items()):
+            if not (wait or future.done()):
+                continue
+            del self._pending_grades[q_idx]
+            try:
+                accuracy = future.result()
+            except Exception as e:
+                self.logger.exception(e)
+                self.logger.info(f"Grading of pretest answer {q_idx + 1} failed, accuracy left empty")
+                continue
+            self.pretest_accuracy[q_idx] = accuracy
+            self.history_store.update("pretest", self.pretest_record_ids[q_idx], {"accuracy": accuracy})
+            self.logger.debug(f"Pretest answer {q_idx + 1} graded: {accuracy}")
+
+    def begin_turn(self):
+        self._turn_start = time.perf_counter()
+        self.apply_late_results()
+
+    def record_turn(self, section, record, episode=None):
+        # Every turn goes to the append-only store right away, learning_history.jsonl survives a crash. Returns the
+        # turn's id in the store, where later updates of the turn go
+        record_id = self.history_store.append(section, record, episode=episode)
+        # The whole turn (begin_turn -> recorded) as one span, the spans of the turn's steps are nested in it
+        tracing.get_tracer().add_span("turn", "turn", self._turn_start, time.perf_counter(), section=section,
+                                      episode=episode)
+        return record_id
+
+    def _export_learning_history(self):
         learning_result_file = os.path.join(self.logging_root_dir, self.config["logging"]["learning_result"])
-        with pd.ExcelWriter(learning_result_file) as writer:
-            for section in self.learning_history:
-                df = pd.DataFrame(self.learning_history[section])
-                # Essentially checking if learning history is nested (happens for episode learning history)
-                if isinstance(self.learning_history[section][0], list):
-                    df = df.stack().apply(pd.Series)
-                df.to_excel(writer, sheet_name=section)
+        export_to_excel(read_learning_history(self.history_store.file_path), learning_result_file)
         self.logger.info(f"Learning history saved to {learning_result_file}.")
 
+    def save_learning_history(self, background=False):
+        # The Excel workbook is an export of the learning history store (also doable offline with history_store.py).
+        # Late results arriving after this are dropped, the store is closed
+        self.apply_late_results()
+        self.history_store.close()
+        if background:
+            return tasks.submit("export_learning_history", self._export_learning_history)
+        self._export_learning_history()
+
+    def save_checkpoint(self, section, **position):
+        # Where to continue from (section + position in it) and everything needed to rebuild the session state.
+        # Written after every turn to a temporary file then renamed, so a crash mid-write keeps the previous checkpoint
+        self.apply_late_results()
+        self.position = {"section": section, **position}
+        checkpoint = {
+            "time": time.time(),
+            "program": self.program,
+            "episode": self.episode,
+            "position": self.position,
+            "learning_history": self.learning_history,
+            "thread_id": self.assistant.thread.id,
+            "tts_file_idx": self.tts_client.file_idx if self.tts_client else 0,
+            "stt_file_idx": self.stt_client.file_idx if self.stt_client else 0,
+            "fallback_counts": self.fallback_counts,
+            "pretest_record_ids": self.pretest_record_ids,
+            "pretest_accuracy": self.pretest_accuracy,
+        }
+        checkpoint_file = os.path.join(self.logging_root_dir,
+                                       self.config["logging"].get("checkpoint_file", "checkpoint.json"))
+        with open(f"{checkpoint_file}.tmp", "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False, default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{checkpoint_file}.tmp", checkpoint_file)
+
+    def save_trace(self):
+        tracer = tracing.get_tracer()
+        if not tracer.enabled:
+            return
+        trace_file = os.path.join(self.logging_root_dir, self.config["logging"].get("trace_file", "trace.json"))
+        num_events = tracer.save(trace_file)
+        self.logger.info(f"Trace ({num_events} events) saved to {trace_file}.")
+
     def save_raw_conversation(self):
         assistant_convo_file = os.path.join(self.logging_root_dir, self.config["logging"]["raw_assistant_conversation"])
         with open(assistant_convo_file, "w", encoding="utf-8") as f:
@@ -252,51 +788,84 @@ class AdaptiveCA:
 
     def run_warmup(self):
         self.logger.info("Begin warmups")
-        self.assistant.converse("We will now begin by showing a warmup video and asking a few warmup questions")
-        if not self.text_IO:
-            self.video_player.play_video(self.video_path_list["intro"],
-                                         max_duration=self.config["video_settings"]["max_playing_duration"],
-                                         stop_when_finished=False)
-        warmup_learning_history = []
-        for question in self.warmup_questions:
+        # When resuming mid-warmup, the intro and the answered questions are already done
+        start_idx = self.position["question_idx"] if self.position["section"] == "warmup" else 0
+        if start_idx == 0:
+            self.assistant.converse("We will now begin by showing a warmup video and asking a few warmup questions")
+            if not self.text_IO:
+                self.video_player.play_video(self.video_path_list["intro"],
+                                             max_duration=self.config["video_settings"]["max_playing_duration"],
+                                             stop_when_finished=False)
+        warmup_learning_history = self.learning_history.setdefault("warmup", [])
+        for q_idx, question in enumerate(self.warmup_questions[start_idx:], start=start_idx):
+            self.begin_turn()
             answer = self.ask_question(question)
             warmup_feedback_msg = (f"Here's a warmup question '{question}'. The child answer is '{answer}'. Please "
                                    f"give the child feedback based on their answer.")
-            _, json_responses = self.assistant.converse(warmup_feedback_msg,
-                                                        tools=[generate_feedback_pretest_function_json])
+            _, json_responses = self.converse_within_budget(
+                "feedback", warmup_feedback_msg, [generate_feedback_pretest_function_json],
+                fallback=functools.partial(self.fallback_pretest_feedback, question, answer),
+                on_late=functools.partial(self.record_late_feedback, "warmup", None, question, answer))
             feedback = json_responses[0]["feedback"]
+            self.report_first_feedback()
             self.speak(feedback)
             warmup_learning_history.append({
                 "question": question,
                 "answer": answer,
                 "feedback": feedback
             })
-        self.learning_history["warmup"] = warmup_learning_history
+            self.record_turn("warmup", warmup_learning_history[-1])
+            self.save_checkpoint("warmup", question_idx=q_idx + 1)
 
     def run_pre_test(self):
-        self.assistant.converse("Now I will begin asking the child a few pretest questions, then you will give me"
-                                "feedbacks based on the child's answer")
-        pretest_learning_history = []
-        for pretest_eval in self.pretest:
+        start_idx = self.position["question_idx"] if self.position["section"] == "pretest" else 0
+        deferred = self.pretest_grading == "deferred"
+        if start_idx == 0 and not deferred:
+            self.assistant.converse("Now I will begin asking the child a few pretest questions, then you will give me"
+                                    "feedbacks based on the child's answer")
+        pretest_learning_history = self.learning_history.setdefault("pretest", [])
+        # Resumed: answers whose grading didn't finish before the interruption are graded again
+        for q_idx, record in enumerate(pretest_learning_history):
+            if self.pretest_accuracy[q_idx] is None:
+                pretest_eval = self.pretest[q_idx]
+                self.submit_pretest_grading(q_idx, self.pretest_feedback_message(
+                    record["question"], pretest_eval["level"], pretest_eval["answer"], record["answer"]))
+        for q_idx, pretest_eval in enumerate(self.pretest[start_idx:], start=start_idx):
+            self.begin_turn()
             pretest_question, pretest_answer = pretest_eval["question"], pretest_eval["answer"]
             question_level = pretest_eval["level"]
             # I/O stuffs
             answer = self.ask_question(pretest_question)
 
             # Get feedback from GPT
-            pretest_msg = (f"Here's a {question_level} pretest question: {pretest_question}, and a sample "
-                           f"answer: {pretest_answer}. Here's the child's answer: {answer}. Please give the "
-                           "child a feedback based on their answer.")
-            responses, json_response = self.assistant.converse(pretest_msg,
-                                                               tools=[generate_feedback_pretest_function_json])
-            feedback = json_response[0]["feedback"]
+            pretest_msg = self.pretest_feedback_message(pretest_question, question_level, pretest_answer, answer)
+            if deferred:
+                # The feedback is neutral anyway, only the accuracy needs the assistant
+                feedback, accuracy = self.fallback_encouragement(), None
+                self.submit_pretest_grading(q_idx, pretest_msg)
+            else:
+                responses, json_response = self.converse_within_budget(
+                    "feedback", pretest_msg, [generate_feedback_pretest_function_json],
+                    fallback=functools.partial(self.fallback_pretest_feedback, pretest_question, answer),
+                    on_late=functools.partial(self.record_late_feedback, "pretest", None, pretest_question, answer))
+                feedback, accuracy = json_response[0]["feedback"], json_response[0]["accuracy"]
+            self.report_first_feedback()
             self.speak(feedback)
             pretest_learning_history.append({
                 "question": pretest_question,
                 "answer": answer,
                 "feedback": feedback
             })
-        self.learning_history["pretest"] = pretest_learning_history
+            # The store's row also has the accuracy, a deferred grade updates that row (by its id) once it's known
+            self.pretest_accuracy.append(accuracy)
+            self.pretest_record_ids.append(self.record_turn("pretest", dict(pretest_learning_history[-1],
+                                                                            accuracy=accuracy)))
+            self.apply_pretest_grades()
+            self.save_checkpoint("pretest", question_idx=q_idx + 1)
+        if self._pending_grades:
+            self.logger.info(f"Waiting for {len(self._pending_grades)} pretest answers to be graded")
+            self.apply_pretest_grades(wait=True)
+            self.save_checkpoint("pretest", question_idx=len(self.pretest))
 
     def adaptive_learning_loop(self):
         # def generate_question(learning_history):
@@ -306,73 +875,140 @@ class AdaptiveCA:
         #     feedback_msg, json_tool_responses = self.assistant.converse(question_gen_msg,
         #                                                                 tools=[generate_question_function_json])
         #     return feedback_msg, json_tool_responses
+        # Every assistant call below is bounded by the turn's latency budget (converse_within_budget), the local
+        # fallbacks are a neutral feedback with a default accuracy and the next bank question of the targeted level
         @utils.time_logger(self.logger)
-        def generate_feedback(question, answer):
-            # Template function to generate feedback from child's answer
+        def generate_feedback(question, answer, episode_idx):
+            # Template function to generate feedback from child's answer. With stream_feedback, the evaluation is
+            # spoken as soon as the model has generated it, the thread speaking it is returned (None otherwise)
             feedback_generation_msg = (f"The question is: '{question}'. Here's the child's answer: '{answer}'. "
                                        f"Generate feedback based on this answer.")
-            feedback_msg, json_tool_responses = self.assistant.converse(feedback_generation_msg,
-                                                                        tools=[generate_feedback_function_json])
-            return feedback_msg, json_tool_responses
+            early_speech = {"open": True}
+            early_speech_lock = threading.Lock()
+
+            def speak_evaluation(name, value):
+                # Assistant thread. Once the turn has moved on (e.g. past the latency budget) it's no longer spoken
+                if name != "evaluation":
+                    return
+                with early_speech_lock:
+                    if early_speech["open"] and "thread" not in early_speech:
+                        self.report_first_feedback()
+                        early_speech["evaluation"] = value
+                        early_speech["thread"] = self.speak_non_block(value)
+
+            feedback_msg, json_tool_responses = self.converse_within_budget(
+                "feedback", feedback_generation_msg, [generate_feedback_function_json], fallback=self.fallback_feedback,
+                on_late=functools.partial(self.record_late_feedback, "episode", episode_idx, question, answer),
+                on_field=speak_evaluation if self.stream_feedback else None)
+            with early_speech_lock:
+                early_speech["open"] = False
+            if "thread" in early_speech:
+                # What the child heard, even if the rest of the call went past the budget
+                json_tool_responses[0]["evaluation"] = early_speech["evaluation"]
+            return feedback_msg, json_tool_responses, early_speech.get("thread")
 
         @utils.time_logger(self.logger)
-        def simplify_question(question):
+        def simplify_question(question, fallback):
             # Template to simplify question
             simplified_generation_msg = (f"The child couldn't answer the previous question, please give me a "
                                          f"simplified version of '{question}'. The simplified question must be a "
                                          f"yes/no question or a question with multiple choices and must be different"
                                          f"from the original question.")
-            feedback_msg, json_tool_responses = self.assistant.converse(simplified_generation_msg,
-                                                                        tools=[simplify_question_function_json])
+            feedback_msg, json_tool_responses = self.converse_within_budget(
+                "question", simplified_generation_msg, [simplify_question_function_json], fallback=fallback)
             return feedback_msg, json_tool_responses
 
         @utils.time_logger(self.logger)
-        def select_question(question_banks, q_level, learning_history):
+        def select_question(candidates, q_level, learning_history, fallback):
+            # The candidates are sent as id|level|question rows and the assistant answers with an id, so the question
+            # spoken always comes from the bank. An unknown id, or one that isn't a candidate (e.g. wrong level), gets
+            # the local fallback question
             question_selection_msg = (f"Here's the child's learning history: {learning_history}. Select a {q_level} "
-                                      f"question from the list of questions: {question_banks}.")
-            feedback_msg, json_tool_responses = self.assistant.converse(question_selection_msg,
-                                                                        tools=[select_question_function_json])
-            return feedback_msg, json_tool_responses
+                                      f"question from the question bank (id|level|question):\n"
+                                      f"{question_rows(candidates)}")
+            feedback_msg, json_tool_responses = self.converse_within_budget(
+                "question", question_selection_msg, [select_question_function_json], fallback=fallback)
+            selection = json_tool_responses[0]
+            if "question_id" not in selection:  # Fallback already
+                return feedback_msg, json_tool_responses
+            question = self.catalog.question(self.episode, selection["question_id"])
+            if question is None or question not in candidates:
+                self.logger.info(f"Assistant selected question id {selection['question_id']!r}, not a {q_level} "
+                                 f"candidate, using local fallback")
+                self.fallback_counts["invalid_question"] = self.fallback_counts.get("invalid_question", 0) + 1
+                return feedback_msg, fallback()
+            return feedback_msg, [{"question": question["question"], "level": question["level"],
+                                   "rationale": selection.get("rationale", "")}]
 
         # Question level ranges: [0,2] inclusive
         question_levels = ["shallow", "intermediate", "deep"]
-        episode_learning_history = []
+        episode_learning_history = self.learning_history.setdefault("episode", [])
+        # Part (0-index) and question to continue from, set by run_adaptive_learning_program or a resumed checkpoint
+        resume_idx, resume_q_id = self.position["episode_idx"], self.position["question_idx"]
 
-        for idx, dialogue in enumerate(self.dialogues[self.start_video_idx - 1:self.end_video_idx - 1],
-                                       start=self.start_video_idx - 1):  # 0-index
-            dialogue_text, base_question = dialogue["text"], dialogue["question"]
+        # Parts with a video and a question bank
+        last_idx = min(len(self.dialogues), len(self.question_banks), self.end_video_idx - 1) - 1
+        next_part = None  # Prefetch of the next part, running while the current part goes on
+        for idx in range(resume_idx, last_idx + 1):
+            part = None
+            if next_part is not None:
+                try:
+                    part = next_part.result()
+                except Exception:
+                    # Already logged by the task pool, the part is prepared without prefetched media
+                    pass
+            part = part or self.prepare_part(idx)
+            if idx < last_idx:
+                next_part = tasks.submit("prefetch_part", self.prepare_part, idx + 1, prefetch_media=True)
+            base_question, segment_id = part["base_question"], part["segment_id"]
+            self.current_story = part["story"]
+            first_run = len(self.assistant.run_stats)
             current_question_bank = self.question_banks[idx]
-            self.logger.info("Video playing...")
-            # Play the episode video in the background
-            self.logger.info(f"Playing video: {self.video_path_list['episodes'][idx]}")
-            parallel_thread = self.video_player.play_video_non_blocking(
-                self.video_path_list["episodes"][idx],
-                max_duration=self.config["video_settings"]["max_playing_duration"],
-                stop_when_finished=False,
-            )
-            # Learning history for this part only
-            current_learning_history = []  # learning history sent to OpenAI
-            learning_history_log = []  # logging for everything
-
-            # Story conversing
-            self.logger.info("Conversing current story to OpenAI")
-            question_generation_msg = (f"Here's the current story: {dialogue_text}. | \n"
-                                       f"Through this story, we will assist the child in learning some new science "
-                                       f"concepts.")
-            self.assistant.converse(question_generation_msg)
-            # Keeping the old framework, now we need a mock json_response object to represent the base question
-            # (not generated but fixed)
-            json_responses = [{
-                "question": base_question,
-                "level": "BASE",
-                "rationale": "Base question to start out"
-            }]
-            self.logger.info("Conversing done!")
-
             # Ask maximum 3 questions
             max_questions = 3
-            next_q_level = 1  # Base question is intermediate
-            for q_id in range(max_questions):  # Question levels
+            first_q_id = 0
+            if idx == resume_idx and resume_q_id > 0:
+                # Resumed mid-part: the story was already sent to the thread, this part's history and the next
+                # question come from the checkpoint
+                self.logger.info(f"Resuming part {idx + 1} at question {resume_q_id + 1}")
+                parallel_thread = utils.CompletedTask()
+                current_learning_history = self.position["current_learning_history"]
+                learning_history_log = episode_learning_history[-1]
+                json_responses = [self.position["next_question"]]
+                next_q_level = self.position["next_q_level"]
+                first_q_id = resume_q_id
+            else:
+                self.logger.info("Video playing...")
+                # Play the episode video in the background
+                self.logger.info(f"Playing video: {self.video_path_list['episodes'][idx]}")
+                parallel_thread = utils.CompletedTask()
+                if not self.text_IO:
+                    parallel_thread = self.video_player.play_video_non_blocking(
+                        self.video_path_list["episodes"][idx],
+                        max_duration=self.config["video_settings"]["max_playing_duration"],
+                        stop_when_finished=False,
+                    )
+                # Learning history for this part only
+                current_learning_history = []  # learning history sent to OpenAI
+                learning_history_log = []  # logging for everything
+                # Add question answer log
+                episode_learning_history.append(learning_history_log)
+
+                # Story conversing
+                self.logger.info("Conversing current story to OpenAI")
+                self.assistant.converse(part["story_message"])
+                # Keeping the old framework, now we need a mock json_response object to represent the base question
+                # (not generated but fixed)
+                json_responses = [{
+                    "question": base_question,
+                    "level": "BASE",
+                    "rationale": "Base question to start out"
+                }]
+                self.logger.info("Conversing done!")
+                next_q_level = 1  # Base question is intermediate
+
+            for q_id in range(first_q_id, max_questions):  # Question levels
+                self.begin_turn()
                 # Ask question, get child's answer, and generate feedback based on that answer
                 generated_question = json_responses[0]["question"]
                 # level and rationale only exists if generate question is called, not simplified
@@ -382,7 +1018,7 @@ class AdaptiveCA:
                     0] else "Simplifying previous question"
                 parallel_thread.join()
                 child_answer = self.ask_question(generated_question)
-                feedback, json_responses = generate_feedback(generated_question, child_answer)
+                feedback, json_responses, evaluation_speech = generate_feedback(generated_question, child_answer, idx)
                 accuracy, evaluation, explanation, transition = [json_responses[0][obj] for obj in [
                     "accuracy", "evaluation", "explanation", "transition"]]
                 self.logger.debug(f"Answer's accuracy: {accuracy}")
@@ -409,55 +1045,91 @@ class AdaptiveCA:
                                   f"next question level: {question_levels[next_q_level]}")
                 # If we have two rights (or wrongs) in a row, evaluation + exit
                 # We also check for if it's currently the last questions
-                if next_q_level == last_q_level == 0 or next_q_level == last_q_level == 2 or q_id == max_questions - 1:
-                    parallel_thread = self.speak_non_block(evaluation, explanation)
-                    learning_history_dict["feedback"] = f"{evaluation} {explanation}"
+                last_question = (next_q_level == last_q_level == 0 or next_q_level == last_q_level == 2
+                                 or q_id == max_questions - 1)
+                if last_question:
+                    feedback_texts = (evaluation, explanation)
+                elif next_q_level < last_q_level:
+                    feedback_texts = (evaluation, transition)
+                else:
+                    feedback_texts = (evaluation, explanation, transition)
+                if evaluation_speech:
+                    # The evaluation is already being spoken (streamed), the rest follows it
+                    parallel_thread = self.speak_after(evaluation_speech, *feedback_texts[1:])
+                else:
+                    self.report_first_feedback()
+                    parallel_thread = self.speak_non_block(*feedback_texts)
+                learning_history_dict["feedback"] = " ".join(feedback_texts)
+                self.record_turn("episode", learning_history_dict, episode=idx)
+                if last_question:
                     break
+                asked_questions = [turn["question"] for turn in learning_history_log]
+                fallback = functools.partial(self.fallback_question, segment_id, question_levels[next_q_level],
+                                             current_question_bank, asked_questions)
                 # Simplifying previous asked question
                 if next_q_level < last_q_level:  # wrong answer -> simplify
-                    parallel_thread = self.speak_non_block(evaluation, transition)
-                    learning_history_dict["feedback"] = f"{evaluation} {transition}"
-                    feedback, json_responses = simplify_question(generated_question)
+                    feedback, json_responses = simplify_question(generated_question, fallback)
                 else:  # Harder question only rely on learning history
-                    parallel_thread = self.speak_non_block(evaluation, explanation, transition)
-                    learning_history_dict["feedback"] = f"{evaluation} {explanation} {transition}"
                     # feedback, json_responses = generate_question(current_learning_history)
-                    feedback, json_responses = select_question(current_question_bank, question_levels[next_q_level],
-                                                               current_learning_history)
+                    # Only the bank questions of the targeted level are sent (whole bank if there are none)
+                    candidates = (self.catalog.candidates(self.episode, segment_id, question_levels[next_q_level])
+                                  or current_question_bank)
+                    feedback, json_responses = select_question(candidates, question_levels[next_q_level],
+                                                               current_learning_history, fallback)
+                self.save_checkpoint("episode", episode_idx=idx, question_idx=q_id + 1,
+                                     next_question=json_responses[0], next_q_level=next_q_level,
+                                     current_learning_history=current_learning_history)
             parallel_thread.join()
-            # Add question answer log
-            episode_learning_history.append(learning_history_log)
+            self.save_checkpoint("episode", episode_idx=idx + 1, question_idx=0)
+            self.log_assistant_usage(f"Part {idx + 1}", first_run)
 
-        self.learning_history["episode"] = episode_learning_history
         return episode_learning_history
 
     @utils.exception_logger
     def run_pretest_program(self):
+        self.program = "pretest"
+        if self.position["section"] == "done":
+            self.logger.info("Pretest already finished")
+            return
         self.logger.info("Begin pretest")
         self.logger.info("=" * 50)
-        self.speak("Let's begin with a pretest!")
+        if self.position["section"] != "pretest":
+            self.speak("Let's begin with a pretest!")
         self.run_pre_test()
+        self.log_assistant_usage("Pretest")
         self.speak("You're now done with the pretest!")
+        self.save_checkpoint("done")
+        self.logger.info(f"Local fallbacks used: {self.fallback_counts or 'none'}")
 
     @utils.exception_logger
     def run_adaptive_learning_program(self, skip_warmup=False):
-        # Warmup video + question
-        if not skip_warmup:
-            self.run_warmup()
+        self.program = "adaptive"
+        section = self.position["section"]
+        if section == "done":
+            self.logger.info("Adaptive learning session already finished")
+            return
+        if section in (None, "warmup"):
+            # Warmup video + question
+            if not skip_warmup:
+                self.run_warmup()
+            self.assistant.converse(("Now you will be presented with a transcript from an "
+                                     "animation made to help children learn science concepts. The dialogue will be "
+                                     "divided into multiple parts, with each part focusing on a science concept. "
+                                     "Your goal is to help the child learn science knowledge from the stories."))
+            self.save_checkpoint("episode", episode_idx=self.start_video_idx - 1, question_idx=0)
         # Adaptive learning loop
         self.logger.info("Begin adaptive learning loop")
         self.logger.info("=" * 50)
-        self.assistant.converse(("Now you will be presented with a transcript from an "
-                                 "animation made to help children learn science concepts. The dialogue will be "
-                                 "divided into multiple parts, with each part focusing on a science concept. "
-                                 "Your goal is to help the child learn science knowledge from the stories."))
         self.adaptive_learning_loop()
         # Outro + Post adaptive loop message
-        self.video_player.play_video(self.video_path_list["outro"],
-                                     max_duration=self.config["video_settings"]["max_playing_duration"],
-                                     stop_when_finished=False)
+        if not self.text_IO:
+            self.video_player.play_video(self.video_path_list["outro"],
+                                         max_duration=self.config["video_settings"]["max_playing_duration"],
+                                         stop_when_finished=False)
         post_adaptive_loop_msg = "Congratulations! Hope you have fun learning something new today!"
         self.speak(post_adaptive_loop_msg)
+        self.save_checkpoint("done")
+        self.logger.info(f"Local fallbacks used: {self.fallback_counts or 'none'}")
 
 
 if __name__ == "__main__":
@@ -466,16 +1138,30 @@ if __name__ == "__main__":
     argparser.add_argument("--pretest", action="store_true", help="Running pretest program")
     argparser.add_argument("--mode", choices=["terminal", "interactive"], default="interactive")
     argparser.add_argument("--skip-warmup", action="store_true", help="If present, skip warmup section")
+    argparser.add_argument("--profile-startup", action="store_true",
+                           help="Report import and initialization time of each subsystem")
+    argparser.add_argument("--resume", metavar="LOG_DIR", default=None,
+                           help="Continue an interrupted session from the checkpoint in its log folder")
+    argparser.add_argument("--trace", action="store_true",
+                           help="Record a span trace of the session (Chrome trace format) in its log folder")
+    argparser.add_argument("--record", action="store_true",
+                           help="Record all OpenAI/STT/TTS requests and responses to a cassette in the log folder")
+    argparser.add_argument("--replay", metavar="CASSETTE", default=None,
+                           help="Replay a recorded cassette (file or session log folder) instead of calling services")
+    argparser.add_argument("--replay-speed", type=float, default=1.,
+                           help="1 replays at the recorded speed, 0 as fast as possible")
     arguments = argparser.parse_args()
     # Main program loop
-    adaptive_conversational_agent = AdaptiveCA(text_only=arguments.mode == "terminal")
-    if arguments.pretest:
+    adaptive_conversational_agent = AdaptiveCA(text_only=arguments.mode == "terminal", pretest_only=arguments.pretest,
+                                               profile_startup=arguments.profile_startup, resume_dir=arguments.resume,
+                                               trace=arguments.trace, record=arguments.record,
+                                               replay=arguments.replay, replay_speed=arguments.replay_speed)
+    if arguments.pretest or adaptive_conversational_agent.resumed_program == "pretest":
         adaptive_conversational_agent.run_pretest_program()
     else:
-        skip_warmup = (arguments.skip_warmup or
-                       adaptive_conversational_agent.config["video_settings"]["start_episode"] > 1)
+        # A resumed session continues where it stopped, warmup included
+        skip_warmup = not arguments.resume and (
+                arguments.skip_warmup or adaptive_conversational_agent.config["video_settings"]["start_episode"] > 1)
         adaptive_conversational_agent.run_adaptive_learning_program(skip_warmup=skip_warmup)
     # Save learning state information after running
-    adaptive_conversational_agent.save_learning_history()
-    adaptive_conversational_agent.save_raw_conversation()
-    adaptive_conversational_agent.video_player.stop_video()
+    adaptive_conversational_agent.finish_session()
@@ -0,0 +1,207 @@
+"""
+Cohort analytics over running_logs/<childID>/<timestamp>/ session folders.
+
+Each session's learning history (learning_history.jsonl, or learning_result.xlsx for older sessions) and the timing
+lines of program_info.log (utils.time_logger) are parsed with a process pool and written to a columnar (parquet)
+dataset. An index of the parsed sessions (with the mtime/size of their files) is kept next to the dataset, so a re-run
+only reads new or modified sessions.
+
+    python analytics.py running_logs/ --output analytics/
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from history_store import read_learning_history
+
+SESSION_FILES = ["learning_history.jsonl", "learning_result.xlsx", "program_info.log"]
+TIMING_PATTERN = re.compile(r"^(\S+ \S+) - \[DEBUG\] - (?:Function \((\w+)\)|(Question to transcript)) took ([\d.]+)s")
+EPISODE_PATTERN = re.compile(r"parts of episode with base questions (?:from|for) (\S+)")
+
+
+def find_sessions(logging_dir):
+    return sorted(os.path.relpath(session_dir, logging_dir)
+                  for session_dir in glob.glob(os.path.join(logging_dir, "*", "*", ""))
+                  if any(os.path.exists(os.path.join(session_dir, file)) for file in SESSION_FILES))
+
+
+def session_signature(session_dir):
+    signature = {}
+    for file in SESSION_FILES:
+        file_path = os.path.join(session_dir, file)
+        if os.path.exists(file_path):
+            stat = os.stat(file_path)
+            signature[file] = [stat.st_mtime_ns, stat.st_size]
+    return signature
+
+
+def _episode_name(log_file):
+    # Which episode the session used, from the content retrieval log line
+    if not os.path.exists(log_file):
+        return None
+    with open(log_file, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = EPISODE_PATTERN.search(line)
+            if match:
+                source = match.group(1)
+                # Older logs have the transcript path (transcripts/lucky_shirt/lucky_shirt_main.xlsx)
+                return os.path.basename(os.path.dirname(source)) if source.endswith(".xlsx") else source
+    return None
+
+
+def _learning_history_from_excel(xlsx_file):
+    import pandas as pd
+    learning_history = {}
+    for section, df in pd.read_excel(xlsx_file, sheet_name=None).items():
+        if section == "episode":
+            # Written from a stacked DataFrame: first column is the episode part (only on its first row), second one
+            # the question index
+            part_column, turn_column = df.columns[0], df.columns[1]
+            df[part_column] = df[part_column].ffill()
+            # Parts with fewer questions are padded with empty rows
+            df = df.dropna(how="all", subset=[column for column in df.columns if column not in (part_column, turn_column)])
+            learning_history[section] = [group.drop(columns=[part_column, turn_column]).to_dict(orient="records")
+                                         for _, group in df.groupby(part_column, sort=True)]
+        else:
+            learning_history[section] = df.drop(columns=[df.columns[0]]).to_dict(orient="records")
+    return learning_history
+
+
+def parse_session(logging_dir, session):
+    # Runs in a worker process. Returns (turn rows, timing rows) of one session
+    session_dir = os.path.join(logging_dir, session)
+    child_id, timestamp = os.path.split(os.path.normpath(session))
+    log_file = os.path.join(session_dir, "program_info.log")
+    episode = _episode_name(log_file)
+
+    store_file = os.path.join(session_dir, "learning_history.jsonl")
+    xlsx_file = os.path.join(session_dir, "learning_result.xlsx")
+    if os.path.exists(store_file):
+        learning_history = read_learning_history(store_file)
+    elif os.path.exists(xlsx_file):
+        learning_history = _learning_history_from_excel(xlsx_file)
+    else:
+        learning_history = {}
+
+    turn_rows = []
+    for section, turns in learning_history.items():
+        parts = turns if section == "episode" else [turns]
+        for part_idx, part_turns in enumerate(parts):
+            for turn_idx, turn in enumerate(part_turns):
+                turn_rows.append({
+                    "child_id": child_id,
+                    "session": timestamp,
+                    "episode": episode,
+                    "section": section,
+                    "part": part_idx if section == "episode" else None,
+                    "turn": turn_idx,
+                    "question": str(turn.get("question", "")),
+                    "level": turn.get("level"),
+                    "answer": str(turn.get("answer", "")),
+                    "accuracy": turn.get("accuracy"),
+                    "feedback": str(turn.get("feedback", "")),
+                })
+
+    timing_rows = []
+    if os.path.exists(log_file):
+        with open(log_file, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                match = TIMING_PATTERN.match(line)
+                if match:
+                    timing_rows.append({
+                        "child_id": child_id,
+                        "session": timestamp,
+                        "time": match.group(1),
+                        "function": match.group(2) or match.group(3),
+                        "seconds": float(match.group(4)),
+                    })
+    return turn_rows, timing_rows
+
+
+def _load_index(output_dir):
+    index_file = os.path.join(output_dir, "index.json")
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_index(output_dir, index):
+    index_file = os.path.join(output_dir, "index.json")
+    with open(f"{index_file}.tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=1)
+    os.replace(f"{index_file}.tmp", index_file)
+
+
+def update_dataset(logging_dir, output_dir, max_workers=None):
+    # Parse new/modified sessions into a new part file of the dataset, returns the number of sessions parsed
+    import pandas as pd
+
+    os.makedirs(os.path.join(output_dir, "turns"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "timings"), exist_ok=True)
+    index = _load_index(output_dir)
+    pending = {}
+    for session in find_sessions(logging_dir):
+        signature = session_signature(os.path.join(logging_dir, session))
+        if session not in index or index[session]["signature"] != signature:
+            pending[session] = signature
+    if not pending:
+        return 0
+
+    part = f"{time.strftime('%y%m%d_%H%M%S')}_{os.getpid()}"
+    turn_rows, timing_rows = [], []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(parse_session, [logging_dir] * len(pending), list(pending),
+                               chunksize=max(len(pending) // 64, 1))
+        for session, (session_turns, session_timings) in zip(pending, results):
+            turn_rows.extend(session_turns)
+            timing_rows.extend(session_timings)
+            index[session] = {"signature": pending[session], "part": part}
+
+    for name, rows in [("turns", turn_rows), ("timings", timing_rows)]:
+        if rows:
+            df = pd.DataFrame(rows)
+            df["dataset_part"] = part
+            df.to_parquet(os.path.join(output_dir, name, f"part-{part}.parquet"), index=False)
+    _save_index(output_dir, index)
+    return len(pending)
+
+
+def load_dataset(output_dir, name="turns"):
+    # A re-parsed session has rows in several parts, only the latest part (the one in the index) is kept
+    import pandas as pd
+
+    index = _load_index(output_dir)
+    part_files = sorted(glob.glob(os.path.join(output_dir, name, "*.parquet")))
+    if not part_files:
+        return pd.DataFrame()
+    df = pd.concat([pd.read_parquet(part_file) for part_file in part_files], ignore_index=True)
+    latest_part = (df["child_id"] + os.sep + df["session"]).map(lambda session: index.get(session, {}).get("part"))
+    return df[df["dataset_part"] == latest_part].reset_index(drop=True)
+
+
+def accuracy_per_level(turns):
+    # Mean accuracy and number of answers per episode/section/question level
+    if turns.empty:
+        return turns
+    scored = turns.dropna(subset=["accuracy"])
+    return (scored.groupby(["episode", "section", "level"], dropna=False)["accuracy"]
+            .agg(["mean", "count"]).reset_index())
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Consolidate learning results and timings of all sessions")
+    argparser.add_argument("logging_dir", nargs="?", default="running_logs/")
+    argparser.add_argument("--output", default="analytics/", help="Folder of the consolidated dataset")
+    argparser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    arguments = argparser.parse_args()
+
+    num_parsed = update_dataset(arguments.logging_dir, arguments.output, max_workers=arguments.workers)
+    print(f"Parsed {num_parsed} new or modified sessions")
+    summary = accuracy_per_level(load_dataset(arguments.output, "turns"))
+    summary.to_csv(os.path.join(arguments.output, "accuracy_per_level.csv"), index=False)
+    print(summary.to_string(index=False))
@@ -1,51 +1,222 @@
-from openai import OpenAI
 import json
+import threading
 import time
+from typing import TYPE_CHECKING
+
+import ratelimit
+import tracing
+from json_stream import JSONFieldStream
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+
+def is_request_timeout(exception):
+    # openai.APITimeoutError, or httpx.ReadTimeout raised while a stream is read (openai is only imported by the caller)
+    return type(exception).__name__ in ("APITimeoutError", "ReadTimeout")
 
 
 class GPTAssistant:
     # Create an OpenAI chat assistant.
     # Normally an assistant can have multiple threads but for our purpose we restrict to 1 thread to preserve context
     # This class is mainly just to wrap around OpenAI's API call to make it easier to use
-    def __init__(self, client: OpenAI, assistant_id: str, logger=None):
+    def __init__(self, client: "OpenAI", assistant_id: str, logger=None, thread_id=None, run_timeout=None,
+                 last_messages=None, rollover_tokens=None, context_summary=None):
         self.client = client
-        self.assistant = self.client.beta.assistants.retrieve(assistant_id)
+        self.assistant = ratelimit.call("openai", self.client.beta.assistants.retrieve, assistant_id)
         self.id = assistant_id
         self.logger = logger
 
         # New assistant is basically old assistant but new thread, can rewrite this one maybe
-        self.thread = self.client.beta.threads.create()
+        # A resumed session continues its previous thread, so the conversation context is kept
+        if thread_id:
+            self.thread = ratelimit.call("openai", self.client.beta.threads.retrieve, thread_id)
+        else:
+            self.thread = self.create_thread()
         if self.logger:
             self.logger.debug(f"Current thread's ID: {self.thread.id}")
         self.last_run = None
+        # A run still going after run_timeout seconds is cancelled and TimeoutError is raised (None: wait forever)
+        self.run_timeout = run_timeout
+        # One run at a time on the thread: a converse still running in the background (a late answer past the turn's
+        # latency budget) finishes before the next one is submitted. The next converse waits for it, at most about
+        # run_timeout (then that run is cancelled)
+        self._converse_lock = threading.Lock()
+
+        # Context management, so the input of a run (and its latency) doesn't grow with the whole session:
+        # - last_messages: every run only reads the thread's last N messages
+        # - rollover_tokens: once a run's input goes over this many tokens, the conversation continues on a new thread
+        #   seeded with context_summary() (e.g. the story so far and the learning history)
+        self.last_messages = last_messages
+        self.rollover_tokens = rollover_tokens
+        self.context_summary = context_summary
+        self.thread_ids = [self.thread.id]
+        # Input/output tokens and latency of every converse, in order
+        self.run_stats = []
 
     def submit_message(self, message):
-        self.client.beta.threads.messages.create(
-            thread_id=self.thread.id,
-            role="user",
-            content=message
-        )
-        self.last_run = self.client.beta.threads.runs.create(
-            thread_id=self.thread.id,
-            assistant_id=self.assistant.id
-        )
+        # Every HTTP call to the API gets its own span ("http" category) and goes through the shared OpenAI rate limiter
+        with tracing.span("openai.messages.create", "http"):
+            ratelimit.call(
+                "openai", self.client.beta.threads.messages.create,
+                thread_id=self.thread.id,
+                role="user",
+                content=message
+            )
+        with tracing.span("openai.runs.create", "http"):
+            self.last_run = ratelimit.call(
+                "openai", self.client.beta.threads.runs.create,
+                thread_id=self.thread.id,
+                assistant_id=self.assistant.id,
+                **self._run_options()
+            )
         return self.last_run
 
-    def wait_on_run(self):
-        # Wait until a run is finished or an action is required
-        while self.last_run and self.run_not_finished() and not self.run_requires_action():
-            self.last_run = self.client.beta.threads.runs.retrieve(
+    def create_thread(self):
+        # A new empty thread, e.g. created ahead of time for the next session (see new_thread)
+        with tracing.span("openai.threads.create", "http"):
+            return ratelimit.call("openai", self.client.beta.threads.create)
+
+    def new_thread(self, thread=None):
+        # Start a new conversation (next session) on thread, or on a new one. A converse still running finishes first
+        with self._converse_lock:
+            self.thread = thread or self.create_thread()
+            self.thread_ids = [self.thread.id]
+            self.run_stats = []
+            self.last_run = None
+        if self.logger:
+            self.logger.debug(f"Current thread's ID: {self.thread.id}")
+
+    def _run_options(self):
+        if not self.last_messages:
+            return {}
+        return {"truncation_strategy": {"type": "last_messages", "last_messages": self.last_messages}}
+
+    def rollover(self, summary):
+        # Continue the conversation on a new thread which only holds the summary
+        previous_thread_id = self.thread.id
+        self.thread = self.create_thread()
+        with tracing.span("openai.messages.create", "http"):
+            ratelimit.call("openai", self.client.beta.threads.messages.create, thread_id=self.thread.id, role="user",
+                           content=summary)
+        self.thread_ids.append(self.thread.id)
+        self.last_run = None
+        if self.logger:
+            self.logger.info(f"Assistant thread {previous_thread_id} rolled over to {self.thread.id} "
+                             f"(summary of {len(summary)} characters)")
+
+    def _manage_context(self):
+        if not (self.rollover_tokens and self.context_summary and self.run_stats):
+            return
+        last_stats = self.run_stats[-1]
+        if last_stats["thread_id"] == self.thread.id and (last_stats["input_tokens"] or 0) > self.rollover_tokens:
+            self.rollover(self.context_summary())
+
+    def _record_run_stats(self, start_time):
+        usage = getattr(self.last_run, "usage", None)
+        stats = {
+            "thread_id": self.thread.id,
+            "input_tokens": usage.prompt_tokens if usage else None,
+            "output_tokens": usage.completion_tokens if usage else None,
+            "latency": time.perf_counter() - start_time,
+        }
+        self.run_stats.append(stats)
+        if self.logger:
+            self.logger.debug(f"Run took {stats['latency']:.2f}s, {stats['input_tokens']} input tokens, "
+                              f"{stats['output_tokens']} output tokens")
+
+    def submit_message_streaming(self, message, on_field):
+        # Same as submit_message, but the run's events are streamed until an action is required (or the run ends):
+        # on_field(name, value) is called for each field of the tool call arguments as soon as it's complete
+        with tracing.span("openai.messages.create", "http"):
+            ratelimit.call(
+                "openai", self.client.beta.threads.messages.create,
                 thread_id=self.thread.id,
-                run_id=self.last_run.id,
+                role="user",
+                content=message
             )
-            time.sleep(0.5)
+        deadline = time.perf_counter() + self.run_timeout if self.run_timeout else None
+        # The deadline is checked at every event, a stream that stalls is bounded by the request's own timeout (no
+        # data received for run_timeout seconds)
+        request_options = {"timeout": self.run_timeout} if self.run_timeout else {}
+        argument_streams = {}  # tool call index -> JSONFieldStream
+        with tracing.span("openai.runs.create", "http", stream=True):
+            stream = ratelimit.call(
+                "openai", self.client.beta.threads.runs.create,
+                thread_id=self.thread.id,
+                assistant_id=self.assistant.id,
+                stream=True,
+                **self._run_options(),
+                **request_options
+            )
+            try:
+                for event in stream:
+                    if event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step"):
+                        # Run status changes (created, requires_action, completed...)
+                        self.last_run = event.data
+                    elif event.event == "thread.run.step.delta":
+                        step_details = event.data.delta.step_details
+                        for tool_call in getattr(step_details, "tool_calls", None) or []:
+                            if tool_call.function is None or not tool_call.function.arguments:
+                                continue
+                            fields = argument_streams.setdefault(tool_call.index, JSONFieldStream())
+                            for name, value in fields.feed(tool_call.function.arguments):
+                                on_field(name, value)
+                    if self.last_run and self.last_run.status not in ("queued", "in_progress"):
+                        stream.close()
+                        break
+                    if deadline and time.perf_counter() > deadline:
+                        raise TimeoutError(f"Run {self.last_run.id} not finished after {self.run_timeout}s, "
+                                           f"cancelled")
+            except Exception as e:
+                if not (isinstance(e, TimeoutError) or is_request_timeout(e)):
+                    raise
+                stream.close()
+                if self.last_run:
+                    self.cancel_run()
+                if isinstance(e, TimeoutError):
+                    raise
+                raise TimeoutError(f"Run stream stalled, nothing received for {self.run_timeout}s, cancelled") from e
         return self.last_run
 
+    def wait_on_run(self):
+        # Wait until a run is finished or an action is required
+        deadline = time.perf_counter() + self.run_timeout if self.run_timeout else None
+        with tracing.span("assistant.wait_on_run", "assistant"):
+            while self.last_run and self.run_not_finished() and not self.run_requires_action():
+                if deadline and time.perf_counter() > deadline:
+                    self.cancel_run()
+                    raise TimeoutError(f"Run {self.last_run.id} not finished after {self.run_timeout}s, cancelled")
+                with tracing.span("openai.runs.retrieve", "http"):
+                    self.last_run = ratelimit.call(
+                        "openai", self.client.beta.threads.runs.retrieve,
+                        thread_id=self.thread.id,
+                        run_id=self.last_run.id,
+                    )
+                time.sleep(0.5)
+        return self.last_run
+
+    def cancel_run(self):
+        with tracing.span("openai.runs.cancel", "http"):
+            self.last_run = ratelimit.call("openai", self.client.beta.threads.runs.cancel, thread_id=self.thread.id,
+                                           run_id=self.last_run.id)
+        # The thread doesn't take new messages until the run is actually cancelled
+        for _ in range(20):
+            if self.last_run.status != "cancelling":
+                break
+            time.sleep(0.5)
+            self.last_run = ratelimit.call("openai", self.client.beta.threads.runs.retrieve, thread_id=self.thread.id,
+                                           run_id=self.last_run.id)
+        if self.logger:
+            self.logger.debug(f"Run {self.last_run.id} cancelled ({self.last_run.status})")
+
     # Mainly used for getting a response after submitting a message. Will wait for either response or actions are
     # required
     def get_last_response(self, pretty=True):
         self.wait_on_run()
-        message = next(iter(self.client.beta.threads.messages.list(thread_id=self.thread.id)))
+        with tracing.span("openai.messages.list", "http"):
+            message = next(iter(ratelimit.call("openai", self.client.beta.threads.messages.list,
+                                               thread_id=self.thread.id)))
         if pretty:
             return f"{message.content[0].text.value}"     # TODO: Maybe later but why 0?
         else:
@@ -53,8 +224,14 @@ class GPTAssistant:
             return f"{message.role}: {message.content[0].text.value}"
 
     def get_all_messages(self):
-        self.wait_on_run()
-        all_messages = self.client.beta.threads.messages.list(thread_id=self.thread.id, order="asc")
+        # Messages of every thread of the session (see rollover), oldest first
+        with self._converse_lock:
+            self.wait_on_run()
+            all_messages = []
+            for thread_id in self.thread_ids:
+                with tracing.span("openai.messages.list", "http"):
+                    all_messages.extend(ratelimit.call("openai", self.client.beta.threads.messages.list,
+                                                       thread_id=thread_id, order="asc"))
         results = []
         for message in all_messages:
             results.append(f"{message.role}: {message.content[0].text.value}")
@@ -92,29 +269,45 @@ class GPTAssistant:
 
             json_responses.append(json_output)
 
-        self.last_run = self.client.beta.threads.runs.submit_tool_outputs(
-            thread_id=self.thread.id,
-            run_id=self.last_run.id,
-            tool_outputs=all_tool_outputs
-        )
+        with tracing.span("openai.runs.submit_tool_outputs", "http"):
+            self.last_run = ratelimit.call(
+                "openai", self.client.beta.threads.runs.submit_tool_outputs,
+                thread_id=self.thread.id,
+                run_id=self.last_run.id,
+                tool_outputs=all_tool_outputs
+            )
         return json_responses
 
     # Basically a wrapper for a conversation step. If no tools are specified, it will behave exactly like a chatbot
     # If tools are specified, the assistant will try to use the tools if context fit.
     # The reason we will use tools is to have a foolproof json response format.
-    def converse(self, message, tools=None):
+    # With on_field, the run is streamed and on_field(name, value) gets each field of the tool call arguments as soon as
+    # the model has generated it (e.g. to start speaking before the whole tool call is done)
+    def converse(self, message, tools=None, on_field=None):
         # Update tools used in this message
         if tools is None:
             tools = []
-        api_tools = [{"type": "function", "function": tool} for tool in tools]
-        self.client.beta.assistants.update(assistant_id=self.id, tools=api_tools)
-        self.submit_message(message)
+        with self._converse_lock, tracing.span("assistant.converse", "assistant",
+                                               tools=[tool["name"] for tool in tools]):
+            self._manage_context()
+            start_time = time.perf_counter()
+            api_tools = [{"type": "function", "function": tool} for tool in tools]
+            with tracing.span("openai.assistants.update", "http"):
+                ratelimit.call("openai", self.client.beta.assistants.update, assistant_id=self.id, tools=api_tools)
+            if on_field and tools:
+                self.submit_message_streaming(message, on_field)
+            else:
+                self.submit_message(message)
 
-        if not tools:
-            return self.get_last_response()
+            if not tools:
+                response = self.get_last_response()
+                self._record_run_stats(start_time)
+                return response
 
-        json_response = self.resolve_run_required_action()
-        return self.get_last_response(), json_response
+            json_response = self.resolve_run_required_action()
+            response = self.get_last_response()
+            self._record_run_stats(start_time)
+            return response, json_response
 
     def run_not_finished(self):
         return self.last_run.status == "queued" or self.last_run.status == "in_progress"
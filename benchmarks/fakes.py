@@ -0,0 +1,450 @@
+"""
+Stand-ins for the external services of a session (OpenAI, Google TTS/STT, VLC) for offline benchmarks.
+
+Every fake has the same interface as the real client used by AdaptiveCA, and takes its time from a LatencyModel
+(seeded, so a session takes the same path and the same simulated time on every run). The time each fake spends being
+"busy" (a request in flight, audio playing, the child talking...) is recorded in an ExternalTimeline; whatever is left
+of a turn's wall time is orchestration overhead.
+"""
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import types
+from concurrent.futures import Future, CancelledError
+
+import ratelimit
+
+
+class LatencyModel:
+    # base + per_unit * units seconds (units: characters, ...), +/- jitter (fraction), multiplied by scale
+    def __init__(self, base=0., per_unit=0., jitter=0., scale=1., seed=0):
+        self.base = base
+        self.per_unit = per_unit
+        self.jitter = jitter
+        self.scale = scale
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self, units=0):
+        latency = self.base + self.per_unit * units
+        if self.jitter:
+            with self._lock:
+                latency *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+        return max(latency, 0.) * self.scale
+
+
+# Seconds. openai_run is the server side of a run (from runs.create/submit_tool_outputs until it's done), its units
+# are the run's input tokens (the thread read by the run)
+LATENCY_PROFILES = {
+    "typical": {
+        "openai_http": {"base": 0.08, "jitter": 0.3},
+        "openai_run": {"base": 1.2, "per_unit": 0.0002, "jitter": 0.4},
+        "tts_synthesize": {"base": 0.25, "per_unit": 0.002, "jitter": 0.3},
+        "tts_playback": {"base": 0.3, "per_unit": 0.06, "jitter": 0.},
+        "stt_listen": {"base": 2.5, "jitter": 0.5},
+        "stt_finalize": {"base": 0.4, "jitter": 0.3},
+        "video_switch": {"base": 0.05, "jitter": 0.2},
+        "video_episode": {"base": 3., "jitter": 0.},
+    },
+    # Instant services, what's left is the orchestration alone (poll intervals, threads, logging...)
+    "zero": {
+        "openai_http": {}, "openai_run": {}, "tts_synthesize": {}, "tts_playback": {}, "stt_listen": {},
+        "stt_finalize": {}, "video_switch": {}, "video_episode": {},
+    },
+}
+
+
+def make_latency_models(profile="typical", scale=1., seed=0):
+    return {name: LatencyModel(scale=scale, seed=seed + idx, **params)
+            for idx, (name, params) in enumerate(LATENCY_PROFILES[profile].items())}
+
+
+class ExternalTimeline:
+    # [start, end] of everything the fakes spend time on, from any thread
+    def __init__(self):
+        self.intervals = []
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, start, end):
+        with self._lock:
+            self.intervals.append((start, end))
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def busy(self, kind, duration):
+        # Block the calling thread for duration seconds, recorded as external time
+        start = time.perf_counter()
+        time.sleep(duration)
+        self.add(kind, start, time.perf_counter())
+
+    def covered(self, start, end):
+        # Time between start and end during which at least one external service was busy
+        with self._lock:
+            intervals = sorted((max(s, start), min(e, end)) for s, e in self.intervals if s < end and e > start)
+        covered, current_start, current_end = 0., None, None
+        for s, e in intervals:
+            if current_end is None or s > current_end:
+                if current_end is not None:
+                    covered += current_end - current_start
+                current_start, current_end = s, e
+            else:
+                current_end = max(current_end, e)
+        if current_end is not None:
+            covered += current_end - current_start
+        return covered
+
+
+# OpenAI --------------------------------------------------------------------------------------------------------------
+class _FakeRun:
+    def __init__(self, run_id, duration, tools, timeline, input_tokens=0):
+        self.id = run_id
+        self.tools = tools
+        self.required_action = None
+        self.cancelled = False
+        self.usage = types.SimpleNamespace(prompt_tokens=input_tokens, completion_tokens=0,
+                                           total_tokens=input_tokens)
+        self._tool_phase = bool(tools)
+        self._timeline = timeline
+        self._start(duration)
+
+    def _start(self, duration):
+        self._started = time.perf_counter()
+        self._done_at = self._started + duration
+        self._timeline.add("openai.run", self._started, self._done_at)
+
+    @property
+    def status(self):
+        if self.cancelled:
+            return "cancelled"
+        if time.perf_counter() < self._done_at:
+            return "in_progress"
+        return "requires_action" if self._tool_phase else "completed"
+
+
+class _FakeRunStream:
+    # Events of a streamed run (runs.create(stream=True)): the tool call arguments arrive in chunks spread evenly over
+    # the run's duration, then the run requires action
+    def __init__(self, run, chunk_size=8):
+        self.run = run
+        self.chunk_size = chunk_size
+        self._closed = False
+
+    @staticmethod
+    def _event(name, data):
+        return types.SimpleNamespace(event=name, data=data)
+
+    def _wait_until(self, moment):
+        time.sleep(max(moment - time.perf_counter(), 0.))
+
+    def __iter__(self):
+        run = self.run
+        yield self._event("thread.run.created", run)
+        chunks = []
+        if run.required_action:
+            arguments = run.required_action.submit_tool_outputs.tool_calls[0].function.arguments
+            chunks = [arguments[i:i + self.chunk_size] for i in range(0, len(arguments), self.chunk_size)]
+        duration = run._done_at - run._started
+        for idx, chunk in enumerate(chunks):
+            self._wait_until(run._started + duration * (idx + 1) / (len(chunks) + 1))
+            if self._closed:
+                return
+            tool_call = types.SimpleNamespace(index=0, function=types.SimpleNamespace(arguments=chunk))
+            yield self._event("thread.run.step.delta", types.SimpleNamespace(
+                delta=types.SimpleNamespace(step_details=types.SimpleNamespace(type="tool_calls",
+                                                                               tool_calls=[tool_call]))))
+        self._wait_until(run._done_at)
+        if not self._closed:
+            yield self._event(f"thread.run.{run.status}", run)
+
+    def close(self):
+        self._closed = True
+
+
+class FakeOpenAI:
+    # Enough of client.beta (assistants, threads, messages, runs) for GPTAssistant. Tool calls are answered with
+    # scripted, seeded arguments; plain messages get a short canned reply
+    def __init__(self, latency_models, timeline, seed=0):
+        self.latency_models = latency_models
+        self.timeline = timeline
+        self._rng = random.Random(seed)
+        self._ids = itertools.count(1)
+        self._tools = []
+        self._messages = {}  # thread id -> [(role, text)]
+        self._runs = {}
+        self.beta = types.SimpleNamespace(
+            assistants=types.SimpleNamespace(retrieve=self._retrieve_assistant, update=self._update_assistant),
+            threads=types.SimpleNamespace(
+                create=self._create_thread, retrieve=self._retrieve_thread,
+                messages=types.SimpleNamespace(create=self._create_message, list=self._list_messages),
+                runs=types.SimpleNamespace(create=self._create_run, retrieve=self._retrieve_run,
+                                           submit_tool_outputs=self._submit_tool_outputs, cancel=self._cancel_run),
+            ),
+        )
+
+    def _http(self, kind):
+        self.timeline.busy(kind, self.latency_models["openai_http"].sample())
+
+    def _retrieve_assistant(self, assistant_id):
+        self._http("openai.assistants.retrieve")
+        return types.SimpleNamespace(id=assistant_id, model_dump=lambda: {"id": assistant_id})
+
+    def _update_assistant(self, assistant_id, tools=None, **kwargs):
+        self._http("openai.assistants.update")
+        if tools is not None:
+            self._tools = [tool["function"] for tool in tools]
+
+    def _create_thread(self):
+        self._http("openai.threads.create")
+        thread_id = f"thread_fake{next(self._ids)}"
+        self._messages[thread_id] = []
+        return types.SimpleNamespace(id=thread_id)
+
+    def _retrieve_thread(self, thread_id):
+        self._http("openai.threads.retrieve")
+        self._messages.setdefault(thread_id, [])
+        return types.SimpleNamespace(id=thread_id)
+
+    def _create_message(self, thread_id, role, content):
+        self._http("openai.messages.create")
+        self._messages[thread_id].append((role, content))
+
+    def _list_messages(self, thread_id, order="desc"):
+        self._http("openai.messages.list")
+        messages = [types.SimpleNamespace(role=role, content=[types.SimpleNamespace(
+            text=types.SimpleNamespace(value=text))]) for role, text in self._messages[thread_id]]
+        return messages if order == "asc" else messages[::-1]
+
+    def _input_tokens(self, thread_id, truncation_strategy=None):
+        # About 4 characters per token: the thread's messages (the last N with a truncation strategy) and the tools
+        messages = self._messages[thread_id]
+        if truncation_strategy and truncation_strategy.get("type") == "last_messages":
+            messages = messages[-truncation_strategy["last_messages"]:]
+        characters = sum(len(text) for _, text in messages) + len(json.dumps(self._tools))
+        return characters // 4
+
+    def _create_run(self, thread_id, assistant_id, stream=False, truncation_strategy=None, timeout=None):
+        self._http("openai.runs.create")
+        input_tokens = self._input_tokens(thread_id, truncation_strategy)
+        run = _FakeRun(f"run_fake{next(self._ids)}", self.latency_models["openai_run"].sample(input_tokens),
+                       self._tools, self.timeline, input_tokens)
+        run.thread_id = thread_id
+        if run.tools:
+            last_message = self._messages[thread_id][-1][1]
+            tool_calls = [types.SimpleNamespace(id=f"call_fake{next(self._ids)}", function=types.SimpleNamespace(
+                name=tool["name"], arguments=json.dumps(self._tool_arguments(tool["name"], last_message))))
+                for tool in run.tools[:1]]
+            run.required_action = types.SimpleNamespace(
+                submit_tool_outputs=types.SimpleNamespace(tool_calls=tool_calls))
+        else:
+            self._messages[thread_id].append(("assistant", "Okay!"))
+        self._runs[run.id] = run
+        return _FakeRunStream(run) if stream else run
+
+    def _retrieve_run(self, thread_id, run_id):
+        self._http("openai.runs.retrieve")
+        return self._runs[run_id]
+
+    def _cancel_run(self, thread_id, run_id):
+        self._http("openai.runs.cancel")
+        run = self._runs[run_id]
+        run.cancelled = True
+        return run
+
+    def _submit_tool_outputs(self, thread_id, run_id, tool_outputs):
+        self._http("openai.runs.submit_tool_outputs")
+        run = self._runs[run_id]
+        run._tool_phase = False
+        run._start(self.latency_models["openai_run"].sample(run.usage.prompt_tokens))
+        # The tool outputs step reads the thread again, usage adds up over the run's steps
+        run.usage.prompt_tokens *= 2
+        run.usage.total_tokens = run.usage.prompt_tokens
+        self._messages[thread_id].append(("assistant", "Done."))
+        return run
+
+    def _tool_arguments(self, name, message):
+        if name == "generate_feedback":
+            return {"accuracy": self._rng.choice([1., 1., 0.5, 0.]), "evaluation": "Good thinking!",
+                    "explanation": "Ari's shirt got smaller because he grew taller.",
+                    "transition": "Let's try another question."}
+        if name == "generate_feedback_pretest":
+            return {"question": "", "answer": "", "accuracy": self._rng.choice([1., 0.5, 0.]),
+                    "feedback": "Thank you for your answer!"}
+        if name == "select_question":
+            # First bank row (id|level|question) of the requested level
+            level = re.search(r"Select a (\w+) question", message)
+            level = level.group(1).upper() if level else "INTERMEDIATE"
+            rows = re.findall(r"^([^|\n]+)\|(\w+)\|", message, re.MULTILINE)
+            question_id = next((row_id for row_id, row_level in rows if row_level == level), rows[0][0] if rows else "")
+            return {"question_id": question_id, "rationale": "Scripted selection"}
+        if name == "simplify_question":
+            return {"question": "Is the shirt too small, yes or no?"}
+        return {}
+
+
+# TTS / STT -----------------------------------------------------------------------------------------------------------
+class FakePlayback:
+    # Same interface as multimedia.audio_player.AudioPlayback
+    def __init__(self, duration, timeline):
+        self.duration = duration
+        self.gain = 1.
+        self._timeline = timeline
+        self._finished = threading.Event()
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        threading.Timer(self.duration, self.stop).start()
+        return self
+
+    @property
+    def is_playing(self):
+        return not self._finished.is_set()
+
+    def duck(self, gain=0.2):
+        self.gain = gain
+
+    def stop(self):
+        if not self._finished.is_set():
+            self._finished.set()
+            self._timeline.add("tts.playback", self._start, time.perf_counter())
+
+    def wait(self, timeout=None):
+        return self._finished.wait(timeout)
+
+
+class FakeTTSClient:
+    def __init__(self, latency_models, timeline, output_dir=None, logger=None):
+        self.latency_models = latency_models
+        self.timeline = timeline
+        self.output_dir = output_dir
+        self.logger = logger
+        self.file_idx = 0
+        self._file_idx_lock = threading.Lock()
+        self._presynthesized = {}
+
+    def synthesize(self, text):
+        ratelimit.acquire("tts")
+        self.timeline.busy("tts.synthesize", self.latency_models["tts_synthesize"].sample(len(text)))
+        # Nothing is written, the path is only logged
+        with self._file_idx_lock:
+            file_path = os.path.join(self.output_dir or "", f"{self.file_idx:03}.wav")
+            self.file_idx += 1
+        return file_path
+
+    def presynthesize(self, text):
+        if text.strip() and text not in self._presynthesized:
+            self._presynthesized[text] = self.synthesize(text)
+
+    def _speech_file(self, text):
+        return self._presynthesized.pop(text, None) or self.synthesize(text)
+
+    def text_to_speech(self, text):
+        if not text.strip():
+            return
+        self._speech_file(text)
+        self.timeline.busy("tts.playback", self.latency_models["tts_playback"].sample(len(text)))
+
+    def text_to_speech_non_blocking(self, text):
+        if not text.strip():
+            return None
+        self._speech_file(text)
+        return FakePlayback(self.latency_models["tts_playback"].sample(len(text)), self.timeline).start()
+
+
+class FakeSTTStreamingClient:
+    # Answers come from a script (cycled), the child talks for stt_listen seconds then the server takes stt_finalize
+    def __init__(self, latency_models, timeline, answers, output_dir=None, logger=None):
+        self.latency_models = latency_models
+        self.timeline = timeline
+        self._answers = itertools.cycle(answers)
+        self.output_dir = output_dir
+        self.logger = logger
+        self.file_idx = 0
+        self.rate, self.audio_channels = 16000, 1
+
+    def next_recording_file(self):
+        self.file_idx += 1
+        return None
+
+    def speech_to_text(self):
+        self.next_recording_file()
+        ratelimit.acquire("stt")
+        self.timeline.busy("stt.listen", self.latency_models["stt_listen"].sample())
+        self.timeline.busy("stt.finalize", self.latency_models["stt_finalize"].sample())
+        return next(self._answers)
+
+
+# Video ---------------------------------------------------------------------------------------------------------------
+class FakePlaybackFuture(Future):
+    # Same interface as multimedia.video_player.PlaybackFuture
+    def __init__(self, video_path):
+        super().__init__()
+        self.video_path = video_path
+
+    def join(self, timeout=None):
+        try:
+            self.result(timeout)
+        except (TimeoutError, CancelledError):
+            pass
+
+
+class FakeVideoPlayer:
+    # Episode videos play for video_episode seconds (capped by max_duration), looping clips never end on their own
+    def __init__(self, latency_models, timeline, logger=None):
+        self.latency_models = latency_models
+        self.timeline = timeline
+        self.logger = logger
+        self.media_pool = {}
+        self.loop_paths = set()
+        self._current = None
+        self._lock = threading.Lock()
+
+    def preload(self, video_paths, loop_paths=()):
+        for video_path in list(video_paths) + list(loop_paths):
+            self.media_pool[video_path] = None
+        self.loop_paths.update(loop_paths)
+
+    def _replace_current(self, future, reason="replaced"):
+        with self._lock:
+            previous, self._current = self._current, future
+        if previous is not None and not previous.done():
+            previous.set_result(reason)
+
+    def play_video_non_blocking(self, video_path, max_duration=None, stop_when_finished=True):
+        future = FakePlaybackFuture(video_path)
+        if (video_path in self.loop_paths and self._current is not None
+                and self._current.video_path == video_path and not self._current.done()):
+            self._replace_current(future)
+            return future
+        self._replace_current(future)
+        self.timeline.busy("video.switch", self.latency_models["video_switch"].sample())
+        if video_path not in self.loop_paths:
+            duration = self.latency_models["video_episode"].sample()
+            if max_duration is not None:
+                duration = min(duration, max_duration)
+            start = time.perf_counter()
+
+            def finish():
+                if not future.done():
+                    future.set_result("ended")
+                self.timeline.add("video.episode", start, time.perf_counter())
+            threading.Timer(duration, finish).start()
+        return future
+
+    def play_video(self, video_path, max_duration=None, stop_when_finished=True):
+        future = self.play_video_non_blocking(video_path, max_duration, stop_when_finished)
+        future.join()
+        return future.result() if future.done() else None
+
+    def stop_video(self):
+        self._replace_current(None, "stopped")
+
+    def pause_video(self):
+        self._replace_current(None, "stopped")
+
+    def close(self):
+        self.stop_video()
@@ -0,0 +1,113 @@
+"""
+Measures what logging costs the threads doing the actual work (turn loop, TTS, video...), with the handlers attached
+directly to the logger (previous setup) vs. behind a QueueHandler + background QueueListener (current setup).
+
+Reported per mode, for the calling threads only:
+* latency of a logger.debug/info call (mean and p99)
+* time spent waiting for handler locks (contention between threads logging at the same time)
+* time spent flushing handlers (file/console I/O)
+
+    python -m benchmarks.logging_overhead --threads 4 --records 2000
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+import utils
+
+
+class HandlerTimer:
+    # Wraps acquire/flush of handlers to add up the time the calling threads spend in them
+    def __init__(self, handlers, calling_threads):
+        self.calling_threads = calling_threads
+        self.lock_wait = 0.
+        self.flush_time = 0.
+        self._lock = threading.Lock()
+        for handler in handlers:
+            handler.acquire = self._timed(handler.acquire, "lock_wait")
+            handler.flush = self._timed(handler.flush, "flush_time")
+
+    def _timed(self, func, counter):
+        def wrapper():
+            start = time.perf_counter()
+            func()
+            if threading.current_thread().name in self.calling_threads:
+                with self._lock:
+                    setattr(self, counter, getattr(self, counter) + time.perf_counter() - start)
+        return wrapper
+
+
+def make_handlers(log_dir):
+    debug_handler = logging.FileHandler(os.path.join(log_dir, "program_info.log"))
+    debug_handler.setFormatter(logging.Formatter("%(asctime)s - [%(levelname)s] - %(message)s"))
+    # Console output redirected to a file, same I/O path without flooding the terminal
+    console_handler = logging.StreamHandler(open(os.path.join(log_dir, "console.log"), "w"))
+    console_handler.setLevel(logging.INFO)
+    info_handler = logging.FileHandler(os.path.join(log_dir, "assistant_info.log"))
+    info_handler.setLevel(logging.INFO)
+    return [debug_handler, console_handler, info_handler]
+
+
+def run(mode, num_threads, num_records, log_dir):
+    logger = logging.getLogger(f"logging_overhead_{mode}")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    handlers = make_handlers(log_dir)
+    thread_names = {f"worker-{idx}" for idx in range(num_threads)}
+    listener = None
+    if mode == "direct":
+        for handler in handlers:
+            logger.addHandler(handler)
+        timer = HandlerTimer(handlers, thread_names)
+    else:
+        listener = utils.attach_queue_logging(logger, handlers)
+        timer = HandlerTimer(logger.handlers, thread_names)
+
+    # Roughly the size of the tool call dumps in GPTAssistant.resolve_run_required_action
+    payload = {"accuracy": 1, "evaluation": "Great job!", "explanation": "x" * 300, "transition": "Let's keep going!"}
+    latencies = [[] for _ in range(num_threads)]
+
+    def work(idx):
+        for record_idx in range(num_records):
+            start = time.perf_counter()
+            if record_idx % 4 == 0:
+                logger.info(f"Response: record {record_idx}")
+            else:
+                logger.debug(payload)
+            latencies[idx].append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=work, args=(idx,), name=f"worker-{idx}") for idx in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - start
+    if listener:
+        utils.stop_queue_logging(listener)
+    for handler in handlers:
+        handler.close()
+
+    all_latencies = sorted(latency for thread_latencies in latencies for latency in thread_latencies)
+    return {
+        "mean_call_us": statistics.mean(all_latencies) * 1e6,
+        "p99_call_us": all_latencies[int(len(all_latencies) * 0.99)] * 1e6,
+        "lock_wait_ms": timer.lock_wait * 1e3,
+        "flush_ms": timer.flush_time * 1e3,
+        "calling_threads_wall_ms": wall_time * 1e3,
+    }
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Logging cost on the calling threads, direct vs queued handlers")
+    argparser.add_argument("--threads", type=int, default=4)
+    argparser.add_argument("--records", type=int, default=2000, help="Records logged per thread")
+    arguments = argparser.parse_args()
+    for logging_mode in ["direct", "queued"]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = run(logging_mode, arguments.threads, arguments.records, tmp_dir)
+        print(f"{logging_mode:>7}: " + ", ".join(f"{key} {value:.1f}" for key, value in results.items()))
@@ -0,0 +1,218 @@
+"""
+Offline benchmark of a complete session (run_adaptive_learning_program or run_pretest_program) on the bundled
+lucky_shirt content, with the fakes of benchmarks/fakes.py instead of OpenAI, Google TTS/STT and VLC.
+
+Reported for each turn (begin_turn -> record_turn): wall time, and orchestration overhead, the part of the turn during
+which none of the (fake) external services was busy (poll intervals, thread hand-offs, logging, content lookups...).
+Results are compared with the stored baseline of the same program/profile (benchmarks/baselines/):
+    python -m benchmarks.session_benchmark --program adaptive --profile typical
+    python -m benchmarks.session_benchmark --program adaptive --profile typical --save-baseline
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import yaml
+
+import ratelimit
+import utils
+from adaptive_ca import AdaptiveCA
+from assistant import GPTAssistant
+from benchmarks.fakes import (make_latency_models, ExternalTimeline, FakeOpenAI, FakeTTSClient,
+                              FakeSTTStreamingClient, FakeVideoPlayer)
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+# Child answers, cycled
+SCRIPTED_ANSWERS = ["His shirt is too small", "I don't know", "Because he grew bigger", "Yes", "He was sad", "No"]
+# Metrics compared with the baseline, a change above the tolerance is flagged
+COMPARED_METRICS = ["session_wall_time", "turn_wall_mean", "turn_overhead_mean", "turn_overhead_p90",
+                    "answer_to_feedback_mean"]
+
+
+class BenchmarkCA(AdaptiveCA):
+    # AdaptiveCA with every external service replaced by a fake. The orchestration code (turn loops, threads, logging,
+    # history store, checkpoints) is the real one
+    def __init__(self, config_file, latency_models, timeline, pretest_only=False, resume_dir=None):
+        self.latency_models = latency_models
+        self.timeline = timeline
+        self.turns = []
+        super().__init__(config_file, text_only=False, pretest_only=pretest_only, resume_dir=resume_dir)
+
+    def _init_logging(self):
+        super()._init_logging()
+        # Keep the console for the benchmark report, the log files are still written
+        for handler in self.log_listener.handlers:
+            if type(handler) is logging.StreamHandler:
+                handler.setLevel(logging.WARNING)
+
+    def _sanity_check(self):
+        # No keys or video files needed, only the episode range
+        self.start_video_idx, self.end_video_idx = self._episode_video_range(None)
+
+    def _episode_video_range(self, video_dir):
+        start_video_idx = self.config["video_settings"]["start_episode"]
+        return start_video_idx, start_video_idx + self.config["video_settings"]["max_videos"]
+
+    def _initialize_assistant(self):
+        self.client = FakeOpenAI(self.latency_models, self.timeline)
+        self.assistant = GPTAssistant(self.client, self.config["OpenAI_assistant"]["id"], logger=self.logger,
+                                      **self.assistant_options())
+
+    def _init_multimedia_module(self):
+        self.tts_client = FakeTTSClient(self.latency_models, self.timeline, logger=self.logger)
+        self.stt_client = FakeSTTStreamingClient(self.latency_models, self.timeline, SCRIPTED_ANSWERS,
+                                                 logger=self.logger)
+        self.video_player = FakeVideoPlayer(self.latency_models, self.timeline, logger=self.logger)
+        self.video_player.preload(self.first_part_videos(),
+                                  loop_paths=[self.video_path_list["idle"], self.video_path_list["lip_flap"]])
+
+    def record_turn(self, section, record, episode=None):
+        record_id = super().record_turn(section, record, episode=episode)
+        self.turns.append((section, self._turn_start, time.perf_counter()))
+        return record_id
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.
+
+
+def run_session(program="adaptive", profile="typical", scale=1., parts=2, seed=0,
+                config_file="configs/sample_config.yaml"):
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+    log_dir = tempfile.mkdtemp(prefix="session_benchmark_")
+    config["logging"]["logging_dir"] = log_dir
+    config["video_settings"].update({"start_episode": 1, "max_videos": parts})
+    config["stt_settings"].setdefault("barge_in", {})["enabled"] = False
+    # The production rate limits would measure limiter sleeps on the fakes instead of the orchestration overhead
+    config["rate_limits"] = None
+    # The baselines were recorded with the opt-in turn modes on (off in the shipped config)
+    config["turn_settings"].update({"latency_budget": 8, "pretest_grading": "deferred", "stream_feedback": True})
+    config["assistant_context"] = dict(config.get("assistant_context") or {}, rollover_tokens=4000)
+    benchmark_config_file = os.path.join(log_dir, "config.yaml")
+    with open(benchmark_config_file, "w") as f:
+        yaml.safe_dump(config, f)
+
+    timeline = ExternalTimeline()
+    start = time.perf_counter()
+    agent = BenchmarkCA(benchmark_config_file, make_latency_models(profile, scale, seed), timeline,
+                        pretest_only=program == "pretest")
+    startup_time = time.perf_counter() - start
+    start = time.perf_counter()
+    if program == "pretest":
+        agent.run_pretest_program()
+    else:
+        agent.run_adaptive_learning_program()
+    session_wall_time = time.perf_counter() - start
+    finished = agent.position["section"] == "done"
+    agent.history_store.close()
+    utils.stop_queue_logging(agent.log_listener)
+    # The logger is shared by every AdaptiveCA of the process
+    for handler in list(agent.logger.handlers):
+        agent.logger.removeHandler(handler)
+    shutil.rmtree(log_dir, ignore_errors=True)
+    if not finished:
+        raise RuntimeError(f"Session stopped at {agent.position}, see the exception above")
+
+    input_tokens = [stats["input_tokens"] or 0 for stats in agent.assistant.run_stats]
+    turn_walls, turn_overheads, sections = [], [], {}
+    for section, turn_start, turn_end in agent.turns:
+        wall = turn_end - turn_start
+        overhead = wall - timeline.covered(turn_start, turn_end)
+        turn_walls.append(wall)
+        turn_overheads.append(overhead)
+        section_stats = sections.setdefault(section, {"turns": 0, "wall": 0., "overhead": 0.})
+        section_stats["turns"] += 1
+        section_stats["wall"] += wall
+        section_stats["overhead"] += overhead
+    return {
+        "program": program,
+        "profile": profile,
+        "scale": scale,
+        "parts": parts,
+        "seed": seed,
+        "turns": len(agent.turns),
+        "startup_time": startup_time,
+        "session_wall_time": session_wall_time,
+        "turn_wall_mean": statistics.mean(turn_walls),
+        "turn_overhead_mean": statistics.mean(turn_overheads),
+        "turn_overhead_p90": _percentile(turn_overheads, 0.9),
+        "turn_overhead_max": max(turn_overheads),
+        # Child's answer -> first feedback sent to TTS
+        "answer_to_feedback_mean": statistics.mean(agent.answer_to_feedback),
+        # Runs of the session's assistant thread(s), e.g. none in a pretest graded in the background
+        "assistant_input_tokens_mean": statistics.mean(input_tokens or [0]),
+        "assistant_input_tokens_max": max(input_tokens, default=0),
+        "assistant_threads": len(agent.assistant.thread_ids),
+        "sections": sections,
+        "external_calls": timeline.calls,
+        "fallbacks": agent.fallback_counts,
+        # Requests per service and priority class, how many waited for the rate limiter and for how long
+        "rate_limit_waits": ratelimit.stats(),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def baseline_file(program, profile):
+    return os.path.join(BASELINE_DIR, f"{program}_{profile}.json")
+
+
+def compare(result, baseline, tolerance=0.1):
+    # Lines of metric, baseline, current, relative change; flagged when the change is above tolerance
+    lines = []
+    if baseline["turns"] != result["turns"]:
+        lines.append(f"Turn count changed: {baseline['turns']} -> {result['turns']} (session path differs)")
+    for metric in COMPARED_METRICS:
+        if metric not in baseline:
+            # Added after the baseline was recorded
+            continue
+        change = (result[metric] - baseline[metric]) / baseline[metric] if baseline[metric] else 0.
+        flag = " <-- regression" if change > tolerance else (" <-- improvement" if change < -tolerance else "")
+        lines.append(f"{metric:<28}{baseline[metric]:>10.3f}s{result[metric]:>10.3f}s{change:>+9.1%}{flag}")
+    return lines
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Offline benchmark of a full session with fake services")
+    argparser.add_argument("--program", choices=["adaptive", "pretest"], default="adaptive")
+    argparser.add_argument("--profile", choices=["typical", "zero"], default="typical")
+    argparser.add_argument("--scale", type=float, default=0.25, help="Multiplier of every fake latency")
+    argparser.add_argument("--parts", type=int, default=2, help="Number of episode parts (adaptive program)")
+    argparser.add_argument("--seed", type=int, default=0)
+    argparser.add_argument("--tolerance", type=float, default=0.1, help="Relative change flagged in the comparison")
+    argparser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    arguments = argparser.parse_args()
+
+    session_result = run_session(arguments.program, arguments.profile, arguments.scale, arguments.parts,
+                                 arguments.seed)
+    session_result["commit"] = _commit()
+    print(json.dumps(session_result, indent=1))
+
+    stored_baseline_file = baseline_file(arguments.program, arguments.profile)
+    if arguments.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        with open(stored_baseline_file, "w") as f:
+            json.dump(session_result, f, indent=1)
+        print(f"Baseline saved to {stored_baseline_file}")
+    elif os.path.exists(stored_baseline_file):
+        with open(stored_baseline_file) as f:
+            stored_baseline = json.load(f)
+        if any(stored_baseline[key] != session_result[key] for key in ["scale", "parts", "seed"]):
+            print("Baseline was recorded with different --scale/--parts/--seed, not comparable")
+        else:
+            print(f"Compared with baseline of commit {stored_baseline.get('commit')}:")
+            print("\n".join(compare(session_result, stored_baseline, arguments.tolerance)))
@@ -0,0 +1,223 @@
+"""
+Record/replay of a session's external I/O.
+
+Record mode appends every request/response pair to the session cassette (cassette.jsonl in the session's log folder),
+with how long the call took: assistant turns (GPTAssistant.converse, including the tool call outputs), child
+transcripts (STT) and synthesized speech (TTS, the wav files stay in the session's assistant_tts/ folder).
+Replay mode drives AdaptiveCA from a cassette without any network access, at the recorded speed or as fast as possible:
+    python adaptive_ca.py --record
+    python adaptive_ca.py --mode terminal --replay running_logs/0001/240101_120000/ --replay-speed 0
+"""
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Cassette:
+    def __init__(self, file_path, mode="record", speed=1., logger=None):
+        # speed: 1 replays at the recorded speed, 2 twice as fast..., 0 without waiting at all
+        self.file_path = file_path
+        self.mode = mode
+        self.speed = speed
+        self.logger = logger
+        self.base_dir = os.path.dirname(os.path.abspath(file_path))
+        self.mismatches = 0
+        self._lock = threading.Lock()
+        self.header = {}
+        if mode == "record":
+            self._file = None
+            self.open(file_path)
+        else:
+            self._entries = collections.defaultdict(collections.deque)
+            with open(file_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Last line cut short by a crash
+                        continue
+                    if entry["kind"] == "session":
+                        self.header = entry["response"]
+                    else:
+                        self._entries[entry["kind"]].append(entry)
+
+    def open(self, file_path):
+        # Record mode: the next entries go to file_path (e.g. the next kiosk session's folder), the clients wrapped by
+        # record_* keep recording to this cassette
+        with self._lock:
+            if self._file and not self._file.closed:
+                self._file.close()
+            self.file_path = file_path
+            self.base_dir = os.path.dirname(os.path.abspath(file_path))
+            self._file = open(file_path, "a", encoding="utf-8")
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.debug(message)
+        else:
+            print(message)
+
+    def record(self, kind, request, response, duration=0.):
+        entry = {"time": time.time(), "kind": kind, "request": request, "response": response, "duration": duration}
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def replay(self, kind, request, match_key=None):
+        # Next recorded response of this kind. With match_key, the next entry whose request has the same value for
+        # that key is preferred (e.g. TTS of the same text), otherwise entries are used in order
+        with self._lock:
+            entries = self._entries[kind]
+            if not entries:
+                raise RuntimeError(f"Cassette {self.file_path} has no more {kind} entries")
+            entry = None
+            if match_key is not None:
+                entry = next((candidate for candidate in entries
+                              if candidate["request"].get(match_key) == request.get(match_key)), None)
+            if entry is None:
+                entry = entries[0]
+            entries.remove(entry)
+            if entry["request"] != request:
+                self.mismatches += 1
+        if entry["request"] != request:
+            self._log(f"Cassette: {kind} request differs from the recorded one (session diverged)")
+        if self.speed > 0:
+            time.sleep(entry["duration"] / self.speed)
+        return entry["response"]
+
+    def close(self):
+        if self.mode == "record":
+            with self._lock:
+                self._file.close()
+        elif self.mismatches:
+            self._log(f"Cassette: {self.mismatches} requests differed from the recording")
+
+
+# Record mode: the real clients' methods are wrapped on the instance ------------------------------------------------
+def _recorded(cassette, kind, func, make_request, make_response):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        cassette.record(kind, make_request(*args, **kwargs), make_response(result), time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+def record_session(cassette, assistant):
+    # Header of the cassette, the replayed assistant takes its ids
+    cassette.record("session", {}, {"thread_id": assistant.thread.id, "assistant_id": assistant.id})
+
+
+def record_assistant(cassette, assistant):
+    def make_response(result):
+        if isinstance(result, tuple):
+            return {"response": result[0], "json_responses": result[1]}
+        return {"response": result, "json_responses": None}
+
+    record_session(cassette, assistant)
+    assistant.converse = _recorded(
+        cassette, "openai.converse", assistant.converse,
+        lambda message, tools=None, on_field=None: {"message": message,
+                                                    "tools": [tool["name"] for tool in tools or []]},
+        make_response)
+
+
+def record_stt(cassette, stt_client, barge_in_listener=None):
+    # Barge-in answers are transcripts too, replayed in the same order
+    stt_client.speech_to_text = _recorded(cassette, "stt.speech_to_text", stt_client.speech_to_text,
+                                          lambda: {}, lambda transcript: {"transcript": transcript})
+    if barge_in_listener:
+        barge_in_listener.listen = _recorded(cassette, "stt.speech_to_text", barge_in_listener.listen,
+                                             lambda playback: {}, lambda transcript: {"transcript": transcript})
+
+
+def record_tts(cassette, tts_client):
+    tts_client.synthesize = _recorded(cassette, "tts.synthesize", tts_client.synthesize,
+                                      lambda text: {"text": text},
+                                      lambda file_path: {"file": os.path.relpath(file_path, cassette.base_dir)})
+
+
+# Replay mode: stand-ins for the clients, nothing goes over the network ----------------------------------------------
+class ReplayAssistant:
+    # Same interface as GPTAssistant for AdaptiveCA
+    def __init__(self, cassette, logger=None):
+        self.cassette = cassette
+        self.logger = logger
+        self.id = cassette.header.get("assistant_id")
+        self.thread = type("ReplayThread", (), {"id": cassette.header.get("thread_id")})()
+        self._messages = []
+        self.thread_ids = [self.thread.id]
+        self.run_stats = []
+
+    def converse(self, message, tools=None, on_field=None):
+        request = {"message": message, "tools": [tool["name"] for tool in tools or []]}
+        recorded = self.cassette.replay("openai.converse", request)
+        self._messages += [f"user: {message}", f"assistant: {recorded['response']}"]
+        if self.logger and recorded["json_responses"]:
+            self.logger.debug(recorded["json_responses"])
+        if on_field and recorded["json_responses"]:
+            # Streamed fields are only known once the whole call has been replayed
+            for name, value in recorded["json_responses"][0].items():
+                on_field(name, value)
+        if not tools:
+            return recorded["response"]
+        return recorded["response"], recorded["json_responses"]
+
+    def get_all_messages(self):
+        return list(self._messages)
+
+
+class ReplaySTTClient:
+    def __init__(self, cassette, logger=None):
+        self.cassette = cassette
+        self.logger = logger
+        self.file_idx = 0
+
+    def speech_to_text(self):
+        self.file_idx += 1
+        return self.cassette.replay("stt.speech_to_text", {})["transcript"]
+
+
+class ReplayTTSClient:
+    # The recorded wav files are played (local), synthesis takes the recorded time
+    def __init__(self, cassette, logger=None):
+        self.cassette = cassette
+        self.logger = logger
+        self.file_idx = 0
+        self._presynthesized = {}
+
+    def synthesize(self, text):
+        recorded = self.cassette.replay("tts.synthesize", {"text": text}, match_key="text")
+        self.file_idx += 1
+        return os.path.join(self.cassette.base_dir, recorded["file"])
+
+    def presynthesize(self, text):
+        if text.strip() and text not in self._presynthesized:
+            self._presynthesized[text] = self.synthesize(text)
+
+    def _speech_file(self, text):
+        return self._presynthesized.pop(text, None) or self.synthesize(text)
+
+    def text_to_speech(self, text):
+        if not text.strip():
+            return
+        file_path = self._speech_file(text)
+        if os.path.exists(file_path):
+            import playsound
+            playsound.playsound(file_path)
+
+    def text_to_speech_non_blocking(self, text):
+        if not text.strip():
+            return None
+        file_path = self._speech_file(text)
+        from multimedia.audio_player import AudioPlayback
+        return AudioPlayback(file_path).start()
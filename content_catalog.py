@@ -0,0 +1,91 @@
+"""
+Catalog of every episode under transcripts/.
+
+Episodes are either a folder with <episode>_main.xlsx, <episode>_pre_test.xlsx, <episode>_question_bank.xlsx and
+<episode>_warmups.xlsx (e.g. transcripts/lucky_shirt/), or a single <episode>_base.xlsx transcript with base questions
+(e.g. transcripts/town_picnic_base.xlsx). Every episode is loaded once (through the compiled content cache) and its
+question banks are indexed by (episode, segment, level), segment being the transcript's id_text, and by question id,
+so a session can look up candidate questions, resolve a question picked by the assistant or switch episodes without
+re-reading any file.
+"""
+import glob
+import os
+
+from episode_content import load_episode_content
+
+EPISODE_FILE_SUFFIXES = {
+    "transcript": "_main.xlsx",
+    "pretest": "_pre_test.xlsx",
+    "question_bank": "_question_bank.xlsx",
+    "warmups": "_warmups.xlsx",
+}
+BASE_TRANSCRIPT_SUFFIX = "_base.xlsx"
+
+
+def discover_episodes(transcripts_dir):
+    # {episode name: {"transcript": path, ...}} for everything under transcripts_dir
+    episodes = {}
+    for episode_dir in sorted(glob.glob(os.path.join(transcripts_dir, "*", ""))):
+        text_files = {}
+        for category, suffix in EPISODE_FILE_SUFFIXES.items():
+            matches = sorted(glob.glob(os.path.join(episode_dir, f"*{suffix}")))
+            if matches:
+                text_files[category] = matches[0]
+        if "transcript" in text_files:
+            episodes[os.path.basename(os.path.normpath(episode_dir))] = text_files
+    for transcript in sorted(glob.glob(os.path.join(transcripts_dir, f"*{BASE_TRANSCRIPT_SUFFIX}"))):
+        episode = os.path.basename(transcript)[:-len(BASE_TRANSCRIPT_SUFFIX)]
+        # A full episode folder takes priority over its base transcript
+        episodes.setdefault(episode, {"transcript": transcript})
+    return episodes
+
+
+class EpisodeCatalog:
+    def __init__(self, transcripts_dir="transcripts/", cache_dir=".content_cache/", logger=None):
+        self.cache_dir = cache_dir
+        self.logger = logger
+        self.episodes = {}  # episode -> content (pretest, warmup_questions, dialogues, question_banks, ...)
+        self._segment_ids = {}  # episode -> id_text of each question bank, in transcript order
+        self._index = {}  # (episode, segment, level) -> candidate questions
+        self._questions = {}  # (episode, question id) -> question
+        for episode, text_files in discover_episodes(transcripts_dir).items():
+            self.add_episode(episode, text_files)
+
+    def add_episode(self, episode, text_files):
+        if episode in self.episodes:
+            return self.episodes[episode]
+        content = load_episode_content(text_files, self.cache_dir, logger=self.logger)
+        self.episodes[episode] = content
+        self._segment_ids[episode] = content["bank_segment_ids"]
+        for segment, question_bank in zip(content["bank_segment_ids"], content["question_banks"]):
+            for question in question_bank:
+                self._index.setdefault((episode, segment, question["level"]), []).append(question)
+                self._questions[(episode, question["id"])] = question
+        if self.logger:
+            self.logger.debug(f"Indexed episode {episode}: {len(content['dialogues'])} parts, "
+                              f"{content['num_bank_questions']} bank questions")
+        return content
+
+    @property
+    def names(self):
+        return list(self.episodes)
+
+    def content(self, episode):
+        return self.episodes[episode]
+
+    def segment_id(self, episode, idx):
+        # id_text of the idx-th part of the episode (0-index, same order as question_banks)
+        segment_ids = self._segment_ids[episode]
+        return segment_ids[idx] if idx < len(segment_ids) else None
+
+    def candidates(self, episode, segment, level):
+        return self._index.get((episode, segment, level.upper()), [])
+
+    def question(self, episode, question_id):
+        # None for an id that isn't in the episode's banks
+        return self._questions.get((episode, str(question_id).strip()))
+
+
+def question_rows(questions):
+    # Compact "id|level|question" rows sent to the assistant instead of the question dicts
+    return "\n".join(f"{question['id']}|{question['level']}|{question['question']}" for question in questions)
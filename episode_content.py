@@ -0,0 +1,168 @@
+"""
+Compiled episode content cache.
+
+Parsing the episode spreadsheets with pandas/openpyxl (and importing them) is a large part of the start-up time, so
+an episode's spreadsheets are compiled once into a JSON artifact which is all the runtime needs to load. The artifact
+records the mtime, size and sha256 of every source spreadsheet, and it's recompiled automatically when one changes.
+
+To compile ahead of time:
+    python episode_content.py --config configs/sample_config.yaml
+"""
+import argparse
+import hashlib
+import json
+import os
+
+CACHE_VERSION = 3
+LEVEL_ORDER = {"SHALLOW": 0, "INTERMEDIATE": 1, "DEEP": 2}
+
+
+def get_text_files(config):
+    # {"pretest": path, "warmups": path, "transcript": path, "question_bank": path} from the config
+    text_config = config["episode_files"]["text"]
+    root_dir = text_config.get("base_dir", "")
+    return {category: os.path.join(root_dir, text_config[category]) for category in text_config
+            if category != "base_dir"}
+
+
+def _file_signature(file_path, with_hash=True):
+    stat = os.stat(file_path)
+    signature = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    if with_hash:
+        with open(file_path, "rb") as f:
+            signature["sha256"] = hashlib.sha256(f.read()).hexdigest()
+    return signature
+
+
+def _cache_path(text_files, cache_dir):
+    # One artifact per set of source files
+    key = hashlib.sha1("|".join(f"{k}={os.path.abspath(v)}" for k, v in sorted(text_files.items())).encode())
+    episode_name = os.path.splitext(os.path.basename(text_files["transcript"]))[0]
+    return os.path.join(cache_dir, f"{episode_name}_{key.hexdigest()[:12]}.json")
+
+
+def compile_episode_content(text_files):
+    # text_files needs a transcript, pretest/warmups/question_bank are optional (e.g. town_picnic_base.xlsx only has
+    # the transcript with its base questions)
+    # The only place pandas is needed
+    import pandas as pd
+
+    content = {
+        "pretest": [],
+        "warmup_questions": [],
+        "dialogues": [],
+        "question_banks": [],
+        "bank_segment_ids": [],  # id_text of each question bank, same order as question_banks
+        "num_bank_questions": 0,
+    }
+    # Pretest questions
+    if "pretest" in text_files:
+        df = pd.read_excel(text_files["pretest"], usecols=["question", "level", "answer"])
+        content["pretest"] = df.to_dict(orient="records")
+
+    # Warmup questions
+    if "warmups" in text_files:
+        df = pd.read_excel(text_files["warmups"], usecols=["question"])
+        content["warmup_questions"] = df["question"].tolist()
+
+    # Transcript (base transcripts name their columns id/text/base_q)
+    df = pd.read_excel(text_files["transcript"]).rename(columns={"id": "id_text", "base_q": "question"})
+    df = df[[column for column in ["id_text", "text", "question"] if column in df.columns]]
+    dialogues = df.to_dict(orient="records")
+    # For now don't retrieve question without any dialogue (e.g. in town_picnic_base.xlsx)
+    content["dialogues"] = [dialogue for dialogue in dialogues
+                            if isinstance(dialogue["text"], str) and dialogue["text"].strip()]
+
+    # Question banks, one per part of the episode (id_text), questions ordered shallow -> intermediate -> deep.
+    # Every question gets an id stable across loads: id_text + level initial + rank in the level (e.g. 3S1, 3D2)
+    if "question_bank" in text_files:
+        df = pd.read_excel(text_files["question_bank"])
+        for id_text, group in df.groupby("id_text", sort=True):
+            current_questions = [{"question": question, "level": level.upper()}
+                                 for question, level in zip(group["question"], group["level"])]
+            current_questions.sort(key=lambda item: LEVEL_ORDER.get(item["level"], len(LEVEL_ORDER)))
+            level_counts = {}
+            for item in current_questions:
+                level_counts[item["level"]] = level_counts.get(item["level"], 0) + 1
+                item["id"] = f"{id_text}{item['level'][0]}{level_counts[item['level']]}"
+            content["question_banks"].append(current_questions)
+            content["bank_segment_ids"].append(id_text)
+        content["num_bank_questions"] = len(df)
+    return content
+
+
+def _to_builtin(obj):
+    # numpy scalars left over from pandas
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _write_artifact(cache_file, artifact):
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False, default=_to_builtin)
+    os.replace(tmp_file, cache_file)
+
+
+def _is_fresh(artifact, text_files):
+    # Returns (fresh, sources_touched). Compare mtime + size first, only hash files whose mtime/size changed
+    if artifact.get("version") != CACHE_VERSION or set(artifact["sources"]) != set(text_files):
+        return False, False
+    touched = False
+    for category, file_path in text_files.items():
+        recorded = artifact["sources"][category]
+        current = _file_signature(file_path, with_hash=False)
+        if current["mtime_ns"] == recorded["mtime_ns"] and current["size"] == recorded["size"]:
+            continue
+        if _file_signature(file_path)["sha256"] != recorded["sha256"]:
+            return False, False
+        touched = True
+    return True, touched
+
+
+def load_episode_content(text_files, cache_dir, force_compile=False, logger=None):
+    def log(message):
+        if logger:
+            logger.debug(message)
+        else:
+            print(message)
+
+    cache_file = _cache_path(text_files, cache_dir)
+    if not force_compile and os.path.isfile(cache_file):
+        with open(cache_file, encoding="utf-8") as f:
+            artifact = json.load(f)
+        fresh, touched = _is_fresh(artifact, text_files)
+        if fresh:
+            if touched:
+                # Same content, new mtimes: refresh the signatures so next launch doesn't hash again
+                artifact["sources"] = {category: _file_signature(path) for category, path in text_files.items()}
+                _write_artifact(cache_file, artifact)
+            log(f"Loaded compiled episode content from {cache_file}")
+            return artifact["content"]
+        log(f"Episode spreadsheets changed, recompiling {cache_file}")
+
+    artifact = {
+        "version": CACHE_VERSION,
+        "sources": {category: _file_signature(path) for category, path in text_files.items()},
+        "content": compile_episode_content(text_files),
+    }
+    _write_artifact(cache_file, artifact)
+    log(f"Compiled episode content to {cache_file}")
+    # Read back so a fresh compile returns exactly what a cached load would (plain JSON types)
+    with open(cache_file, encoding="utf-8") as f:
+        return json.load(f)["content"]
+
+
+if __name__ == "__main__":
+    import yaml
+
+    argparser = argparse.ArgumentParser(description="Compile an episode's spreadsheets into the content cache")
+    argparser.add_argument("--config", default="configs/sample_config.yaml")
+    argparser.add_argument("--force", action="store_true", help="Recompile even if the cache is up to date")
+    arguments = argparser.parse_args()
+    with open(arguments.config) as f:
+        config = yaml.safe_load(f)
+    load_episode_content(get_text_files(config), config.get("content_cache_dir", ".content_cache/"),
+                         force_compile=arguments.force)
@@ -0,0 +1,98 @@
+"""
+Crash-safe learning history.
+
+Every warmup, pretest and episode turn is appended to a JSONL file (one line per turn) and fsync'd as soon as it
+happens, so a crash or a kill mid-session doesn't lose the results. Fields known only later (e.g. the accuracy of a
+pretest answer graded in the background) are appended as updates of an earlier turn, referenced by the id written with
+it (not its position, a question asked again after a crash is in the file twice). The Excel workbook is an export
+generated from that file, either in the background at the end of a session or offline:
+    python history_store.py running_logs/0001/240101_120000/
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+
+
+class LearningHistoryStore:
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+        # Append mode: a resumed session keeps adding to the same file
+        self._file = open(file_path, "a", encoding="utf-8")
+
+    def append(self, section, record, episode=None):
+        # Returns the id of the turn, used to update it later
+        record_id = uuid.uuid4().hex
+        self._write({"time": time.time(), "id": record_id, "section": section, "episode": episode, "record": record})
+        return record_id
+
+    def update(self, section, record_id, fields):
+        # Fields added to the turn appended with record_id
+        self._write({"time": time.time(), "section": section, "episode": None, "id": record_id, "update": fields})
+
+    def _write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_learning_history(file_path):
+    # Rebuild the same structure as AdaptiveCA.learning_history: {"warmup": [...], "pretest": [...],
+    # "episode": [[turns of part 1], [turns of part 2], ...]}
+    learning_history = {}
+    episode_turns = {}
+    records = {}  # id -> record, for the updates
+    with open(file_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line cut short by a crash
+                continue
+            if "update" in entry:
+                # The turn's own line may have been lost (cut short by a crash)
+                if entry["id"] in records:
+                    records[entry["id"]].update(entry["update"])
+                continue
+            records[entry["id"]] = entry["record"]
+            if entry["episode"] is None:
+                learning_history.setdefault(entry["section"], []).append(entry["record"])
+            else:
+                episode_turns.setdefault(entry["episode"], []).append(entry["record"])
+    if episode_turns:
+        learning_history["episode"] = [episode_turns[episode] for episode in sorted(episode_turns)]
+    return learning_history
+
+
+def export_to_excel(learning_history, learning_result_file):
+    import pandas as pd
+    with pd.ExcelWriter(learning_result_file) as writer:
+        for section in learning_history:
+            if not learning_history[section]:
+                continue
+            df = pd.DataFrame(learning_history[section])
+            # Essentially checking if learning history is nested (happens for episode learning history)
+            if isinstance(learning_history[section][0], list):
+                df = df.stack().apply(pd.Series)
+            df.to_excel(writer, sheet_name=section)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Export a session's learning history store to Excel")
+    argparser.add_argument("log_dir", help="Session folder (running_logs/<childID>/<timestamp>/)")
+    argparser.add_argument("--store", default="learning_history.jsonl")
+    argparser.add_argument("--output", default="learning_result.xlsx")
+    arguments = argparser.parse_args()
+    history = read_learning_history(os.path.join(arguments.log_dir, arguments.store))
+    output_file = os.path.join(arguments.log_dir, arguments.output)
+    export_to_excel(history, output_file)
+    print(f"Learning history saved to {output_file}.")
@@ -0,0 +1,85 @@
+"""
+Incremental parser of a JSON object that arrives in pieces (the arguments of a streamed tool call, delta by delta).
+
+Each top-level field is reported as soon as its value is complete, before the rest of the object has arrived, so e.g.
+the evaluation of a feedback can be spoken while the explanation is still being generated:
+    fields = JSONFieldStream()
+    fields.feed('{"accuracy": 1, "evaluation": "Good th')  # [("accuracy", 1)]
+    fields.feed('inking!", "explanation": "Ari')           # [("evaluation", "Good thinking!")]
+"""
+import json
+
+
+class JSONFieldStream:
+    def __init__(self):
+        self.fields = {}
+        self.done = False
+        # key: waiting for/reading a key, colon: waiting for ':', value: reading a value, next: waiting for ',' or '}'
+        self._state = None
+        self._token = []
+        self._key = None
+        self._nesting = 0  # [] / {} opened inside the current value
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        # Returns the (key, value) of the fields completed by this chunk, in order
+        completed = []
+        for char in chunk:
+            if self.done:
+                break
+            if self._in_string:
+                self._token.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._state == "key":
+                        self._key = json.loads("".join(self._token))
+                        self._state = "colon"
+                    elif self._nesting == 0:
+                        # A string value is complete at its closing quote, no need to wait for the next field
+                        completed.append(self._complete())
+                        self._state = "next"
+                continue
+            if self._state is None:
+                if char == "{":
+                    self._state = "key"
+            elif self._state == "key":
+                if char == '"':
+                    self._token, self._in_string = [char], True
+                elif char == "}":
+                    self.done = True
+            elif self._state == "colon":
+                if char == ":":
+                    self._state, self._token = "value", []
+            elif self._state == "value":
+                if self._nesting == 0 and char in ",}":
+                    if "".join(self._token).strip():
+                        completed.append(self._complete())
+                    self._state = "key"
+                    self.done = char == "}"
+                    continue
+                if char.isspace() and not self._token:
+                    continue
+                self._token.append(char)
+                if char == '"':
+                    self._in_string = True
+                elif char in "[{":
+                    self._nesting += 1
+                elif char in "]}":
+                    self._nesting -= 1
+            elif self._state == "next":
+                if char == ",":
+                    self._state = "key"
+                elif char == "}":
+                    self.done = True
+        return completed
+
+    def _complete(self):
+        value = json.loads("".join(self._token))
+        self.fields[self._key] = value
+        self._token = []
+        return self._key, value
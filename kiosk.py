@@ -0,0 +1,172 @@
+"""
+Kiosk daemon: one warm process runs consecutive sessions.
+
+Starting adaptive_ca.py for every child imports and initializes the OpenAI, TTS, STT and video clients, loads the
+episode content and preloads the videos each time. The daemon does all of that once, then waits for the next child.
+A new session only creates what belongs to it (log folder, assistant thread, learning history, see
+AdaptiveCA.new_session), and the assistant thread of the next session is created while waiting.
+
+Commands are JSON lines on a localhost socket, one session runs at a time:
+    python kiosk.py serve --mode interactive --port 8765
+    python kiosk.py start 12 --pretest
+    python kiosk.py status
+    python kiosk.py stop
+"""
+import argparse
+import concurrent.futures
+import json
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import ratelimit
+import tasks
+from adaptive_ca import AdaptiveCA
+
+DEFAULT_PORT = 8765
+
+
+class KioskDaemon:
+    def __init__(self, config_file="configs/sample_config.yaml", text_only=False, port=DEFAULT_PORT, trace=False):
+        self.port = port
+        # The log folder created here only holds the start-up logs, every session gets its own
+        self.agent = AdaptiveCA(config_file=config_file, text_only=text_only, trace=trace)
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self.current_session = None  # {"childID", "program", "started"} of the running session
+        self.sessions_run = 0
+        # Assistant thread of the next session, created in the background between sessions. The start-up thread is
+        # still empty, the first session uses it
+        self._spare_thread = concurrent.futures.Future()
+        self._spare_thread.set_result(self.agent.assistant.thread)
+        self._server = None
+
+    def _prepare_spare_thread(self):
+        if not self.agent.client:
+            return
+        self._spare_thread = tasks.submit("create_spare_thread", self._create_spare_thread)
+
+    def _create_spare_thread(self):
+        with ratelimit.priority("background"):
+            return self.agent.assistant.create_thread()
+
+    def _take_spare_thread(self):
+        spare, self._spare_thread = self._spare_thread, None
+        if spare is None:
+            return None
+        try:
+            return spare.result()
+        except Exception:
+            # Already logged by the task pool, new_session creates the thread itself
+            return None
+
+    def handle(self, request):
+        # Called from the listener threads, the sessions themselves run on the main thread (serve_forever)
+        if not isinstance(request, dict):
+            return {"status": "error", "error": "A request is a JSON object"}
+        command = request.get("command")
+        with self._lock:
+            if command == "status":
+                return {"status": "running" if self.current_session else "idle", "session": self.current_session,
+                        "sessions_run": self.sessions_run}
+            if command == "start":
+                try:
+                    child_id = int(request["childID"])
+                except (KeyError, TypeError, ValueError):
+                    return {"status": "error", "error": "start needs a numeric childID"}
+                if self.current_session:
+                    return {"status": "busy", "session": self.current_session}
+                self.current_session = {"childID": child_id,
+                                        "program": "pretest" if request.get("pretest") else "adaptive",
+                                        "started": time.time()}
+                self._requests.put(dict(self.current_session, skip_warmup=request.get("skip_warmup", False)))
+                return {"status": "started", "session": self.current_session}
+            if command == "stop":
+                # The running session (if any) finishes first
+                self._requests.put(None)
+                return {"status": "stopping"}
+        return {"status": "error", "error": f"Unknown command {command!r}"}
+
+    def run_session(self, session):
+        # Whatever fails in a session, the kiosk keeps waiting for the next one
+        try:
+            self.agent.new_session(session["childID"], thread=self._take_spare_thread())
+            if session["program"] == "pretest":
+                self.agent.run_pretest_program()
+            else:
+                self.agent.run_adaptive_learning_program(skip_warmup=session["skip_warmup"])
+        except Exception:
+            self.agent.logger.exception(f"Session of child {session['childID']} failed")
+        finally:
+            try:
+                self.agent.finish_session(stop_video=False)
+            except Exception:
+                self.agent.logger.exception(f"Saving the session of child {session['childID']} failed")
+            with self._lock:
+                self.current_session = None
+                self.sessions_run += 1
+            self._prepare_spare_thread()
+
+    def serve_forever(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    try:
+                        response = daemon.handle(json.loads(line))
+                    except ValueError as e:
+                        # Not JSON (JSONDecodeError, UnicodeDecodeError)
+                        response = {"status": "error", "error": f"Invalid request: {e}"}
+                    self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="kiosk-listener", daemon=True).start()
+        self.agent.logger.info(f"Kiosk ready, listening on localhost:{self.port}")
+        try:
+            while True:
+                session = self._requests.get()
+                if session is None:
+                    break
+                self.run_session(session)
+        finally:
+            self._server.shutdown()
+            self._server.server_close()
+            if self.agent.video_player:
+                self.agent.video_player.stop_video()
+            tasks.get_executor().shutdown()
+
+
+def send_command(request, port=DEFAULT_PORT, timeout=10):
+    with socket.create_connection(("127.0.0.1", port), timeout=timeout) as connection:
+        connection.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        return json.loads(connection.makefile(encoding="utf-8").readline())
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Run consecutive sessions in one warm process")
+    argparser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    subparsers = argparser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Initialize everything once and wait for sessions")
+    serve_parser.add_argument("--config", default="configs/sample_config.yaml")
+    serve_parser.add_argument("--mode", choices=["terminal", "interactive"], default="interactive")
+    serve_parser.add_argument("--trace", action="store_true", help="Save a span trace in every session's log folder")
+    start_parser = subparsers.add_parser("start", help="Start the next child's session")
+    start_parser.add_argument("childID", type=int)
+    start_parser.add_argument("--pretest", action="store_true", help="Running pretest program")
+    start_parser.add_argument("--skip-warmup", action="store_true", help="If present, skip warmup section")
+    subparsers.add_parser("status", help="Running session and number of sessions run")
+    subparsers.add_parser("stop", help="Exit once the running session is finished")
+    arguments = argparser.parse_args()
+    if arguments.command == "serve":
+        KioskDaemon(config_file=arguments.config, text_only=arguments.mode == "terminal", port=arguments.port,
+                    trace=arguments.trace).serve_forever()
+    else:
+        request = {"command": arguments.command}
+        if arguments.command == "start":
+            request.update(childID=arguments.childID, pretest=arguments.pretest, skip_warmup=arguments.skip_warmup)
+        print(json.dumps(send_command(request, port=arguments.port)))
@@ -13,34 +13,75 @@ from google.cloud import speech
 from google.oauth2 import service_account
 from .audio_recorder import MicRecorder
 from .microphone import MicrophoneStream
+from .audio_preprocessing import preprocess_for_upload
 from google.cloud.speech_v2.types import cloud_speech
 import google.cloud.speech_v2 as speech_v2
 from google.protobuf import duration_pb2
 from datetime import datetime
 import time
+import ratelimit
+import tracing
 
 
 class STTClient:
     def __init__(self, stt_private_key_path="../keys/stt-private-key.json", sample_frequency=24000, max_alternatives=3,
-                 output_dir=None, logger=None):
+                 output_dir=None, logger=None, preprocess=True, target_sample_rate=None):
         # STT Client and config
         assert os.path.exists(stt_private_key_path), f"STT private key file at {stt_private_key_path} does not exist."
         credentials = service_account.Credentials.from_service_account_file(stt_private_key_path)
         self.client = speech.SpeechClient(credentials=credentials)
+        self.max_alternatives = max_alternatives
         self.stt_config = speech.RecognitionConfig(
             encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
             sample_rate_hertz=sample_frequency,
             language_code="en-US",
             max_alternatives=max_alternatives,
         )
+        # Trim silence (+ optional downmix/resample) and upload as FLAC instead of the raw recording
+        self.preprocess = preprocess
+        self.target_sample_rate = target_sample_rate
+        self.last_request_stats = {}
 
         self.audio_recorder = MicRecorder(sample_frequency, output_dir, logger)
+        self.logger = logger
+
+    def _prepare_request(self, file_path):
+        if not self.preprocess:
+            with open(file_path, "rb") as audio_file:
+                content = audio_file.read()
+            return self.stt_config, content, {"bytes_sent": len(content)}
+        content, sample_rate, channels, stats = preprocess_for_upload(file_path,
+                                                                      target_sample_rate=self.target_sample_rate)
+        config = speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.FLAC,
+            sample_rate_hertz=sample_rate,
+            audio_channel_count=channels,
+            language_code="en-US",
+            max_alternatives=self.max_alternatives,
+        )
+        return config, content, stats
 
     def get_speech_text_from_file(self, file_path):
-        with open(file_path, "rb") as audio_file:
-            content = audio_file.read()
-            audio = speech.RecognitionAudio(content=content)
-        responses = self.client.recognize(config=self.stt_config, audio=audio)
+        with tracing.span("stt.preprocess", "stt"):
+            config, content, stats = self._prepare_request(file_path)
+        stats["raw_bytes"] = os.path.getsize(file_path)
+        stats["recognize_latency"] = 0.
+        self.last_request_stats = stats
+        # Nothing but silence in the recording, the API wouldn't return any result either
+        if not content:
+            return ""
+        audio = speech.RecognitionAudio(content=content)
+        start_time = time.perf_counter()
+        responses = self.client.recognize(config=config, audio=audio)
+        stats["recognize_latency"] = time.perf_counter() - start_time
+        tracing.get_tracer().add_span("stt.recognize", "http", start_time, start_time + stats["recognize_latency"],
+                                      bytes_sent=stats["bytes_sent"])
+        log_msg = (f"STT upload: {stats['bytes_sent']}/{stats['raw_bytes']} bytes, "
+                   f"recognize took {stats['recognize_latency']:.2f}s")
+        if self.logger:
+            self.logger.debug(log_msg)
+        else:
+            print(log_msg)
         results = []
         for result in responses.results:
             results.append(result.alternatives[0].transcript)
@@ -66,6 +107,7 @@ class STTStreamingClient:
         self.output_dir = output_dir
         if self.output_dir:
             os.makedirs(self.output_dir, exist_ok=True)
+        self.file_idx = 0
         self.logger = logger
 
     def _init_cloud_recognizer(self, max_start_timeout, max_pause_duration):
@@ -108,10 +150,49 @@ class STTStreamingClient:
         yield self.config_request
         yield from audio
 
+    def streaming_responses(self, audio_stream):
+        # Send an iterable of raw audio chunks (MicrophoneStream, WavReplayStream, ...) to the streaming recognizer and
+        # yield the server responses as they arrive
+        audio_requests = (
+            cloud_speech.StreamingRecognizeRequest(audio=content) for content in audio_stream
+        )
+        # One token of the shared STT rate limiter per stream. Not retried on a 429: the audio already sent is gone
+        ratelimit.acquire("stt")
+        yield from self.client.streaming_recognize(requests=self._streaming_requests(audio_requests))
+
+    def transcribe_stream(self, audio_stream):
+        # Traced as stt.listen (stream opened -> end of speech event) and stt.finalize (end of speech -> last result)
+        responses = []
+        start_time = time.perf_counter()
+        speech_end_time = None
+        for response in self.streaming_responses(audio_stream):
+            # if (response.speech_event_type
+            #         == cloud_speech.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_BEGIN):
+            #     print("Speech started.")
+            if (response.speech_event_type
+                    == cloud_speech.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_END):
+                speech_end_time = time.perf_counter()
+            for result in response.results:
+                if "alternatives" in result:
+                    responses.append(result.alternatives[0].transcript)
+        end_time = time.perf_counter()
+        tracer = tracing.get_tracer()
+        tracer.add_span("stt.listen", "stt", start_time, speech_end_time or end_time)
+        if speech_end_time:
+            tracer.add_span("stt.finalize", "stt", speech_end_time, end_time)
+        return "".join(responses)
+
+    def next_recording_file(self):
+        # Recordings are numbered (file_idx is saved in the session checkpoint, so a resumed session keeps counting)
+        if not self.output_dir:
+            return None
+        recording_output_file = os.path.join(self.output_dir,
+                                             f"{self.file_idx:03}_{datetime.now().strftime('%y-%m-%d_%H-%M-%S')}.wav")
+        self.file_idx += 1
+        return recording_output_file
+
     def speech_to_text(self):
-        recording_output_file = None
-        if self.output_dir:
-            recording_output_file = os.path.join(self.output_dir, f"{datetime.now().strftime('%y-%m-%d_%H-%M-%S')}.wav")
+        recording_output_file = self.next_recording_file()
         if self.logger:
             self.logger.debug(f"Recording audio to {recording_output_file}")
             self.logger.debug("Listening...")
@@ -119,24 +200,7 @@ class STTStreamingClient:
             print("Listening...")
 
         with MicrophoneStream(channels=self.audio_channels, rate=self.rate, output_file=recording_output_file) as audio_stream:
-            audio_requests = (
-                cloud_speech.StreamingRecognizeRequest(audio=content) for content in audio_stream
-            )
-            responses_iterator = self.client.streaming_recognize(requests=self._streaming_requests(audio_requests))
-            responses = []
-            for response in responses_iterator:
-                # if (response.speech_event_type
-                #         == cloud_speech.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_BEGIN):
-                #     print("Speech started.")
-                # if (response.speech_event_type
-                #         == cloud_speech.StreamingRecognizeResponse.SpeechEventType.SPEECH_ACTIVITY_END):
-                #     print("Speech ended.")
-                for result in response.results:
-                    if "alternatives" in result:
-                        responses.append(result.alternatives[0].transcript)
-
-            return "".join(responses)
-
+            return self.transcribe_stream(audio_stream)
 
 if __name__ == "__main__":
     stt_client = STTStreamingClient()
@@ -11,10 +11,14 @@ import shutil
 import playsound
 import os
 import logging
+import threading
 from google.cloud import texttospeech
 from google.oauth2 import service_account
 from google.api_core.retry import Retry
 from utils import is_gcs_retryable
+import ratelimit
+import tracing
+from .audio_player import AudioPlayback
 
 
 class TTSClient:
@@ -37,27 +41,58 @@ class TTSClient:
             self.logger = logging.getLogger(__name__)
         self.output_dir = output_dir
         self.file_idx = 0
-        # If retrying, wait for 0.5 seconds, then keep retrying with duration * 2 (max of 4 seconds between retry)
-        self.gcs_retry_policy = Retry(predicate=is_gcs_retryable, initial=0.5, maximum=4, timeout=60)
+        self._file_idx_lock = threading.Lock()
+        # text -> wav synthesized ahead of time by presynthesize(), played by the next text_to_speech of that text
+        self._presynthesized = {}
+        # If retrying, wait for 0.5 seconds, then keep retrying with duration * 2 (max of 4 seconds between retry).
+        # 429s aren't retried blindly here, they pause every TTS request through the shared rate limiter (ratelimit.py)
+        self.gcs_retry_policy = Retry(
+            predicate=lambda exc: is_gcs_retryable(exc) and not ratelimit.is_rate_limited(exc),
+            initial=0.5, maximum=4, timeout=60)
 
-    def text_to_speech(self, text):
-        # Handle empty input
-        if not text.strip():
-            self.logger.debug("Empty TTS input")
-            return
+    def synthesize(self, text):
+        # Synthesize text into a wav file in output_dir and return its path
         synthesis_input = texttospeech.SynthesisInput(text=text)
-        response = self.client.synthesize_speech(
-            input=synthesis_input, voice=self.voice, audio_config=self.audio_config,
-            retry=self.gcs_retry_policy
-        )
-        file_path = os.path.join(self.output_dir, f"{self.file_idx:03}.wav")
+        with tracing.span("tts.synthesize", "tts", characters=len(text)):
+            response = ratelimit.call(
+                "tts", self.client.synthesize_speech,
+                input=synthesis_input, voice=self.voice, audio_config=self.audio_config,
+                retry=self.gcs_retry_policy
+            )
+        # Synthesis can also run in the background (presynthesize), every file gets its own index
+        with self._file_idx_lock:
+            file_path = os.path.join(self.output_dir, f"{self.file_idx:03}.wav")
+            self.file_idx += 1
         with open(file_path, "wb") as out:
             out.write(response.audio_content)
             if self.logger:
                 self.logger.debug(f'Audio content written to file "{file_path}"')
-        self.file_idx += 1
-        playsound.playsound(file_path)
+        return file_path
+
+    def presynthesize(self, text):
+        # Synthesize ahead of time (e.g. the next part's question while the current part goes on)
+        if text.strip() and text not in self._presynthesized:
+            self._presynthesized[text] = self.synthesize(text)
+
+    def _speech_file(self, text):
+        return self._presynthesized.pop(text, None) or self.synthesize(text)
 
+    def text_to_speech(self, text):
+        # Handle empty input
+        if not text.strip():
+            self.logger.debug("Empty TTS input")
+            return
+        file_path = self._speech_file(text)
+        with tracing.span("tts.playback", "tts", file=file_path):
+            playsound.playsound(file_path)
+
+    def text_to_speech_non_blocking(self, text):
+        # Same as text_to_speech, but returns the started playback so it can be stopped/ducked (used for barge-in)
+        if not text.strip():
+            self.logger.debug("Empty TTS input")
+            return None
+        file_path = self._speech_file(text)
+        return AudioPlayback(file_path).start()
 
 if __name__ == "__main__":
     tts_client = TTSClient(output_dir="tmp")
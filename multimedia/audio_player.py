@@ -0,0 +1,63 @@
+import threading
+import time
+
+import sounddevice as sd
+import soundfile as sf
+
+import tracing
+
+
+class AudioPlayback:
+    """Non-blocking playback of an audio file that can be stopped or ducked while playing (unlike playsound)."""
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self._data, self.rate = sf.read(file_path, dtype="float32", always_2d=True)
+        self.duration = len(self._data) / self.rate
+        self._position = 0
+        self.gain = 1.
+        self._finished = threading.Event()
+        self._start_time = None
+        self._stream = sd.OutputStream(samplerate=self.rate, channels=self._data.shape[1], dtype="float32",
+                                       callback=self._audio_callback, finished_callback=self._on_finished)
+
+    def start(self):
+        self._start_time = time.perf_counter()
+        self._stream.start()
+        return self
+
+    def _on_finished(self):
+        # Called from the audio thread once playback is over (end of file, stop or abort)
+        self._finished.set()
+        if self._start_time is not None:
+            tracing.get_tracer().add_span("tts.playback", "tts", self._start_time, time.perf_counter(),
+                                          file=self.file_path, stopped_early=self._position < len(self._data))
+
+    def _audio_callback(self, outdata, frames, _time, _status) -> None:
+        """This is called (from a separate thread) for each audio block."""
+        chunk = self._data[self._position:self._position + frames]
+        outdata[:len(chunk)] = chunk * self.gain
+        outdata[len(chunk):] = 0
+        self._position += frames
+        if len(chunk) < frames:
+            raise sd.CallbackStop
+
+    @property
+    def is_playing(self):
+        return not self._finished.is_set()
+
+    def duck(self, gain=0.2):
+        # Lower the volume but keep playing
+        self.gain = gain
+
+    def stop(self):
+        if self.is_playing:
+            self._stream.abort()
+        self._finished.set()
+        self._stream.close()
+
+    def wait(self, timeout=None):
+        finished = self._finished.wait(timeout)
+        if finished:
+            self._stream.close()
+        return finished
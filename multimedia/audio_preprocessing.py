@@ -0,0 +1,82 @@
+"""
+Notes
+----------------------------------------
+* NumPy preprocessing applied to a recording before it is uploaded to the (batch) STT API
+* Leading/trailing silence is trimmed with a frame energy threshold relative to the recording's peak, with some padding
+  kept around the speech so word onsets/endings aren't clipped
+* Optional downmix to mono and resampling (linear interpolation, good enough for speech recognition)
+* The result is encoded as FLAC (lossless) which is usually ~2x smaller than raw LINEAR16
+----------------------------------------
+"""
+import io
+
+import numpy as np
+import soundfile as sf
+
+
+def load_audio(file_path):
+    # Always returns float32 samples with shape (num_frames, num_channels)
+    samples, sample_rate = sf.read(file_path, dtype="float32", always_2d=True)
+    return samples, sample_rate
+
+
+def downmix(samples):
+    return samples.mean(axis=1, keepdims=True)
+
+
+def resample(samples, sample_rate, target_sample_rate):
+    if sample_rate == target_sample_rate or len(samples) == 0:
+        return samples
+    num_frames = int(round(len(samples) * target_sample_rate / sample_rate))
+    old_times = np.arange(len(samples)) / sample_rate
+    new_times = np.arange(num_frames) / target_sample_rate
+    return np.stack([np.interp(new_times, old_times, samples[:, ch]) for ch in range(samples.shape[1])],
+                    axis=1).astype(np.float32)
+
+
+def trim_silence(samples, sample_rate, relative_threshold_db=-35., min_threshold_db=-60., frame_duration=0.02,
+                 padding=0.25):
+    # Frame energy (dBFS) over all channels
+    frame_length = max(int(sample_rate * frame_duration), 1)
+    num_frames = len(samples) // frame_length
+    if num_frames == 0:
+        return samples
+    frames = samples[:num_frames * frame_length].reshape(num_frames, frame_length, -1)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float64), axis=(1, 2)))
+    energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    # Threshold is relative to the loudest frame so quiet children aren't trimmed away, with an absolute floor so
+    # a recording of pure silence comes out empty
+    threshold = max(energy_db.max() + relative_threshold_db, min_threshold_db)
+    voiced = np.flatnonzero(energy_db > threshold)
+    if len(voiced) == 0:
+        return samples[:0]
+    pad = int(padding * sample_rate)
+    start = max(voiced[0] * frame_length - pad, 0)
+    end = min((voiced[-1] + 1) * frame_length + pad, len(samples))
+    return samples[start:end]
+
+
+def encode_flac(samples, sample_rate):
+    buffer = io.BytesIO()
+    sf.write(buffer, samples, sample_rate, format="FLAC", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def preprocess_for_upload(file_path, trim=True, mono=True, target_sample_rate=None):
+    # Returns FLAC bytes + the audio format of those bytes + some stats for logging
+    samples, sample_rate = load_audio(file_path)
+    original_duration = len(samples) / sample_rate
+    if mono and samples.shape[1] > 1:
+        samples = downmix(samples)
+    if target_sample_rate:
+        samples = resample(samples, sample_rate, target_sample_rate)
+        sample_rate = target_sample_rate
+    if trim:
+        samples = trim_silence(samples, sample_rate)
+    content = encode_flac(samples, sample_rate) if len(samples) else b""
+    stats = {
+        "original_duration": original_duration,
+        "trimmed_duration": len(samples) / sample_rate,
+        "bytes_sent": len(content),
+    }
+    return content, sample_rate, samples.shape[1], stats
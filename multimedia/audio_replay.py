@@ -0,0 +1,187 @@
+"""
+Notes
+----------------------------------------
+* Replays the child recordings saved under running_logs/<child>/<ts>/child_stt/*.wav through STTStreamingClient,
+  so endpointing / engine changes can be benchmarked on real children's speech without a microphone
+* WavReplayStream has the same interface as MicrophoneStream (context manager + generator of raw audio chunks)
+* speed=1 streams in real time, speed=N streams N times faster, speed=0 streams as fast as possible
+----------------------------------------
+"""
+import argparse
+import csv
+import glob
+import os
+import statistics
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+
+class WavReplayStream:
+    """Replays a WAV file as a generator yielding audio chunks, standing in for MicrophoneStream."""
+
+    def __init__(self, wav_path: str, chunk_duration: float = 0.1, speed: float = 1.0) -> None:
+        self.wav_path = wav_path
+        self._chunk_duration = chunk_duration
+        self._speed = speed
+        with wave.open(wav_path, "rb") as wav_in:
+            self.channels = wav_in.getnchannels()
+            self.rate = wav_in.getframerate()
+            self.sample_width = wav_in.getsampwidth()
+            self.num_frames = wav_in.getnframes()
+        # chunk_duration default is 100ms (0.1s) -> 16000Hz -> 1600 frames per chunk
+        self._chunk = int(self.rate * chunk_duration)
+        self.duration = self.num_frames / self.rate if self.rate else 0.
+        self.closed = True
+        # Timestamps (time.perf_counter) of the first and last chunk handed to the consumer
+        self.first_chunk_time = None
+        self.last_chunk_time = None
+
+    def __enter__(self):
+        self._wav = wave.open(self.wav_path, "rb")
+        self.closed = False
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wav.close()
+        self.closed = True
+
+    def __iter__(self):
+        # Pace the chunks with absolute deadlines so sleep jitter doesn't accumulate over long recordings
+        start_time = time.perf_counter()
+        chunk_idx = 0
+        while not self.closed:
+            chunk = self._wav.readframes(self._chunk)
+            if not chunk:
+                return
+            if self._speed > 0:
+                deadline = start_time + chunk_idx * self._chunk_duration / self._speed
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            now = time.perf_counter()
+            if self.first_chunk_time is None:
+                self.first_chunk_time = now
+            self.last_chunk_time = now
+            chunk_idx += 1
+            yield chunk
+
+
+def replay_file(stt_client, wav_path, speed=1.0, chunk_duration=0.1):
+    # Stream one recording through the STT client and time it
+    with WavReplayStream(wav_path, chunk_duration=chunk_duration, speed=speed) as audio_stream:
+        if audio_stream.rate != stt_client.rate or audio_stream.channels != stt_client.audio_channels:
+            raise ValueError(f"{wav_path} is {audio_stream.rate}Hz/{audio_stream.channels}ch but the STT client expects "
+                             f"{stt_client.rate}Hz/{stt_client.audio_channels}ch")
+        start_time = time.perf_counter()
+        first_result_time = None
+        transcripts = []
+        for response in stt_client.streaming_responses(audio_stream):
+            for result in response.results:
+                if "alternatives" in result:
+                    if first_result_time is None:
+                        first_result_time = time.perf_counter()
+                    transcripts.append(result.alternatives[0].transcript)
+        end_time = time.perf_counter()
+        audio_end_time = audio_stream.last_chunk_time or end_time
+
+    return {
+        "file": wav_path,
+        "transcript": "".join(transcripts),
+        "audio_duration": audio_stream.duration,
+        "wall_time": end_time - start_time,
+        # Time from the start of the stream to the first recognized result
+        "time_to_first_result": first_result_time - start_time if first_result_time is not None else None,
+        # Time from the last audio chunk sent to the final response (server finalization/endpointing latency)
+        "latency": max(end_time - audio_end_time, 0.),
+    }
+
+
+def find_recordings(root_dir):
+    # Either a child_stt folder itself or any folder above it (e.g. running_logs/ or running_logs/<child>/)
+    recordings = glob.glob(os.path.join(root_dir, "**", "child_stt", "*.wav"), recursive=True)
+    recordings.extend(glob.glob(os.path.join(root_dir, "*.wav")))
+    return sorted(set(recordings))
+
+
+def replay_directory(stt_client, root_dir, speed=1.0, max_workers=4, chunk_duration=0.1, logger=None):
+    # Batch replay every recording under root_dir with a bounded worker pool
+    recordings = find_recordings(root_dir)
+    start_time = time.perf_counter()
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(replay_file, stt_client, wav_path, speed, chunk_duration): wav_path
+                   for wav_path in recordings}
+        for future, wav_path in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                log_msg = f"Failed to replay {wav_path}: {e}"
+                if logger:
+                    logger.error(log_msg)
+                else:
+                    print(log_msg)
+    wall_time = time.perf_counter() - start_time
+    return results, summarize(results, wall_time)
+
+
+def summarize(results, wall_time):
+    latencies = sorted(result["latency"] for result in results)
+    first_results = [result["time_to_first_result"] for result in results
+                     if result["time_to_first_result"] is not None]
+    total_audio = sum(result["audio_duration"] for result in results)
+
+    def percentile(values, pct):
+        return values[min(int(len(values) * pct), len(values) - 1)] if values else None
+
+    return {
+        "num_files": len(results),
+        "total_audio": total_audio,
+        "wall_time": wall_time,
+        "mean_latency": statistics.mean(latencies) if latencies else None,
+        "p50_latency": percentile(latencies, 0.5),
+        "p95_latency": percentile(latencies, 0.95),
+        "mean_time_to_first_result": statistics.mean(first_results) if first_results else None,
+        # Seconds of audio recognized per second of wall time, and files per second
+        "throughput": total_audio / wall_time if wall_time > 0 else None,
+        "files_per_second": len(results) / wall_time if wall_time > 0 else None,
+    }
+
+
+def save_report(results, output_file):
+    with open(output_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["file", "audio_duration", "wall_time", "time_to_first_result",
+                                               "latency", "transcript"])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    import yaml
+    from .STT import STTStreamingClient
+
+    argparser = argparse.ArgumentParser(description="Replay recorded child_stt audio through STTStreamingClient")
+    argparser.add_argument("root_dir", help="running_logs/ (or any sub folder) containing child_stt recordings")
+    argparser.add_argument("--config", default="configs/sample_config.yaml")
+    argparser.add_argument("--speed", type=float, default=1.0, help="1 = real time, N = N times faster, 0 = no pacing")
+    argparser.add_argument("--workers", type=int, default=4, help="Number of recordings replayed concurrently")
+    argparser.add_argument("--report", default=None, help="Optional CSV file for per-file results")
+    arguments = argparser.parse_args()
+
+    with open(arguments.config) as f:
+        config = yaml.safe_load(f)
+    stt_client = STTStreamingClient(
+        gcs_private_key_path=config["private_key_path"]["GCS_STT"],
+        gcs_project_id=config["gcs_project_id"],
+        max_start_timeout=config["stt_settings"]["max_start_timeout"],
+        max_pause_duration=config["stt_settings"]["max_pause_duration"])
+    file_results, summary = replay_directory(stt_client, arguments.root_dir, speed=arguments.speed,
+                                             max_workers=arguments.workers)
+    for file_result in file_results:
+        print(f"{file_result['file']}: latency {file_result['latency']:.2f}s, "
+              f"first result {file_result['time_to_first_result']}, '{file_result['transcript']}'")
+    print("=" * 50)
+    for key, value in summary.items():
+        print(f"{key}: {value:.3f}" if isinstance(value, float) else f"{key}: {value}")
+    if arguments.report:
+        save_report(file_results, arguments.report)
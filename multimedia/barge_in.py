@@ -0,0 +1,101 @@
+"""
+Notes
+----------------------------------------
+* Barge-in: the microphone is opened before the assistant starts speaking, so a child answering mid-sentence isn't lost
+* A simple energy VAD decides when the child starts talking, then TTS playback is stopped (or ducked) and everything
+  captured shortly before the detection (pre-roll) + the rest of the answer is streamed into STT
+* There's no echo cancellation, so the VAD threshold has to sit above the level the speakers leak into the microphone
+  (or use a headset)
+----------------------------------------
+"""
+import collections
+import itertools
+import math
+
+import numpy as np
+
+import tracing
+from .microphone import MicrophoneStream
+
+
+class EnergyVAD:
+    """Flags speech once enough consecutive chunks are above an energy threshold (dBFS)."""
+
+    def __init__(self, threshold_db: float = -30., min_speech_duration: float = 0.3, chunk_duration: float = 0.1):
+        self.threshold_db = threshold_db
+        self.min_speech_chunks = max(math.ceil(min_speech_duration / chunk_duration), 1)
+        self._num_speech_chunks = 0
+
+    def reset(self):
+        self._num_speech_chunks = 0
+
+    @staticmethod
+    def energy_db(chunk: bytes) -> float:
+        samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float64) / 32768
+        if len(samples) == 0:
+            return -100.
+        return 20 * np.log10(max(np.sqrt(np.mean(samples ** 2)), 1e-5))
+
+    def is_speech(self, chunk: bytes) -> bool:
+        if self.energy_db(chunk) > self.threshold_db:
+            self._num_speech_chunks += 1
+        else:
+            self._num_speech_chunks = 0
+        return self._num_speech_chunks >= self.min_speech_chunks
+
+    @property
+    def speech_started(self) -> bool:
+        return self._num_speech_chunks > 0
+
+
+class BargeInListener:
+    def __init__(self, stt_client, threshold_db=-30., min_speech_duration=0.3, pre_roll=0.5, action="stop",
+                 duck_gain=0.2, logger=None):
+        self.stt_client = stt_client
+        self.vad = EnergyVAD(threshold_db, min_speech_duration)
+        # MicrophoneStream chunks are 100ms
+        self.pre_roll_chunks = max(math.ceil(pre_roll / 0.1), 1)
+        self.action = action
+        self.duck_gain = duck_gain
+        self.logger = logger
+        # True if the child interrupted the last playback
+        self.last_barged_in = False
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.debug(message)
+        else:
+            print(message)
+
+    def listen(self, playback):
+        # playback is an already started AudioPlayback; the microphone is opened right away and the transcript of
+        # the child's answer is returned
+        recording_output_file = self.stt_client.next_recording_file()
+        self._log(f"Recording audio to {recording_output_file}")
+        self._log("Listening (barge-in enabled)...")
+        self.vad.reset()
+        self.last_barged_in = False
+        pre_roll = collections.deque(maxlen=self.pre_roll_chunks)
+
+        with MicrophoneStream(channels=self.stt_client.audio_channels, rate=self.stt_client.rate,
+                              output_file=recording_output_file) as audio_stream:
+            audio_iterator = iter(audio_stream)
+            # Phase 1: assistant is speaking, only run the VAD and keep a short pre-roll buffer
+            for chunk in audio_iterator:
+                pre_roll.append(chunk)
+                if not playback.is_playing:
+                    break
+                if self.vad.is_speech(chunk):
+                    self.last_barged_in = True
+                    tracing.get_tracer().instant("stt.barge_in", "stt", action=self.action)
+                    self._log(f"Barge-in detected, {self.action} TTS playback")
+                    if self.action == "duck":
+                        playback.duck(self.duck_gain)
+                    else:
+                        playback.stop()
+                    break
+            # Playback ended on its own and nobody is talking: the pre-roll is only the assistant's own voice
+            if not self.last_barged_in and not self.vad.speech_started:
+                pre_roll.clear()
+            # Phase 2: the pre-roll (which includes the speech onset) followed by the live microphone goes to STT
+            return self.stt_client.transcribe_stream(itertools.chain(pre_roll, audio_iterator))
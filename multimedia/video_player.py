@@ -1,9 +1,44 @@
 import vlc
 import time
+import queue
+import itertools
 import threading
+from concurrent.futures import Future, CancelledError, InvalidStateError
+
+import tracing
+
+
+class PlaybackFuture(Future):
+    # Resolved with the reason the video stopped playing: "ended", "max_duration", "error", "replaced", "superseded"
+    # or "stopped". cancel() is a clean cancellation handle: it stops the video if it's still the one on screen
+    def __init__(self, video_player, seq, video_path):
+        super().__init__()
+        self._video_player = video_player
+        self.seq = seq
+        self.video_path = video_path
+
+    def cancel(self):
+        cancelled = super().cancel()
+        if cancelled:
+            self._video_player._send("cancel", self.seq)
+        return cancelled
+
+    def join(self, timeout=None):
+        # Same call as threading.Thread.join so callers can wait on a video like they wait on other threads
+        try:
+            self.result(timeout)
+        except (TimeoutError, CancelledError):
+            pass
 
 
 class VideoPlayer:
+    # Every player operation is a command sent to one actor thread, which is the only thread calling into the
+    # libVLC player. Commands get increasing sequence numbers; when several play/stop/pause commands are waiting, only
+    # the newest one runs and the older ones are resolved as "superseded" instead of racing each other.
+    # libVLC event callbacks (end reached, error, ...) are forwarded to the actor as commands too, they must not call
+    # back into libVLC themselves. Completion is reported through a PlaybackFuture per play command
+    _PLAYER_COMMANDS = {"play", "stop", "pause"}
+
     def __init__(self, full_screen=False, logger=None):
         self.instance = vlc.Instance()
         self.player = self.instance.media_player_new()
@@ -12,47 +47,210 @@ class VideoPlayer:
         self.logger = logger
         self.instance.log_unset()
 
-    def play_video(self, video_path, max_duration=None, stop_when_finished=True):
-        # If there's any other video playing, we pause it
-        self.player.pause()
-        self.player.set_mrl(video_path)
-        self.player.play()
+        # Pre-created and pre-parsed media, looping clips (idle, lip flap) are created with input-repeat so they keep
+        # playing without being restarted. Actor state (see preload)
+        self.media_pool = {}
+        self.loop_paths = set()
 
-        time.sleep(0.1)
-        playing_states = {1, 2, 3, 4}  # TODO: Should we leave the pause state outside?
-        duration = self.player.get_length() / 1000
+        self._seq = itertools.count(1)
+        self._commands = queue.Queue()
+        # Actor state, only touched from the actor thread (apart from _current_seq which callbacks read)
+        self._current = None  # dict with future, deadline, stop_when_finished of the video on screen
+        self._current_seq = 0
+        self._switch_start = None
 
-        logging_message = f"Playing {video_path} for {int(duration // 60)}m{int(duration % 60)}s"
+        event_manager = self.player.event_manager()
+        event_manager.event_attach(vlc.EventType.MediaPlayerPlaying, self._forward_event, "playing")
+        event_manager.event_attach(vlc.EventType.MediaPlayerEndReached, self._forward_event, "ended")
+        event_manager.event_attach(vlc.EventType.MediaPlayerEncounteredError, self._forward_event, "error")
+        event_manager.event_attach(vlc.EventType.MediaPlayerLengthChanged, self._forward_event, "length")
+
+        self._actor = threading.Thread(target=self._run_actor, name="VideoPlayerActor", daemon=True)
+        self._actor.start()
+
+    def _log(self, message):
         if self.logger:
-            self.logger.debug(logging_message)
+            self.logger.debug(message)
         else:
-            print(logging_message)
-        max_duration = max_duration if max_duration is not None else float("inf")
-        start_time = time.time()
+            print(message)
+
+    def _send(self, command, *args):
+        self._commands.put((command, *args))
+
+    @staticmethod
+    def _resolve(future, reason):
+        # The caller can cancel a future at any time (PlaybackFuture.cancel), resolving it must not race with that
+        try:
+            future.set_result(reason)
+        except InvalidStateError:
+            pass
+
+    # libVLC event callback (VLC's thread)
+    def _forward_event(self, event, kind):
+        length = event.u.new_length if kind == "length" else None
+        self._send("event", self._current_seq, kind, length)
+
+    # Actor thread
+    def _run_actor(self):
         while True:
-            time.sleep(1)
-            state = self.player.get_state()
-            if state not in playing_states or time.time() - start_time > max_duration:
-                break
-        if stop_when_finished:
+            timeout = None
+            if self._current and self._current["deadline"] is not None:
+                timeout = max(self._current["deadline"] - time.perf_counter(), 0)
+            try:
+                batch = [self._commands.get(timeout=timeout)]
+            except queue.Empty:
+                self._run_command("timeout", self._finish_current, "max_duration")
+                continue
+            # Drain whatever else is waiting, only the newest player command of the batch is executed
+            while True:
+                try:
+                    batch.append(self._commands.get(block=False))
+                except queue.Empty:
+                    break
+            newest_player_command = max((idx for idx, command in enumerate(batch)
+                                         if command[0] in self._PLAYER_COMMANDS), default=None)
+            for idx, command in enumerate(batch):
+                name, args = command[0], command[1:]
+                if name == "shutdown":
+                    self._finish_current("stopped", stop_player=True)
+                    return
+                if name in self._PLAYER_COMMANDS and idx != newest_player_command:
+                    if name == "play":
+                        self._resolve(args[-1], "superseded")
+                    continue
+                self._run_command(name, getattr(self, f"_do_{name}"), *args)
+
+    def _run_command(self, name, func, *args):
+        # A failing command (e.g. a libVLC error) must not kill the actor, every play_video() would then wait forever
+        try:
+            func(*args)
+        except Exception as e:
+            self._log(f"Video player {name} command failed: {e!r}")
+            if name == "play":
+                self._resolve(args[-1], "error")
+            current, self._current = self._current, None
+            if current:
+                self._resolve(current["future"], "error")
+
+    def _finish_current(self, reason, stop_player=None):
+        # Resolve the future of the video on screen and stop/pause the player according to stop_when_finished
+        current, self._current = self._current, None
+        if current is None:
+            return
+        self._resolve(current["future"], reason)
+        if stop_player is None:
+            stop_player = current["stop_when_finished"]
+        if stop_player:
+            self.player.stop()
+        elif reason != "ended":
+            self.player.set_pause(1)
+
+    def _do_play(self, seq, video_path, max_duration, stop_when_finished, future):
+        if future.cancelled():
+            return
+        deadline = time.perf_counter() + max_duration if max_duration is not None else None
+        # A looping clip that's already on screen keeps playing instead of being restarted
+        if (video_path in self.loop_paths and self._current and self._current["future"].video_path == video_path
+                and self.player.is_playing()):
+            self._resolve(self._current["future"], "replaced")
+            self._current = {"future": future, "deadline": deadline, "stop_when_finished": stop_when_finished}
+            self._current_seq = seq
+            return
+        # If there's any other video playing, it's replaced by this one
+        if self._current:
+            self._resolve(self._current["future"], "replaced")
+        self._current = {"future": future, "deadline": deadline, "stop_when_finished": stop_when_finished}
+        self._current_seq = seq
+        self._switch_start = time.perf_counter()
+        if video_path in self.media_pool:
+            self.player.set_media(self.media_pool[video_path])
+        else:
+            self.player.set_mrl(video_path)
+        self.player.play()
+
+    def _do_stop(self, seq):
+        if self._current:
+            self._finish_current("stopped", stop_player=True)
+        else:
             self.player.stop()
+
+    def _do_pause(self, seq):
+        if self._current:
+            self._finish_current("stopped", stop_player=False)
         else:
-            self.player.pause()
+            self.player.set_pause(1)
+
+    def _do_cancel(self, seq):
+        # Only the video on screen needs an action, a queued play command with a cancelled future is skipped
+        if self._current and self._current["future"].seq == seq:
+            self._finish_current("stopped")
+
+    def _do_event(self, seq, kind, length):
+        # Events tagged with an older sequence number belong to a video that has been replaced since
+        if self._current is None or seq != self._current_seq:
+            return
+        video_path = self._current["future"].video_path
+        if kind == "playing" and self._switch_start is not None:
+            switch_end = time.perf_counter()
+            self._log(f"Switched to {video_path} in {(switch_end - self._switch_start) * 1000:.0f}ms")
+            # Recorded on the actor thread: play command -> first frame playing
+            tracing.get_tracer().add_span("video.switch", "video", self._switch_start, switch_end, video=video_path)
+            self._switch_start = None
+        elif kind == "length":
+            duration = length / 1000
+            self._log(f"Playing {video_path} for {int(duration // 60)}m{int(duration % 60)}s")
+        elif kind == "ended":
+            self._finish_current("ended")
+        elif kind == "error":
+            self._log("VLC encountered an error while playing")
+            self._finish_current("error", stop_player=False)
+
+    def _do_preload(self, video_paths, loop_paths):
+        for video_path in list(video_paths) + list(loop_paths):
+            if video_path in self.media_pool:
+                continue
+            media = self.instance.media_new(video_path)
+            if video_path in loop_paths:
+                media.add_option("input-repeat=65535")
+                self.loop_paths.add(video_path)
+            # Asynchronous parse, it's done by the time the clip is needed
+            media.parse_with_options(vlc.MediaParseFlag.local, 0)
+            self.media_pool[video_path] = media
+        self._log(f"Preloaded {len(self.media_pool)} videos ({len(self.loop_paths)} looping)")
+
+    # Public API, safe to call from any thread
+    def preload(self, video_paths, loop_paths=()):
+        # Create and parse the media once, so switching between clips doesn't re-open and re-parse files. Can be called
+        # during playback (e.g. the next part's video, prefetched from a task), media_pool and loop_paths are only
+        # touched by the actor, and a play command sent afterward finds the media preloaded
+        self._send("preload", list(video_paths), list(loop_paths))
 
     def play_video_non_blocking(self, video_path, max_duration=None, stop_when_finished=True):
-        video_player_thread = threading.Thread(target=self.play_video,
-                                               args=(video_path, max_duration, stop_when_finished))
-        video_player_thread.start()
-        return video_player_thread
+        seq = next(self._seq)
+        future = PlaybackFuture(self, seq, video_path)
+        self._send("play", seq, video_path, max_duration, stop_when_finished, future)
+        return future
+
+    def play_video(self, video_path, max_duration=None, stop_when_finished=True):
+        future = self.play_video_non_blocking(video_path, max_duration, stop_when_finished)
+        try:
+            return future.result()
+        except CancelledError:
+            return "stopped"
 
     def stop_video(self):
-        self.player.stop()
+        self._send("stop", next(self._seq))
 
     def pause_video(self):
-        self.player.pause()
+        self._send("pause", next(self._seq))
+
+    def close(self):
+        self._send("shutdown")
+        self._actor.join()
 
 
 if __name__ == "__main__":
     video_player = VideoPlayer()
     video_player.play_video("../videos/rosita-lip-flap.mp4", max_duration=3, stop_when_finished=False)
     time.sleep(1)
+    video_player.close()
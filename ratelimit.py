@@ -0,0 +1,212 @@
+"""
+Shared rate limiting of the external services (OpenAI, Google TTS and STT).
+
+Every request to a service first takes a token from the service's bucket (rate tokens per second, up to burst saved
+up), so the sessions and background work of the process stay under the account's quota instead of running into 429s.
+A 429 that still happens pauses the whole service for its Retry-After (or an exponential backoff), not only the
+request that got it. Limits are per process, set from the rate_limits section of the config (configure()).
+
+Requests have a priority class: interactive (the child is waiting, the default) or background (prefetch, grading...).
+Waiting interactive requests always go first, and background requests leave background_reserve tokens in the bucket
+for them. The time requests waited for a token is kept per service and priority class, reported by report():
+
+    with ratelimit.priority("background"):
+        tts_client.presynthesize(text)
+    ratelimit.call("openai", client.beta.threads.runs.retrieve, thread_id=thread_id, run_id=run_id)
+"""
+import contextlib
+import threading
+import time
+
+import tracing
+
+PRIORITIES = ("interactive", "background")
+# Retries of a request that got a 429
+RATE_LIMIT_RETRIES = 3
+
+_context = threading.local()
+
+
+@contextlib.contextmanager
+def priority(name):
+    # Priority class of the requests made by this thread inside the block
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown priority class {name!r}, expected one of {PRIORITIES}")
+    previous = current_priority()
+    _context.priority = name
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+def current_priority():
+    return getattr(_context, "priority", "interactive")
+
+
+class RateLimiter:
+    def __init__(self, name, rate=None, burst=None, background_reserve=0, logger=None):
+        self.name = name
+        self.logger = logger
+        self._condition = threading.Condition()
+        self._waiting = {priority_name: 0 for priority_name in PRIORITIES}
+        self._stats = {}  # priority -> {"requests", "waited", "wait", "max_wait"}
+        self._paused_until = 0.
+        self.configure(rate, burst, background_reserve)
+
+    def configure(self, rate=None, burst=None, background_reserve=0, logger=None):
+        # rate: tokens (requests) per second, None doesn't limit the service (waits are still measured)
+        with self._condition:
+            self.rate = rate
+            self.burst = burst or max(rate or 1, 1)
+            self.background_reserve = background_reserve
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+            if logger:
+                self.logger = logger
+            self._condition.notify_all()
+
+    def _refill(self, now):
+        if self.rate:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait_time(self, priority, cost, now):
+        # Seconds until a request of this priority class can go, 0 right now, None once no interactive one waits
+        if now < self._paused_until:
+            return self._paused_until - now
+        if priority != "interactive" and self._waiting["interactive"]:
+            return None
+        if not self.rate:
+            return 0
+        needed = min(cost + (self.background_reserve if priority == "background" else 0), self.burst)
+        if self._tokens >= needed:
+            return 0
+        return (needed - self._tokens) / self.rate
+
+    def acquire(self, cost=1, priority=None):
+        # Block until the request can go, returns how long it waited
+        priority = priority or current_priority()
+        start = time.perf_counter()
+        with self._condition:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = self._wait_time(priority, cost, now)
+                    if wait == 0:
+                        break
+                    self._condition.wait(wait)
+                if self.rate:
+                    self._tokens -= cost
+            finally:
+                self._waiting[priority] -= 1
+                # Background requests held back by this one can go again
+                self._condition.notify_all()
+            waited = time.perf_counter() - start
+            stats = self._stats.setdefault(priority, {"requests": 0, "waited": 0, "wait": 0., "max_wait": 0.})
+            stats["requests"] += 1
+            stats["wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+            if waited > 0.001:
+                stats["waited"] += 1
+        if waited > 0.001:
+            tracing.get_tracer().add_span(f"ratelimit.{self.name}", "ratelimit", start, start + waited,
+                                          priority=priority)
+        return waited
+
+    def backoff(self, seconds):
+        # The service answered 429: no request goes for the next seconds
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+        message = f"{self.name} rate limited, pausing its requests for {seconds:.1f}s"
+        if self.logger:
+            self.logger.warning(message)
+        else:
+            print(message)
+
+    def stats(self):
+        with self._condition:
+            return {priority: dict(stats) for priority, stats in self._stats.items()}
+
+    def reset_stats(self):
+        with self._condition:
+            self._stats = {}
+
+
+def is_rate_limited(exception):
+    # 429 from the OpenAI SDK (status_code) or from google.api_core (code)
+    return getattr(exception, "status_code", None) == 429 or getattr(exception, "code", None) == 429
+
+
+def _retry_after(exception):
+    headers = getattr(getattr(exception, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# One limiter per service, shared by every client of the process (like tasks.get_executor())
+_limiters = {}
+_limiters_lock = threading.Lock()
+_logger = None
+
+
+def get_limiter(service):
+    with _limiters_lock:
+        if service not in _limiters:
+            _limiters[service] = RateLimiter(service, logger=_logger)
+        return _limiters[service]
+
+
+def configure(settings, logger=None):
+    # settings: {service: {"rate", "burst", "background_reserve"}}, the rate_limits section of the config
+    global _logger
+    _logger = logger or _logger
+    for service, options in (settings or {}).items():
+        get_limiter(service).configure(logger=logger, **options)
+
+
+def acquire(service, cost=1):
+    return get_limiter(service).acquire(cost)
+
+
+def call(service, func, *args, **kwargs):
+    # func(*args, **kwargs) once the service's limiter lets it go. A 429 pauses the service, then it's sent again
+    limiter = get_limiter(service)
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == RATE_LIMIT_RETRIES:
+                raise
+            limiter.backoff(_retry_after(e) or 2 ** attempt)
+
+
+def stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
+
+
+def reset_stats():
+    # Queueing delays are counted from here, e.g. for each session of the kiosk (the limits themselves go on)
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    for limiter in limiters:
+        limiter.reset_stats()
+
+
+def report():
+    lines = ["Rate limiter queueing:",
+             f"{'service':<10}{'priority':<13}{'requests':>9}{'waited':>8}{'mean wait':>11}{'max wait':>10}"]
+    for service, service_stats in sorted(stats().items()):
+        for priority_name, priority_stats in sorted(service_stats.items()):
+            mean_wait = priority_stats["wait"] / max(priority_stats["requests"], 1)
+            lines.append(f"{service:<10}{priority_name:<13}{priority_stats['requests']:>9}{priority_stats['waited']:>8}"
+                         f"{mean_wait:>10.3f}s{priority_stats['max_wait']:>9.3f}s")
+    return "\n".join(lines)
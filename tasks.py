@@ -0,0 +1,149 @@
+"""
+Background tasks of the application (speech while the next question is prepared, learning history export...).
+
+Every task goes to one shared, bounded thread pool instead of a thread of its own. Submitting returns a TaskFuture:
+its exception (e.g. a TTS failure) is logged as soon as the task fails and raised again by result()/join(), join()
+takes a timeout like threading.Thread.join, and a task that hasn't started yet can be cancelled. The pool keeps, per
+task name, how many ran, failed and how long they waited in the queue and ran, reported with stats():
+
+    speech = tasks.submit("speak", self.speak, text)
+    ...
+    speech.join()
+"""
+import concurrent.futures
+import functools
+import threading
+import time
+
+import tracing
+
+
+class TaskFuture(concurrent.futures.Future):
+    def __init__(self, name, timeout=None):
+        super().__init__()
+        self.name = name
+        # Default timeout of join()/result(), None waits as long as the task runs
+        self.timeout = timeout
+
+    def result(self, timeout=None):
+        return super().result(self.timeout if timeout is None else timeout)
+
+    def join(self, timeout=None):
+        # Wait for the task like for a thread, its exception is raised here. A cancelled task is nothing to wait for
+        try:
+            self.result(timeout)
+        except concurrent.futures.CancelledError:
+            pass
+
+
+class TaskExecutor:
+    def __init__(self, max_workers=8, logger=None):
+        self.max_workers = max_workers
+        self.logger = logger
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        self._lock = threading.Lock()
+        self._queued = 0
+        self.max_queue_depth = 0
+        self._running = {}  # thread name -> name of the task it runs
+        self._stats = {}  # task name -> {"tasks", "failed", "cancelled", "wait", "run"}
+
+    def configure(self, max_workers=None, logger=None):
+        # Only before the first task is submitted (the pool is created lazily by ThreadPoolExecutor anyway)
+        if max_workers and max_workers != self.max_workers:
+            self._pool.shutdown(wait=True)
+            self.max_workers = max_workers
+            self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        if logger:
+            self.logger = logger
+
+    @property
+    def queue_depth(self):
+        # Tasks submitted but not started yet
+        return self._queued
+
+    @property
+    def running(self):
+        # Names of the tasks running right now
+        with self._lock:
+            return list(self._running.values())
+
+    def _record(self, name, field, value=1):
+        stats = self._stats.setdefault(name, {"tasks": 0, "failed": 0, "cancelled": 0, "wait": 0., "run": 0.})
+        stats[field] += value
+
+    def _run(self, future, submitted, func, args, kwargs):
+        thread_name = threading.current_thread().name
+        with self._lock:
+            self._queued -= 1
+            if not future.set_running_or_notify_cancel():
+                self._record(future.name, "cancelled")
+                return
+            self._running[thread_name] = future.name
+        start = time.perf_counter()
+        try:
+            with tracing.span(future.name, "task"):
+                result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            if self.logger:
+                self.logger.exception(f"Background task {future.name} failed")
+            else:
+                print(f"Background task {future.name} failed: {e!r}")
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._running[thread_name]
+                self._record(future.name, "tasks")
+                self._record(future.name, "wait", start - submitted)
+                self._record(future.name, "run", time.perf_counter() - start)
+                if future.exception() is not None:
+                    self._record(future.name, "failed")
+
+    def submit(self, name, func, *args, timeout=None, **kwargs):
+        future = TaskFuture(name, timeout)
+        with self._lock:
+            self._queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self._queued)
+        self._pool.submit(self._run, future, time.perf_counter(), func, args, kwargs)
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def report(self):
+        lines = [f"Background tasks ({self.max_workers} workers, max queue depth {self.max_queue_depth}):",
+                 f"{'task':<24}{'count':>7}{'failed':>8}{'wait':>10}{'run':>10}"]
+        for name, stats in sorted(self.stats().items()):
+            count = max(stats["tasks"], 1)
+            lines.append(f"{name:<24}{stats['tasks']:>7}{stats['failed']:>8}{stats['wait'] / count:>9.3f}s"
+                         f"{stats['run'] / count:>9.3f}s")
+        return "\n".join(lines)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+# One pool per process, shared by every module (like tracing.get_tracer())
+_executor = TaskExecutor()
+
+
+def get_executor():
+    return _executor
+
+
+def submit(name, func, *args, timeout=None, **kwargs):
+    return _executor.submit(name, func, *args, timeout=timeout, **kwargs)
+
+
+def background(name=None, timeout=None):
+    # Decorator: calling the function submits it to the shared pool and returns its TaskFuture
+    def middle(func):
+        task_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return _executor.submit(task_name, func, *args, timeout=timeout, **kwargs)
+        return wrapper
+    return middle
@@ -0,0 +1,82 @@
+import os
+import sys
+
+import pytest
+import yaml
+
+# The modules live at the top of the repository
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import utils  # noqa: E402
+from benchmarks.fakes import make_latency_models, ExternalTimeline  # noqa: E402
+from benchmarks.session_benchmark import BenchmarkCA  # noqa: E402
+
+
+@pytest.fixture
+def make_episode(tmp_path):
+    # Writes a small episode folder (<name>_main.xlsx, _question_bank.xlsx...) under tmp_path/transcripts/, returns
+    # {category: path}. bank: (id_text, question, level) rows
+    pd = pytest.importorskip("pandas")
+
+    def make(name, parts=2, bank=None, pretest=True, warmups=True):
+        episode_dir = tmp_path / "transcripts" / name
+        episode_dir.mkdir(parents=True, exist_ok=True)
+        text_files = {"transcript": str(episode_dir / f"{name}_main.xlsx")}
+        pd.DataFrame({"id_text": list(range(1, parts + 1)),
+                      "text": [f"Story part {idx}" for idx in range(1, parts + 1)],
+                      "question": [f"Base question {idx}?" for idx in range(1, parts + 1)]}).to_excel(
+            text_files["transcript"], index=False)
+        if bank is None:
+            bank = [(idx, f"{level.capitalize()} question {idx}?", level) for idx in range(1, parts + 1)
+                    for level in ("deep", "shallow", "intermediate")]
+        if bank:
+            text_files["question_bank"] = str(episode_dir / f"{name}_question_bank.xlsx")
+            pd.DataFrame(bank, columns=["id_text", "question", "level"]).to_excel(text_files["question_bank"],
+                                                                                 index=False)
+        if pretest:
+            text_files["pretest"] = str(episode_dir / f"{name}_pre_test.xlsx")
+            pd.DataFrame({"question_id": [1, 2], "level": ["shallow", "deep"], "question": ["Pre 1?", "Pre 2?"],
+                          "answer": ["Yes", "Because"]}).to_excel(text_files["pretest"], index=False)
+        if warmups:
+            text_files["warmups"] = str(episode_dir / f"{name}_warmups.xlsx")
+            pd.DataFrame({"question_id": [1], "question": ["How are you?"]}).to_excel(text_files["warmups"],
+                                                                                     index=False)
+        return text_files
+    return make
+
+
+@pytest.fixture
+def make_agent(tmp_path, monkeypatch):
+    # BenchmarkCA (AdaptiveCA on fake services) on the bundled lucky_shirt content, logging under tmp_path
+    pytest.importorskip("pandas")
+    monkeypatch.chdir(REPO_DIR)
+    agents = []
+
+    def make(resume_dir=None, pretest_only=False, transcripts_dir=None, **turn_settings):
+        with open("configs/sample_config.yaml") as f:
+            config = yaml.safe_load(f)
+        config["logging"]["logging_dir"] = str(tmp_path / "logs")
+        config["content_cache_dir"] = str(tmp_path / "cache")
+        if transcripts_dir:
+            config["transcripts_dir"] = transcripts_dir
+        config["video_settings"].update({"start_episode": 1, "max_videos": 2})
+        config["stt_settings"]["barge_in"]["enabled"] = False
+        config["rate_limits"] = None
+        config["turn_settings"].update(turn_settings)
+        config_file = str(tmp_path / "config.yaml")
+        with open(config_file, "w") as f:
+            yaml.safe_dump(config, f)
+        agent = BenchmarkCA(config_file, make_latency_models("zero"), ExternalTimeline(), pretest_only=pretest_only,
+                            resume_dir=resume_dir)
+        agents.append(agent)
+        return agent
+
+    yield make
+    for agent in agents:
+        agent.history_store.close()
+        if agent.grading_executor:
+            agent.grading_executor.shutdown()
+        utils.stop_queue_logging(agent.log_listener)
+        for handler in list(agent.logger.handlers):
+            agent.logger.removeHandler(handler)
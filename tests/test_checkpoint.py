@@ -0,0 +1,99 @@
+import json
+import os
+
+import pytest
+
+from history_store import read_learning_history
+
+pytest.importorskip("pandas")
+from benchmarks.session_benchmark import SCRIPTED_ANSWERS  # noqa: E402
+
+
+class Crash(Exception):
+    pass
+
+
+def crash_at_answer(agent, answer_idx):
+    # The child's answer_idx-th answer (1-index) never comes, the program stops there (like a kill)
+    speech_to_text = agent.stt_client.speech_to_text
+    answers = []
+
+    def crashing_speech_to_text():
+        answers.append(None)
+        if len(answers) == answer_idx:
+            raise Crash()
+        return speech_to_text()
+
+    agent.stt_client.speech_to_text = crashing_speech_to_text
+
+
+def load_checkpoint(agent):
+    with open(os.path.join(agent.logging_root_dir, "checkpoint.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_checkpoint_after_every_turn(make_agent):
+    agent = make_agent(pretest_only=True)
+    crash_at_answer(agent, 3)
+    agent.run_pretest_program()
+    checkpoint = load_checkpoint(agent)
+    assert checkpoint["program"] == "pretest"
+    assert checkpoint["position"] == {"section": "pretest", "question_idx": 2}
+    assert [turn["answer"] for turn in checkpoint["learning_history"]["pretest"]] == SCRIPTED_ANSWERS[:2]
+    assert checkpoint["thread_id"] == agent.assistant.thread.id
+    assert checkpoint["episode"] == "lucky_shirt"
+    # Written to a temporary file then renamed
+    assert not os.path.exists(os.path.join(agent.logging_root_dir, "checkpoint.json.tmp"))
+
+
+@pytest.mark.parametrize("pretest_grading", ["immediate", "deferred"])
+def test_resumed_pretest(make_agent, pretest_grading):
+    agent = make_agent(pretest_only=True, pretest_grading=pretest_grading)
+    crash_at_answer(agent, 2)
+    agent.run_pretest_program()
+    resumed = make_agent(resume_dir=agent.logging_root_dir, pretest_only=True, pretest_grading=pretest_grading)
+    assert resumed.resumed_program == "pretest"
+    assert resumed.logging_root_dir == agent.logging_root_dir
+    assert resumed.assistant.thread.id == agent.assistant.thread.id
+    resumed.run_pretest_program()
+    assert resumed.position == {"section": "done"}
+    # Every question answered once, the first before the crash
+    pretest = resumed.learning_history["pretest"]
+    assert [turn["question"] for turn in pretest] == [question["question"] for question in resumed.pretest]
+    assert set(pretest[0]) == {"question", "answer", "feedback"}
+    # Graded, also the answer whose deferred grading was pending at the crash
+    assert None not in resumed.pretest_accuracy and len(resumed.pretest_accuracy) == len(pretest)
+    resumed.history_store.close()
+    stored = read_learning_history(resumed.history_store.file_path)["pretest"]
+    assert [turn["accuracy"] for turn in stored] == resumed.pretest_accuracy
+
+
+def test_finished_session_isnt_run_again(make_agent):
+    agent = make_agent(pretest_only=True)
+    agent.run_pretest_program()
+    resumed = make_agent(resume_dir=agent.logging_root_dir, pretest_only=True)
+    resumed.run_pretest_program()
+    assert len(resumed.learning_history["pretest"]) == len(agent.learning_history["pretest"])
+    assert resumed.turns == []
+
+
+def test_resumed_mid_part(make_agent):
+    agent = make_agent()
+    # Answer 1: first question of part 1, answer 2 never comes
+    crash_at_answer(agent, 2)
+    agent.run_adaptive_learning_program(skip_warmup=True)
+    checkpoint = load_checkpoint(agent)
+    position = checkpoint["position"]
+    assert (position["section"], position["episode_idx"], position["question_idx"]) == ("episode", 0, 1)
+
+    resumed = make_agent(resume_dir=agent.logging_root_dir)
+    assert resumed.resumed_program == "adaptive"
+    resumed.run_adaptive_learning_program()
+    assert resumed.position["section"] == "done"
+    episode = resumed.learning_history["episode"]
+    assert len(episode) == 2
+    # Part 1 goes on with the question chosen before the crash, after the turn answered then
+    assert episode[0][0] == checkpoint["learning_history"]["episode"][0][0]
+    assert episode[0][1]["question"] == position["next_question"]["question"]
+    # The resumed session doesn't start over at the warmup
+    assert "warmup" not in resumed.learning_history
@@ -0,0 +1,78 @@
+import pytest
+
+from content_catalog import EpisodeCatalog, discover_episodes, question_rows
+
+
+@pytest.fixture
+def catalog(tmp_path, make_episode):
+    pd = pytest.importorskip("pandas")
+    make_episode("lucky_shirt", parts=2, bank=[(1, "Why?", "deep"), (1, "Who?", "shallow"), (1, "What?", "shallow"),
+                                               (2, "Where?", "intermediate")])
+    make_episode("picnic", parts=1, bank=[(7, "When?", "Shallow")], pretest=False, warmups=False)
+    # Base transcript only, and one whose episode also has a full folder
+    pd.DataFrame({"id": [1], "text": ["Part one"], "base_q": ["Q1?"]}).to_excel(
+        tmp_path / "transcripts" / "town_base.xlsx", index=False)
+    pd.DataFrame({"id": [1], "text": ["Part one"], "base_q": ["Q1?"]}).to_excel(
+        tmp_path / "transcripts" / "picnic_base.xlsx", index=False)
+    return EpisodeCatalog(str(tmp_path / "transcripts"), str(tmp_path / "cache"))
+
+
+def test_discovered_episodes(tmp_path, catalog):
+    episodes = discover_episodes(str(tmp_path / "transcripts"))
+    assert sorted(episodes) == ["lucky_shirt", "picnic", "town"]
+    # The folder takes priority over the base transcript of the same episode
+    assert episodes["picnic"]["transcript"].endswith("picnic_main.xlsx")
+    assert set(episodes["lucky_shirt"]) == {"transcript", "question_bank", "pretest", "warmups"}
+    assert sorted(catalog.names) == ["lucky_shirt", "picnic", "town"]
+
+
+def test_candidates_by_segment_and_level(catalog):
+    assert [question["question"] for question in catalog.candidates("lucky_shirt", 1, "shallow")] == ["Who?",
+                                                                                                     "What?"]
+    assert [question["question"] for question in catalog.candidates("lucky_shirt", 2, "INTERMEDIATE")] == ["Where?"]
+    # Levels are normalized when compiled
+    assert [question["question"] for question in catalog.candidates("picnic", 7, "shallow")] == ["When?"]
+    assert catalog.candidates("lucky_shirt", 2, "deep") == []
+    assert catalog.candidates("town", 1, "shallow") == []
+
+
+def test_segment_ids(catalog):
+    assert [catalog.segment_id("lucky_shirt", idx) for idx in range(3)] == [1, 2, None]
+    assert catalog.segment_id("town", 0) is None
+
+
+def test_episode_content(catalog):
+    assert catalog.content("town")["num_bank_questions"] == 0
+    assert [dialogue["question"] for dialogue in catalog.content("lucky_shirt")["dialogues"]] == [
+        "Base question 1?", "Base question 2?"]
+    with pytest.raises(KeyError):
+        catalog.content("unknown")
+
+
+def test_added_episode_is_loaded_once(catalog, make_episode):
+    content = catalog.content("lucky_shirt")
+    assert catalog.add_episode("lucky_shirt", make_episode("lucky_shirt", parts=3)) is content
+    assert len(catalog.candidates("lucky_shirt", 1, "shallow")) == 2
+
+
+def test_question_by_id(catalog):
+    assert catalog.question("lucky_shirt", "1S2")["question"] == "What?"
+    # The assistant's answer may be padded, the id is a string either way
+    assert catalog.question("lucky_shirt", " 2I1 ")["question"] == "Where?"
+    assert catalog.question("picnic", "7S1")["question"] == "When?"
+    # Ids are per episode
+    assert catalog.question("picnic", "1S1") is None
+    assert catalog.question("lucky_shirt", "9D9") is None
+    assert catalog.question("lucky_shirt", 12) is None
+
+
+def test_selected_question_is_one_of_the_candidates(catalog):
+    candidates = catalog.candidates("lucky_shirt", 1, "shallow")
+    assert catalog.question("lucky_shirt", "1S1") in candidates
+    # Right id, wrong level: not a candidate, AdaptiveCA uses the fallback question
+    assert catalog.question("lucky_shirt", "1D1") not in candidates
+
+
+def test_question_rows():
+    assert question_rows([{"id": "1S1", "level": "SHALLOW", "question": "Who?"},
+                          {"id": "1D1", "level": "DEEP", "question": "Why?"}]) == "1S1|SHALLOW|Who?\n1D1|DEEP|Why?"
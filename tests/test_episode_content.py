@@ -0,0 +1,114 @@
+import json
+import os
+
+import pytest
+
+import episode_content
+from episode_content import load_episode_content, _cache_path
+
+
+class ListLogger:
+    def __init__(self):
+        self.messages = []
+
+    def debug(self, message):
+        self.messages.append(message)
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "cache")
+
+
+def load(text_files, cache_dir, **kwargs):
+    logger = ListLogger()
+    content = load_episode_content(text_files, cache_dir, logger=logger, **kwargs)
+    return content, logger.messages[-1]
+
+
+def test_compiled_content(make_episode, cache_dir):
+    content, message = load(make_episode("lucky", parts=2), cache_dir)
+    assert message.startswith("Compiled")
+    assert [dialogue["question"] for dialogue in content["dialogues"]] == ["Base question 1?", "Base question 2?"]
+    assert content["warmup_questions"] == ["How are you?"]
+    assert [question["answer"] for question in content["pretest"]] == ["Yes", "Because"]
+    # Ordered shallow -> intermediate -> deep, ids stable across loads
+    assert [(question["id"], question["level"]) for question in content["question_banks"][0]] == [
+        ("1S1", "SHALLOW"), ("1I1", "INTERMEDIATE"), ("1D1", "DEEP")]
+    assert content["bank_segment_ids"] == [1, 2]
+    assert content["num_bank_questions"] == 6
+
+
+def test_second_load_uses_the_cache(make_episode, cache_dir, monkeypatch):
+    text_files = make_episode("lucky")
+    compiled, _ = load(text_files, cache_dir)
+
+    def no_pandas(text_files):
+        raise AssertionError("Spreadsheets parsed again")
+
+    monkeypatch.setattr(episode_content, "compile_episode_content", no_pandas)
+    cached, message = load(text_files, cache_dir)
+    assert message.startswith("Loaded compiled")
+    assert cached == compiled
+
+
+def test_touched_file_with_the_same_content_isnt_recompiled(make_episode, cache_dir):
+    text_files = make_episode("lucky")
+    load(text_files, cache_dir)
+    stat = os.stat(text_files["transcript"])
+    os.utime(text_files["transcript"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    _, message = load(text_files, cache_dir)
+    assert message.startswith("Loaded compiled")
+    # The new mtime is recorded, the next load doesn't hash the file again
+    with open(_cache_path(text_files, cache_dir), encoding="utf-8") as f:
+        artifact = json.load(f)
+    assert artifact["sources"]["transcript"]["mtime_ns"] == stat.st_mtime_ns + 10 ** 9
+
+
+def test_changed_spreadsheet_is_recompiled(make_episode, cache_dir):
+    text_files = make_episode("lucky", parts=2)
+    load(text_files, cache_dir)
+    make_episode("lucky", parts=3)
+    content, message = load(text_files, cache_dir)
+    assert message.startswith("Compiled")
+    assert len(content["dialogues"]) == 3
+
+
+def test_new_cache_version_is_recompiled(make_episode, cache_dir, monkeypatch):
+    text_files = make_episode("lucky")
+    load(text_files, cache_dir)
+    monkeypatch.setattr(episode_content, "CACHE_VERSION", episode_content.CACHE_VERSION + 1)
+    _, message = load(text_files, cache_dir)
+    assert message.startswith("Compiled")
+
+
+def test_sources_set_changed_is_recompiled(make_episode, cache_dir):
+    text_files = make_episode("lucky")
+    load(text_files, cache_dir)
+    # Same cache file (keyed by transcript and paths), one source less
+    artifact_file = _cache_path(text_files, cache_dir)
+    with open(artifact_file, encoding="utf-8") as f:
+        artifact = json.load(f)
+    del artifact["sources"]["warmups"]
+    with open(artifact_file, "w", encoding="utf-8") as f:
+        json.dump(artifact, f)
+    _, message = load(text_files, cache_dir)
+    assert message.startswith("Compiled")
+
+
+def test_force_compile(make_episode, cache_dir):
+    text_files = make_episode("lucky")
+    load(text_files, cache_dir)
+    _, message = load(text_files, cache_dir, force_compile=True)
+    assert message.startswith("Compiled")
+
+
+def test_base_transcript_only(tmp_path, cache_dir):
+    pd = pytest.importorskip("pandas")
+    transcript = str(tmp_path / "picnic_base.xlsx")
+    pd.DataFrame({"id": [1, 2, 3], "text": ["Part one", None, "Part three"],
+                  "base_q": ["Q1?", "Q2?", "Q3?"]}).to_excel(transcript, index=False)
+    content, _ = load({"transcript": transcript}, cache_dir)
+    # Rows without dialogue are left out
+    assert [dialogue["question"] for dialogue in content["dialogues"]] == ["Q1?", "Q3?"]
+    assert content["question_banks"] == [] and content["num_bank_questions"] == 0
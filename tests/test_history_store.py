@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from history_store import LearningHistoryStore, read_learning_history
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LearningHistoryStore(str(tmp_path / "learning_history.jsonl"))
+    yield store
+    store.close()
+
+
+def test_sections_and_episode_parts(store):
+    store.append("warmup", {"question": "Hi?", "answer": "Hello"})
+    store.append("episode", {"question": "Part 2", "accuracy": 1.0}, episode=1)
+    store.append("episode", {"question": "Part 1", "accuracy": 0.0}, episode=0)
+    store.append("episode", {"question": "Part 1 again", "accuracy": 0.5}, episode=0)
+    store.close()
+    learning_history = read_learning_history(store.file_path)
+    assert learning_history["warmup"] == [{"question": "Hi?", "answer": "Hello"}]
+    # Parts in order, turns of a part in the order they were appended
+    assert [[turn["question"] for turn in part] for part in learning_history["episode"]] == [
+        ["Part 1", "Part 1 again"], ["Part 2"]]
+
+
+def test_update_goes_to_the_turn_with_its_id(store):
+    first_id = store.append("pretest", {"question": "Q1", "accuracy": None})
+    # Asked again after a crash: the same question is in the store twice, only the second one gets the grade
+    store.append("pretest", {"question": "Q1", "accuracy": None})
+    second_id = store.append("pretest", {"question": "Q1", "accuracy": None})
+    store.update("pretest", second_id, {"accuracy": 1.0})
+    store.update("pretest", first_id, {"accuracy": 0.0})
+    store.close()
+    pretest = read_learning_history(store.file_path)["pretest"]
+    assert [turn["accuracy"] for turn in pretest] == [0.0, None, 1.0]
+
+
+def test_ids_are_unique(store):
+    assert len({store.append("warmup", {"question": str(idx)}) for idx in range(100)}) == 100
+
+
+def test_update_of_a_missing_turn_is_skipped(store):
+    store.append("pretest", {"question": "Q1", "accuracy": None})
+    store.update("pretest", "lost", {"accuracy": 1.0})
+    store.close()
+    assert read_learning_history(store.file_path)["pretest"] == [{"question": "Q1", "accuracy": None}]
+
+
+def test_truncated_last_line_is_ignored(store):
+    record_id = store.append("pretest", {"question": "Q1", "accuracy": None})
+    store.update("pretest", record_id, {"accuracy": 0.5})
+    store.close()
+    with open(store.file_path, "a", encoding="utf-8") as f:
+        # Killed mid-write
+        f.write(json.dumps({"id": "x", "section": "pretest", "episode": None, "record": {"question": "Q2"}})[:30])
+    assert read_learning_history(store.file_path)["pretest"] == [{"question": "Q1", "accuracy": 0.5}]
+
+
+def test_resumed_session_appends_to_the_same_file(store):
+    store.append("warmup", {"question": "Before"})
+    store.close()
+    resumed = LearningHistoryStore(store.file_path)
+    resumed.append("warmup", {"question": "After"})
+    resumed.close()
+    assert [turn["question"] for turn in read_learning_history(store.file_path)["warmup"]] == ["Before", "After"]
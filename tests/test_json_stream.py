@@ -0,0 +1,72 @@
+import json
+import random
+
+import pytest
+
+from json_stream import JSONFieldStream
+
+FEEDBACK = {"accuracy": 1, "evaluation": "Good thinking, \"Ari\"!\nYes \\ no", "explanation": "It's {not} [nested]",
+            "scores": [1, [2, 3], {"a": "]"}], "details": {"level": "deep", "ids": ["3D2", "}"]}, "done": True,
+            "missing": None, "ratio": -0.5e-3, "unicode": "café ❤"}
+
+
+def feed_in_chunks(text, sizes):
+    fields = JSONFieldStream()
+    completed, position = [], 0
+    for size in sizes:
+        completed.extend(fields.feed(text[position:position + size]))
+        position += size
+    completed.extend(fields.feed(text[position:]))
+    return fields, completed
+
+
+def test_fields_are_reported_as_soon_as_complete():
+    fields = JSONFieldStream()
+    assert fields.feed('{"accuracy": 1, "evaluation": "Good th') == [("accuracy", 1)]
+    assert fields.feed('inking!", "explanation": "Ari') == [("evaluation", "Good thinking!")]
+    assert fields.feed('"}') == [("explanation", "Ari")]
+    assert fields.done
+
+
+def test_number_is_complete_at_the_next_separator():
+    fields = JSONFieldStream()
+    assert fields.feed('{"accuracy": 1') == []
+    assert fields.feed('0}') == [("accuracy", 10)]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_escapes_and_nesting_whole(ensure_ascii, indent):
+    text = json.dumps(FEEDBACK, ensure_ascii=ensure_ascii, indent=indent)
+    fields, completed = feed_in_chunks(text, [])
+    assert completed == list(FEEDBACK.items())
+    assert fields.fields == FEEDBACK
+    assert fields.done
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_arbitrary_chunk_boundaries(seed):
+    rng = random.Random(seed)
+    text = json.dumps(FEEDBACK, ensure_ascii=rng.random() < 0.5, indent=rng.choice([None, 1]))
+    sizes = [rng.randint(1, 8) for _ in range(len(text))]
+    fields, completed = feed_in_chunks(text, sizes)
+    assert completed == list(FEEDBACK.items())
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(FEEDBACK)
+    _, completed = feed_in_chunks(text, [1] * len(text))
+    assert completed == list(FEEDBACK.items())
+
+
+def test_nothing_after_the_closing_brace():
+    fields = JSONFieldStream()
+    assert fields.feed('{"a": "x"} {"b": 1}') == [("a", "x")]
+    assert fields.feed(', "c": 2}') == []
+    assert fields.fields == {"a": "x"}
+
+
+def test_empty_object():
+    fields = JSONFieldStream()
+    assert fields.feed("{}") == []
+    assert fields.done
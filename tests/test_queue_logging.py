@@ -0,0 +1,40 @@
+import logging
+
+import utils
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_records_are_flushed_when_stopped():
+    logger = logging.getLogger("test_queue_logging")
+    handler = ListHandler()
+    listener = utils.attach_queue_logging(logger, [handler])
+    for idx in range(100):
+        logger.warning(f"record {idx}")
+    utils.stop_queue_logging(listener)
+    assert handler.messages == [f"record {idx}" for idx in range(100)]
+    # Already stopped
+    utils.stop_queue_logging(listener)
+    for queue_handler in list(logger.handlers):
+        logger.removeHandler(queue_handler)
+
+
+def test_stopped_listeners_arent_kept_for_exit():
+    # A new listener per kiosk session, the exit handler only stops the ones still running
+    logger = logging.getLogger("test_queue_logging_sessions")
+    listeners = [utils.attach_queue_logging(logger, [ListHandler()]) for _ in range(5)]
+    for listener in listeners[:-1]:
+        utils.stop_queue_logging(listener)
+    assert not set(listeners[:-1]) & utils._running_listeners
+    assert listeners[-1] in utils._running_listeners
+    utils._stop_running_listeners()
+    assert listeners[-1] not in utils._running_listeners
+    for queue_handler in list(logger.handlers):
+        logger.removeHandler(queue_handler)
@@ -0,0 +1,146 @@
+import threading
+import time
+import types
+
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter
+
+
+def start_acquire(limiter, priority, done):
+    def run():
+        limiter.acquire(priority=priority)
+        done.append(priority)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_for_waiters(limiter, priority, count):
+    deadline = time.monotonic() + 2
+    while limiter._waiting[priority] < count:
+        assert time.monotonic() < deadline, f"{count} {priority} waiters expected"
+        time.sleep(0.001)
+
+
+def test_unlimited_service_never_waits():
+    limiter = RateLimiter("svc")
+    for _ in range(100):
+        assert limiter.acquire() < 0.01
+    assert limiter.stats()["interactive"]["requests"] == 100
+
+
+def test_burst_then_rate():
+    limiter = RateLimiter("svc", rate=20, burst=2)
+    start = time.perf_counter()
+    for _ in range(4):
+        limiter.acquire()
+    # 2 from the burst, 2 refilled at 20/s
+    assert 0.08 < time.perf_counter() - start < 0.5
+    stats = limiter.stats()["interactive"]
+    assert stats["requests"] == 4 and stats["waited"] == 2
+
+
+def test_interactive_requests_go_before_waiting_background_ones():
+    limiter = RateLimiter("svc", rate=1e-6, burst=1)
+    limiter.acquire()  # empty bucket
+    done = []
+    background = [start_acquire(limiter, "background", done) for _ in range(2)]
+    wait_for_waiters(limiter, "background", 2)
+    interactive = start_acquire(limiter, "interactive", done)
+    wait_for_waiters(limiter, "interactive", 1)
+    # Refill one token at a time
+    for _ in range(3):
+        limiter.configure(rate=1e-6, burst=1)
+        time.sleep(0.05)
+    for thread in background + [interactive]:
+        thread.join(timeout=2)
+    assert done == ["interactive", "background", "background"]
+
+
+def test_background_leaves_the_reserve_to_interactive():
+    limiter = RateLimiter("svc", rate=1e-6, burst=3, background_reserve=2)
+    limiter.acquire(priority="background")  # 3 -> 2 tokens, the reserve
+    done = []
+    background = start_acquire(limiter, "background", done)
+    wait_for_waiters(limiter, "background", 1)
+    time.sleep(0.05)
+    assert done == []
+    assert limiter.acquire(priority="interactive") < 0.01
+    assert limiter.acquire(priority="interactive") < 0.01
+    limiter.configure(rate=1e-6, burst=3, background_reserve=2)  # full bucket again
+    background.join(timeout=2)
+    assert done == ["background"]
+
+
+def test_backoff_pauses_every_priority():
+    limiter = RateLimiter("svc", rate=1000, burst=10, logger=types.SimpleNamespace(warning=lambda message: None))
+    limiter.backoff(0.1)
+    assert limiter.acquire(priority="interactive") > 0.05
+
+
+def test_priority_context():
+    assert ratelimit.current_priority() == "interactive"
+    with ratelimit.priority("background"):
+        assert ratelimit.current_priority() == "background"
+        with ratelimit.priority("interactive"):
+            assert ratelimit.current_priority() == "interactive"
+        assert ratelimit.current_priority() == "background"
+    assert ratelimit.current_priority() == "interactive"
+    with pytest.raises(ValueError):
+        with ratelimit.priority("urgent"):
+            pass
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("429")
+        self.status_code = 429
+        self.response = types.SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+def test_call_retries_after_a_429():
+    attempts = []
+
+    def request(value):
+        attempts.append(time.perf_counter())
+        if len(attempts) == 1:
+            raise RateLimited(retry_after="0.05")
+        return value
+
+    ratelimit.configure({"test_retry": {"rate": None}}, logger=types.SimpleNamespace(warning=lambda message: None))
+    assert ratelimit.call("test_retry", request, "ok") == "ok"
+    assert len(attempts) == 2 and attempts[1] - attempts[0] >= 0.04
+
+
+def test_call_raises_other_errors_and_the_last_429(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_RETRIES", 1)
+    ratelimit.configure({"test_errors": {"rate": None}}, logger=types.SimpleNamespace(warning=lambda message: None))
+    calls = []
+
+    def failing(error):
+        calls.append(error)
+        raise error
+
+    with pytest.raises(KeyError):
+        ratelimit.call("test_errors", failing, KeyError("x"))
+    assert len(calls) == 1
+    with pytest.raises(RateLimited):
+        ratelimit.call("test_errors", failing, RateLimited(retry_after="0.01"))
+    assert len(calls) == 3
+
+
+def test_is_rate_limited():
+    assert ratelimit.is_rate_limited(RateLimited())
+    assert ratelimit.is_rate_limited(types.SimpleNamespace(code=429))
+    assert not ratelimit.is_rate_limited(ValueError())
+
+
+def test_reset_stats():
+    ratelimit.acquire("test_stats")
+    assert ratelimit.stats()["test_stats"]["interactive"]["requests"] == 1
+    assert "test_stats" in ratelimit.report()
+    ratelimit.reset_stats()
+    assert ratelimit.stats()["test_stats"] == {}
+    assert "test_stats" not in ratelimit.report()
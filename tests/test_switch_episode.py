@@ -0,0 +1,49 @@
+import pytest
+
+import utils
+
+
+@pytest.fixture
+def agent(tmp_path, make_episode, make_agent):
+    make_episode("ocean", parts=3)
+    # Transcript with base questions only
+    make_episode("picnic", parts=2, bank=[], pretest=False, warmups=False)
+    return make_agent(transcripts_dir=str(tmp_path / "transcripts"))
+
+
+def test_switch_to_another_episode(agent):
+    configured = dict(agent.video_path_list)
+    agent.switch_episode("ocean")
+    assert agent.episode == "ocean"
+    assert [dialogue["text"] for dialogue in agent.dialogues] == ["Story part 1", "Story part 2", "Story part 3"]
+    assert agent.warmup_questions == ["How are you?"]
+    assert agent.catalog.segment_id("ocean", 0) == 1
+    # Everything the episode plays comes from its own video folder, the character clips are shared
+    assert agent.video_path_list["episodes"][0].replace("\\", "/").endswith("videos/ocean/01_episode.mp4")
+    assert agent.video_path_list["intro"].replace("\\", "/").endswith("videos/ocean/intro.mp4")
+    assert agent.video_path_list["outro"].replace("\\", "/").endswith("videos/ocean/outro.mp4")
+    assert agent.video_path_list["idle"] == configured["idle"]
+    assert agent.video_path_list["lip_flap"] == configured["lip_flap"]
+    assert agent.video_path_list["intro"] in agent.video_player.media_pool
+    # And back
+    agent.switch_episode("lucky_shirt")
+    assert agent.video_path_list == configured
+
+
+def test_episode_without_question_banks_is_refused(agent):
+    agent.switch_episode("ocean")
+    with pytest.raises(ValueError, match="no question banks"):
+        agent.switch_episode("picnic")
+    assert agent.episode == "ocean" and len(agent.dialogues) == 3
+
+
+def test_new_session_starts_on_the_configured_episode(agent):
+    agent.switch_episode("ocean")
+    agent.new_session(7)
+    assert agent.episode == "lucky_shirt"
+    agent.run_pretest_program()
+    assert agent.position == {"section": "done"}
+    # The session's program_info.log names its episode (analytics.py)
+    utils.stop_queue_logging(agent.log_listener)
+    with open(agent.log_listener.handlers[0].baseFilename, encoding="utf-8") as f:
+        assert "parts of episode with base questions for lucky_shirt" in f.read()
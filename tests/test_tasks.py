@@ -0,0 +1,90 @@
+import concurrent.futures
+import threading
+
+import pytest
+
+import tasks
+from tasks import TaskExecutor, TaskFuture
+
+
+@pytest.fixture
+def executor():
+    executor = TaskExecutor(max_workers=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_result_and_stats(executor):
+    future = executor.submit("add", lambda a, b: a + b, 1, b=2)
+    assert future.result(timeout=2) == 3
+    future.join()
+    # Stats are recorded once the future is resolved
+    executor.shutdown()
+    stats = executor.stats()["add"]
+    assert stats["tasks"] == 1 and stats["failed"] == 0
+
+
+def test_exception_is_raised_by_join_and_result(executor):
+    def fail():
+        raise ValueError("TTS failed")
+
+    future = executor.submit("speak", fail)
+    with pytest.raises(ValueError, match="TTS failed"):
+        future.join(timeout=2)
+    with pytest.raises(ValueError):
+        future.result()
+    executor.shutdown()
+    assert executor.stats()["speak"]["failed"] == 1
+    assert "speak" in executor.report()
+
+
+def test_queued_task_can_be_cancelled(executor):
+    release = threading.Event()
+    running = executor.submit("block", release.wait, 2)
+    queued = executor.submit("queued", lambda: "never")
+    assert executor.queue_depth == 1
+    assert queued.cancel()
+    release.set()
+    running.join(timeout=2)
+    # Nothing to wait for, and no exception
+    queued.join(timeout=2)
+    assert queued.cancelled()
+    executor.shutdown()
+    assert executor.stats()["queued"]["cancelled"] == 1
+    assert executor.max_queue_depth == 1
+
+
+def test_default_timeout(executor):
+    release = threading.Event()
+    future = executor.submit("slow", release.wait, 2, timeout=0.05)
+    with pytest.raises(concurrent.futures.TimeoutError):
+        future.join()
+    release.set()
+    assert future.result(timeout=2) is True
+
+
+def test_running_names(executor):
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        started.set()
+        release.wait(2)
+
+    future = executor.submit("export_learning_history", work)
+    started.wait(2)
+    assert executor.running == ["export_learning_history"]
+    release.set()
+    future.join(timeout=2)
+    executor.shutdown()
+    assert executor.running == []
+
+
+def test_background_decorator():
+    @tasks.background("double")
+    def double(value):
+        return value * 2
+
+    future = double(21)
+    assert isinstance(future, TaskFuture)
+    assert future.name == "double"
+    assert future.result(timeout=2) == 42
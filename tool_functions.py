@@ -84,27 +84,23 @@ generate_question_function_json = {
 select_question_function_json = {
     "name": "select_question",
     "description": "Your goal is to help the child learn science knowledge from the given story dialogues by "
-                   "selecting an appropriate question from the question bank. You will be given a question bank, the "
-                   "targeted question level, and the child's learning history. Based on these information, the question"
-                   "selected should aid the child in learning more about the science concepts.",
+                   "selecting an appropriate question from the question bank. You will be given a question bank (one "
+                   "question per row: id|level|question), the targeted question level, and the child's learning "
+                   "history. Based on these information, the question selected should aid the child in learning more "
+                   "about the science concepts.",
     "parameters": {
         "type": "object",
         "properties": {
-            "question": {
-                "type": "string",
-                "description": "The selected question from the question bank."
-            },
-            "level": {
+            "question_id": {
                 "type": "string",
-                "description": "The level of the selected question.",
-                "enum": ["SHALLOW", "INTERMEDIATE", "DEEP"]
+                "description": "The id of the selected question, as written in the question bank."
             },
             "rationale": {
                 "type": "string",
                 "description": "The rationale for selecting the question based on learning history and the story."
             }
         },
-        "required": ["question", "level", "rationale"]
+        "required": ["question_id", "rationale"]
     }
 }
 
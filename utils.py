@@ -1,9 +1,18 @@
+import atexit
+import contextlib
 import json
+import logging
+import logging.handlers
 import os
+import queue
 import threading
 import time
-from openai import OpenAI
-from google.api_core import exceptions
+from typing import TYPE_CHECKING
+
+import tracing
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 def show_json(obj):
@@ -14,7 +23,7 @@ def load_json_response(obj):
     return json.loads(obj.model_dump_json())
 
 
-def list_all_assistant(client: OpenAI, concise=True):
+def list_all_assistant(client: "OpenAI", concise=True):
     assistant_data = client.beta.assistants.list().model_dump()
     concise_object_list = ["id", "name", "description", "instructions", "model", "temperature", "tools"]
     for assistant in assistant_data["data"]:
@@ -63,7 +72,9 @@ def time_logger(logger=None):
     def middle(func):
         def wrapper(*args, **kwargs):
             start = time.time()
-            result = func(*args, **kwargs)
+            # Also a span of the session trace when tracing is enabled
+            with tracing.span(func.__name__, "function"):
+                result = func(*args, **kwargs)
             log_msg = f"Function ({func.__name__}) took {(time.time() - start):.2f}s"
             if logger:
                 logger.debug(log_msg)
@@ -74,25 +85,120 @@ def time_logger(logger=None):
     return middle
 
 
-def multithread(func):
-    def wrapper(*args, **kwargs):
-        t = threading.Thread(target=func, args=args, kwargs=kwargs)
-        t.start()
-        return t
-    return wrapper
+class JsonLogFormatter(logging.Formatter):
+    # One JSON object per line: timestamp, level, thread, message + anything passed with extra={...}
+    _STANDARD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self._STANDARD_ATTRIBUTES})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    # queue.SimpleQueue is already thread-safe, skip the handler lock so logging threads never wait on each other
+    def handle(self, record):
+        keep = self.filter(record)
+        if keep:
+            self.emit(record)
+        return keep
+
+
+# Listeners not stopped yet (e.g. the kiosk's current session), one exit handler for all of them
+_running_listeners = set()
+_listeners_lock = threading.Lock()
+
+
+def attach_queue_logging(logger, handlers):
+    # The logger only puts records on a queue, a background listener thread does the file/console I/O of all handlers.
+    # Returns the listener, stop() flushes whatever is left in the queue
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    with _listeners_lock:
+        _running_listeners.add(listener)
+    return listener
+
+
+def stop_queue_logging(listener):
+    # Safe to call more than once
+    with _listeners_lock:
+        if listener not in _running_listeners:
+            return
+        _running_listeners.remove(listener)
+    listener.stop()
+
+
+@atexit.register
+def _stop_running_listeners():
+    # Records still queued when the program exits (or crashes) are written out
+    with _listeners_lock:
+        listeners = list(_running_listeners)
+    for listener in listeners:
+        stop_queue_logging(listener)
+
+
+class CompletedTask:
+    # Stand-in for a thread/video that has nothing to wait for (e.g. no video in terminal mode)
+    def join(self, timeout=None):
+        pass
+
+
+class StartupProfiler:
+    # Import and init time of each subsystem, reported with --profile-startup
+    def __init__(self):
+        self.records = []
+        self._starts = {}
+
+    def add(self, subsystem, phase, duration):
+        self.records.append((subsystem, phase, duration))
 
+    def start(self, subsystem, phase):
+        self._starts[(subsystem, phase)] = time.perf_counter()
 
-_GCS_RETRIABLE_TYPES = (
-   exceptions.TooManyRequests,  # 429
-   exceptions.InternalServerError,  # 500
-   exceptions.BadGateway,  # 502
-   exceptions.ServiceUnavailable,  # 503
-)
+    def stop(self, subsystem, phase):
+        self.add(subsystem, phase, time.perf_counter() - self._starts.pop((subsystem, phase)))
+
+    @contextlib.contextmanager
+    def measure(self, subsystem, phase):
+        self.start(subsystem, phase)
+        try:
+            yield
+        finally:
+            self.stop(subsystem, phase)
+
+    def report(self):
+        lines = ["Startup profile:", f"{'subsystem':<16}{'import':>10}{'init':>10}"]
+        totals = {"import": 0., "init": 0.}
+        subsystems = list(dict.fromkeys(subsystem for subsystem, _, _ in self.records))
+        for subsystem in subsystems:
+            durations = {phase: sum(d for s, p, d in self.records if s == subsystem and p == phase)
+                         for phase in totals}
+            for phase in totals:
+                totals[phase] += durations[phase]
+            lines.append(f"{subsystem:<16}{durations['import']:>9.3f}s{durations['init']:>9.3f}s")
+        lines.append(f"{'total':<16}{totals['import']:>9.3f}s{totals['init']:>9.3f}s")
+        return "\n".join(lines)
 
 
 def is_gcs_retryable(exc):
-    # Check if exception thrown is one of the defined exception above
-    return isinstance(exc, _GCS_RETRIABLE_TYPES)
+    # Check if exception thrown is one of the retriable Google Cloud errors
+    from google.api_core import exceptions
+    retriable_types = (
+        exceptions.TooManyRequests,  # 429
+        exceptions.InternalServerError,  # 500
+        exceptions.BadGateway,  # 502
+        exceptions.ServiceUnavailable,  # 503
+    )
+    return isinstance(exc, retriable_types)
 
 
 def generate_question_configuration(num_questions, difficulty_weights=None, max_score_answer=10):